@@ -1,72 +1,445 @@
 import os
+import re
 import sys
 import json
-import requests
+import time
+import queue
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import httpx
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-def generate_summary(text):
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+API_BASE = "https://generativelanguage.googleapis.com/v1beta/models"
+MODELS = [
+    "gemini-2.0-flash",
+    "gemini-flash-latest",
+    "gemini-pro-latest",
+    "gemini-2.0-flash-exp"
+]
+REQUEST_TIMEOUT_S = 30.0
+# At most this many models race at once (primary + hedge).
+MAX_IN_FLIGHT = 2
+# Hedge after ~2x the usual latency of the model we try first, within these bounds.
+HEDGE_MIN_S = 3.0
+HEDGE_MAX_S = 20.0
+# Transcripts above this size (estimated tokens) are summarized map-reduce style.
+MAP_REDUCE_MIN_TOKENS = int(os.getenv("SUMMARY_MAP_REDUCE_TOKENS") or 6000)
+CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS") or 3000)
+MAP_WORKERS = int(os.getenv("SUMMARY_MAP_WORKERS") or 4)
+# Bump when a prompt changes so cached summaries made with the old one are not reused.
+MAP_PROMPT_VERSION = 1
+SUMMARY_PROMPT_VERSION = 1
+# Cache eviction: entries unused for longer than this, then oldest first above the size cap.
+CACHE_MAX_AGE_S = float(os.getenv("SUMMARY_CACHE_MAX_AGE_DAYS") or 30) * 86400.0
+CACHE_MAX_BYTES = int(float(os.getenv("SUMMARY_CACHE_MAX_MB") or 50) * 1024 * 1024)
+
+# "SPEAKER_00:", "Psicólogo: texto" ... starts a new speaker turn.
+_TURN_RE = re.compile(r"^\s*([^\s:\[\]][^:\[\]\n]{0,39}):\s*(.*)$")
+_SENTENCE_RE = re.compile(r"(?<=[.!?…])\s+")
+
+_client = None
+_client_lock = threading.Lock()
+_state_lock = threading.Lock()
+
+
+def cache_dir():
+    return Path(os.getenv("SUMMARY_CACHE_DIR") or (PROJECT_ROOT / "outputs" / ".summary_cache"))
+
+
+def _state_path():
+    return cache_dir() / "model_state.json"
+
+
+def _http_client():
+    # One pooled client per process: keep-alive, and HTTP/2 multiplexing when `h2` is installed.
+    global _client
+    with _client_lock:
+        if _client is None:
+            kwargs = dict(
+                timeout=httpx.Timeout(REQUEST_TIMEOUT_S, connect=10.0),
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60.0),
+            )
+            try:
+                _client = httpx.Client(http2=True, **kwargs)
+            except ImportError:
+                _client = httpx.Client(**kwargs)
+        return _client
+
+
+def _read_cache(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            entry = json.load(f)
+    except Exception:
+        return None
+    if not isinstance(entry, dict) or not entry.get("summary"):
+        return None
+    try:
+        # mtime doubles as "last used" for eviction.
+        os.utime(path, None)
+    except OSError:
+        pass
+    return entry
+
+
+def _write_cache(path, entry):
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(dict(entry, created_at=time.time()), f, ensure_ascii=False)
+        os.replace(tmp, path)
+    except Exception:
+        pass
+
+
+def evict_cache(max_age_s=CACHE_MAX_AGE_S, max_bytes=CACHE_MAX_BYTES):
+    """Drops summary/chunk entries unused for `max_age_s`, then the least recently used above `max_bytes`."""
+    now = time.time()
+    entries = []
+    for sub in ("summaries", "chunks"):
+        for f in (cache_dir() / sub).glob("*.json"):
+            try:
+                st = f.stat()
+            except OSError:
+                continue
+            if now - st.st_mtime > max_age_s:
+                f.unlink(missing_ok=True)
+            else:
+                entries.append((st.st_mtime, st.st_size, f))
+    total = sum(size for _, size, _ in entries)
+    for _, size, f in sorted(entries, key=lambda e: e[0]):
+        if total <= max_bytes:
+            break
+        f.unlink(missing_ok=True)
+        total -= size
+
+
+def _load_state():
+    try:
+        with open(_state_path(), "r", encoding="utf-8") as f:
+            state = json.load(f)
+        if isinstance(state, dict):
+            return state
+    except Exception:
+        pass
+    return {"last_good": None, "models": {}}
+
+
+def _record_attempt(model, ok, elapsed_ms):
+    # Shared by every summary process, so the next one starts with the model that last worked.
+    with _state_lock:
+        state = _load_state()
+        m = state.setdefault("models", {}).setdefault(model, {"ok": 0, "fail": 0, "ema_ms": None})
+        if ok:
+            m["ok"] += 1
+            m["ema_ms"] = round(elapsed_ms if m["ema_ms"] is None else 0.7 * m["ema_ms"] + 0.3 * elapsed_ms, 1)
+            state["last_good"] = model
+        else:
+            m["fail"] += 1
+        try:
+            path = _state_path()
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(state, f)
+            os.replace(tmp, path)
+        except Exception:
+            pass
+
+
+def _model_order(state):
+    last_good = state.get("last_good")
+    order = [last_good] if last_good in MODELS else []
+    return order + [m for m in MODELS if m not in order]
+
+
+def _hedge_delay_s(state, model):
+    env_ms = os.getenv("SUMMARY_HEDGE_MS")
+    if env_ms:
+        try:
+            return max(0.0, float(env_ms) / 1000.0)
+        except ValueError:
+            pass
+    ema_ms = ((state.get("models") or {}).get(model) or {}).get("ema_ms")
+    if not ema_ms:
+        return HEDGE_MAX_S
+    return min(HEDGE_MAX_S, max(HEDGE_MIN_S, 2.0 * ema_ms / 1000.0))
+
+
+def _generate_once(model, prompt_text, api_key):
+    payload = {
+        "contents": [{
+            "parts": [{"text": prompt_text}]
+        }]
+    }
+    response = _http_client().post(
+        f"{API_BASE}/{model}:generateContent",
+        headers={"Content-Type": "application/json", "x-goog-api-key": api_key},
+        json=payload,
+    )
+    if response.status_code != 200:
+        raise RuntimeError(f"Model {model} error {response.status_code}: {response.text[:500]}")
+    data = response.json()
+    try:
+        return data['candidates'][0]['content']['parts'][0]['text'].strip()
+    except (KeyError, IndexError, TypeError):
+        # Maybe safety blocked?
+        raise RuntimeError(f"Model {model} returned invalid format: {str(data)[:500]}")
+
+
+def call_gemini(prompt_text, api_key):
+    """Hedged call: the first model gets a head start, a backup model is fired if it is slow
+    and the next one right away if it fails. The first good answer wins."""
+    state = _load_state()
+    pending = _model_order(state)
+    hedge_after = _hedge_delay_s(state, pending[0])
+    results = queue.Queue()
+    errors = []
+    attempts = []
+    running = 0
+
+    def worker(model):
+        t0 = time.perf_counter()
+        try:
+            text, err = _generate_once(model, prompt_text, api_key), None
+        except Exception as e:
+            text, err = None, str(e)
+        results.put((model, text, err, (time.perf_counter() - t0) * 1000.0))
+
+    def launch():
+        nonlocal running
+        model = pending.pop(0)
+        attempts.append(model)
+        running += 1
+        # Daemon threads: a losing request must not keep the process alive after we answer.
+        threading.Thread(target=worker, args=(model,), daemon=True).start()
+
+    launch()
+    while running:
+        can_hedge = bool(pending) and running < MAX_IN_FLIGHT
+        try:
+            model, text, err, elapsed_ms = results.get(timeout=hedge_after if can_hedge else None)
+        except queue.Empty:
+            launch()
+            continue
+        running -= 1
+        _record_attempt(model, bool(text), elapsed_ms)
+        if text:
+            return {"ok": True, "text": text, "model": model, "attempts": attempts}
+        errors.append(err)
+        if pending and running < MAX_IN_FLIGHT:
+            launch()
+
+    return {"ok": False, "error": f"All models failed. Last error: {errors[-1] if errors else None}", "attempts": attempts}
+
+
+def estimate_tokens(text):
+    # ~4 characters per token for Spanish prose; good enough to size chunks.
+    return (len(text or "") + 3) // 4
+
+
+def split_turns(text):
+    """Speaker turns when the transcript has one turn per line, else sentences."""
+    lines = [ln for ln in (text or "").splitlines() if ln.strip()]
+    if len(lines) <= 1:
+        return [s for s in _SENTENCE_RE.split((text or "").strip()) if s]
+    turns = []
+    for ln in lines:
+        if _TURN_RE.match(ln) or not turns:
+            turns.append(ln.strip())
+        else:
+            turns[-1] += " " + ln.strip()
+    return turns
+
+
+def _hard_cut(text, max_chars):
+    """Cuts `text` into pieces of at most `max_chars`, at the last space when there is one."""
+    pieces = []
+    while len(text) > max_chars:
+        cut = text.rfind(" ", 0, max_chars + 1)
+        if cut <= 0:
+            cut = max_chars
+        pieces.append(text[:cut].strip())
+        text = text[cut:].strip()
+    if text:
+        pieces.append(text)
+    return [p for p in pieces if p]
+
+
+def split_long_turn(turn, max_tokens):
+    """Splits a turn over `max_tokens` into sentence groups, hard-cutting a sentence that alone is too long.
+
+    Each piece keeps the speaker label so a chunk that starts mid-turn still says who is talking.
+    """
+    if estimate_tokens(turn) <= max_tokens:
+        return [turn]
+    m = _TURN_RE.match(turn)
+    prefix, body = (f"{m.group(1)}: ", m.group(2)) if m else ("", turn)
+    if estimate_tokens(prefix) * 2 > max_tokens:
+        prefix, body = "", turn
+    max_chars = max(1, max_tokens * 4 - len(prefix))
+
+    pieces, cur = [], ""
+    for sentence in _SENTENCE_RE.split(body.strip()):
+        for part in _hard_cut(sentence, max_chars):
+            joined = f"{cur} {part}" if cur else part
+            if cur and estimate_tokens(prefix + joined) > max_tokens:
+                pieces.append(cur)
+                joined = part
+            cur = joined
+    if cur:
+        pieces.append(cur)
+    return [prefix + p for p in pieces]
+
+
+def chunk_transcript(text, max_tokens=CHUNK_TOKENS):
+    """Packs whole turns into chunks of at most `max_tokens`; a longer turn is split first (split_long_turn)."""
+    chunks = []
+    cur, cur_tokens = [], 0
+    pieces = [p for turn in split_turns(text) for p in split_long_turn(turn, max_tokens)]
+    for piece in pieces:
+        t = estimate_tokens(piece)
+        if cur and cur_tokens + t > max_tokens:
+            chunks.append("\n".join(cur))
+            cur, cur_tokens = [], 0
+        cur.append(piece)
+        cur_tokens += t
+    if cur:
+        chunks.append("\n".join(cur))
+    return chunks
+
+
+def _chunk_cache_path(chunk):
+    key = hashlib.sha1(f"map-v{MAP_PROMPT_VERSION}\n{chunk}".encode("utf-8")).hexdigest()
+    return cache_dir() / "chunks" / f"{key}.json"
+
+
+def _summarize_chunk(chunk, index, total, api_key):
+    path = _chunk_cache_path(chunk)
+    cached = _read_cache(path)
+    if cached:
+        return {"ok": True, "text": cached["summary"], "model": cached.get("model"), "cached": True}
+
+    prompt_text = f"""
+    Actúa como un psicólogo clínico. El siguiente texto es la parte {index} de {total} de la transcripción de una sesión de terapia.
+
+    Extrae en viñetas breves (máximo 120 palabras) lo relevante reportado por el paciente en esta parte: quejas, emociones, pensamientos clave, eventos y personas mencionadas.
+    No escribas introducción ni conclusiones.
+
+    Transcripción (parte {index}/{total}):
+    {chunk}
+
+    Puntos relevantes:
+    """
+    result = call_gemini(prompt_text, api_key)
+    if result["ok"]:
+        _write_cache(path, {"summary": result["text"], "model": result["model"]})
+    return dict(result, cached=False)
+
+
+def generate_summary_chunked(text, api_key):
+    """Map: summarize token-bounded groups of turns concurrently (cached per chunk).
+    Reduce: merge the partial summaries into the final 250-word summary."""
+    chunks = chunk_transcript(text)
+    with ThreadPoolExecutor(max_workers=max(1, MAP_WORKERS)) as pool:
+        partials = list(pool.map(
+            lambda ic: _summarize_chunk(ic[1], ic[0], len(chunks), api_key),
+            enumerate(chunks, 1),
+        ))
+
+    failed = [i for i, p in enumerate(partials, 1) if not p["ok"]]
+    if failed:
+        # Finished chunks stay cached, so a retry only recomputes these.
+        return {
+            "ok": False,
+            "error": f"Failed to summarize parts {failed} of {len(chunks)}. Last error: {partials[failed[-1] - 1].get('error')}",
+        }
+
+    joined = "\n\n".join(f"Parte {i}:\n{p['text']}" for i, p in enumerate(partials, 1))
+    prompt_text = f"""
+    Actúa como un psicólogo clínico. A continuación tienes los puntos relevantes de cada parte de una sesión de terapia, en orden.
+
+    Tarea:
+    1. Integra la información más relevante reportada por el paciente (quejas, emociones, pensamientos clave).
+    2. Genera un resumen conciso (máximo 250 palabras) utilizando un lenguaje profesional y objetivo.
+
+    Puntos por parte:
+    {joined}
+
+    Resumen:
+    """
+    result = call_gemini(prompt_text, api_key)
+    if not result["ok"]:
+        return {"ok": False, "error": result["error"]}
+    return {
+        "ok": True,
+        "summary": result["text"],
+        "model": result["model"],
+        "mode": "map_reduce",
+        "chunks": len(chunks),
+        "chunks_cached": sum(1 for p in partials if p.get("cached")),
+    }
+
+
+def _summary_cache_path(text, chunked):
+    # Transcript + prompt versions: either changing means a different summary. The model that
+    # answered is stored in the entry; editing or reordering MODELS does not invalidate it.
+    key_src = "\n".join([
+        f"summary-v{SUMMARY_PROMPT_VERSION}",
+        f"map-v{MAP_PROMPT_VERSION}" if chunked else "single",
+        text,
+    ])
+    return cache_dir() / "summaries" / f"{hashlib.sha1(key_src.encode('utf-8')).hexdigest()}.json"
+
+
+def generate_summary(text, chunked=None, use_cache=True):
+    if chunked is None:
+        chunked = estimate_tokens(text) > MAP_REDUCE_MIN_TOKENS
+
+    path = _summary_cache_path(text, chunked)
+    cached = _read_cache(path) if use_cache else None
+    if cached:
+        return dict(cached.get("result") or {}, ok=True, summary=cached["summary"], model=cached.get("model"), cached=True)
+
     api_key = os.getenv("GOOGLE_API_KEY") or os.getenv("GEMINI_API_KEY")
-    
+
     if not api_key:
         return {"ok": False, "error": "Google API Key not found in environment variables"}
 
-    headers = {
-        "Content-Type": "application/json"
-    }
+    result = generate_summary_chunked(text, api_key) if chunked else _generate_summary_single(text, api_key)
+    if result.get("ok"):
+        extra = {k: v for k, v in result.items() if k in ("mode", "chunks")}
+        _write_cache(path, {"summary": result["summary"], "model": result.get("model"), "result": extra})
+        evict_cache()
+    return dict(result, cached=False)
+
 
+def _generate_summary_single(text, api_key):
     prompt_text = f"""
     Actúa como un psicólogo clínico. Analiza la siguiente transcripción de una sesión de terapia y proporciona un resumen profesional.
-    
+
     Tarea:
     1. Identifica la información más relevante reportada por el paciente (quejas, emociones, pensamientos clave).
     2. Genera un resumen conciso (máximo 250 palabras) utilizando un lenguaje profesional y objetivo.
-    
+
     Transcripción:
     {text}
-    
+
     Resumen:
     """
-    
-    payload = {
-        "contents": [{
-            "parts": [{"text": prompt_text}]
-        }]
-    }
 
-    models_to_try = [
-        "gemini-2.0-flash", 
-        "gemini-flash-latest", 
-        "gemini-pro-latest",
-        "gemini-2.0-flash-exp"
-    ]
-    last_error = None
-
-    for model in models_to_try:
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={api_key}"
-        try:
-            response = requests.post(url, headers=headers, json=payload, timeout=30)
-            
-            if response.status_code == 200:
-                data = response.json()
-                try:
-                    summary = data['candidates'][0]['content']['parts'][0]['text']
-                    return {"ok": True, "summary": summary.strip()}
-                except (KeyError, IndexError):
-                     # Maybe safety blocked?
-                     last_error = f"Model {model} returned invalid format: {str(data)}"
-                     continue
-            else:
-                 last_error = f"Model {model} error {response.status_code}: {response.text}"
-                 continue
-
-        except Exception as e:
-            last_error = str(e)
-            continue
-            
-    return {"ok": False, "error": f"All models failed. Last error: {last_error}"}
+    result = call_gemini(prompt_text, api_key)
+    if not result["ok"]:
+        return {"ok": False, "error": result["error"]}
+    return {"ok": True, "summary": result["text"], "model": result["model"]}
 
 if __name__ == "__main__":
     try:
@@ -74,13 +447,19 @@ if __name__ == "__main__":
         if sys.platform == "win32":
             sys.stdin.reconfigure(encoding='utf-8')
 
+        # --chunked / --single force the mode; by default long transcripts go map-reduce.
+        # --no-cache recomputes even if this transcript was already summarized.
+        args = [a for a in sys.argv[1:] if a not in ("--chunked", "--single", "--no-cache")]
+        chunked = True if "--chunked" in sys.argv else (False if "--single" in sys.argv else None)
+        use_cache = "--no-cache" not in sys.argv
+
         input_text = ""
-        if len(sys.argv) > 1:
-            if os.path.isfile(sys.argv[1]):
-                with open(sys.argv[1], 'r', encoding='utf-8') as f:
+        if args:
+            if os.path.isfile(args[0]):
+                with open(args[0], 'r', encoding='utf-8') as f:
                     input_text = f.read()
             else:
-                input_text = sys.argv[1]
+                input_text = args[0]
         else:
             input_text = sys.stdin.read()
 
@@ -88,9 +467,9 @@ if __name__ == "__main__":
              print(json.dumps({"ok": False, "error": "No input text provided"}))
              sys.exit(1)
 
-        result = generate_summary(input_text)
+        result = generate_summary(input_text, chunked=chunked, use_cache=use_cache)
         print(json.dumps(result))
-        
+
     except Exception as e:
         print(json.dumps({"ok": False, "error": f"Script error: {str(e)}"}))
         sys.exit(1)
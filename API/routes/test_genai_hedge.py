@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for the hedged Gemini call (genai_summary.call_gemini).
+
+_generate_once is replaced by per-model stubs that block on events, and the
+result queue's timed wait is replaced by one that reports the hedge timeout
+and gives up at once, so every race has a fixed outcome. No network is used.
+
+    python -m pytest API/routes/test_genai_hedge.py
+"""
+
+import json
+import queue
+import sys
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+import genai_summary
+
+MODELS = ["m-a", "m-b", "m-c", "m-d"]
+
+
+class _InstantTimeoutQueue(queue.Queue):
+    """A timed get() returns a ready result or raises Empty immediately, recording the timeout it was given."""
+
+    waits = []
+
+    def get(self, block=True, timeout=None):
+        if timeout is None:
+            return super().get(block=block)
+        try:
+            return super().get_nowait()
+        except queue.Empty:
+            self.waits.append(timeout)
+            raise
+
+
+class _Models:
+    """_generate_once stub: each model waits for its `release` event, then answers or raises."""
+
+    def __init__(self, behaviour):
+        self.behaviour = behaviour
+        self.release = {m: threading.Event() for m in MODELS}
+        self.started = {m: threading.Event() for m in MODELS}
+        self.finished = {m: threading.Event() for m in MODELS}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, model, prompt_text, api_key):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        self.started[model].set()
+        try:
+            self.release[model].wait(5)
+            outcome = self.behaviour[model]
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            self.finished[model].set()
+
+
+@pytest.fixture
+def hedge(tmp_path, monkeypatch):
+    monkeypatch.setenv("SUMMARY_CACHE_DIR", str(tmp_path))
+    monkeypatch.delenv("SUMMARY_HEDGE_MS", raising=False)
+    monkeypatch.setattr(genai_summary, "MODELS", list(MODELS))
+    monkeypatch.setattr(_InstantTimeoutQueue, "waits", [])
+    monkeypatch.setattr(genai_summary, "queue", SimpleNamespace(Queue=_InstantTimeoutQueue, Empty=queue.Empty))
+
+    def _install(behaviour, state=None):
+        if state is not None:
+            (tmp_path / "model_state.json").write_text(json.dumps(state), encoding="utf-8")
+        models = _Models(behaviour)
+        monkeypatch.setattr(genai_summary, "_generate_once", models)
+        return models
+
+    return _install
+
+
+def _state():
+    return genai_summary._load_state()
+
+
+def test_hedge_delay_follows_ema():
+    """The hedge fires after twice the model's EMA latency, within HEDGE_MIN_S..HEDGE_MAX_S"""
+    state = {"models": {"fast": {"ema_ms": 500}, "mid": {"ema_ms": 4000}, "slow": {"ema_ms": 60000}}}
+    assert genai_summary._hedge_delay_s(state, "fast") == genai_summary.HEDGE_MIN_S
+    assert genai_summary._hedge_delay_s(state, "mid") == 8.0
+    assert genai_summary._hedge_delay_s(state, "slow") == genai_summary.HEDGE_MAX_S
+    assert genai_summary._hedge_delay_s(state, "unknown") == genai_summary.HEDGE_MAX_S
+
+
+def test_hedge_delay_env_override(monkeypatch):
+    """SUMMARY_HEDGE_MS overrides the EMA; an invalid value is ignored"""
+    state = {"models": {"mid": {"ema_ms": 4000}}}
+    monkeypatch.setenv("SUMMARY_HEDGE_MS", "250")
+    assert genai_summary._hedge_delay_s(state, "mid") == 0.25
+    monkeypatch.setenv("SUMMARY_HEDGE_MS", "rápido")
+    assert genai_summary._hedge_delay_s(state, "mid") == 8.0
+
+
+def test_slow_primary_is_hedged_and_abandoned(hedge):
+    """A slow last-good model gets a backup after its hedge delay; the backup wins and the loser is not recorded"""
+    models = hedge({"m-a": RuntimeError("Model m-a error 500"), "m-b": "texto b", "m-c": "tarde", "m-d": "texto d"},
+                   state={"last_good": "m-c", "models": {"m-c": {"ok": 3, "fail": 0, "ema_ms": 4000.0}}})
+    models.release["m-a"].set()
+    models.release["m-b"].set()
+
+    result = genai_summary.call_gemini("prompt", "key")
+    # m-c (last good) started first; the hedge waited 2 x 4000 ms, then m-a failed and m-b answered.
+    assert _InstantTimeoutQueue.waits == [8.0]
+    assert result == {"ok": True, "text": "texto b", "model": "m-b", "attempts": ["m-c", "m-a", "m-b"]}
+    assert models.max_in_flight <= genai_summary.MAX_IN_FLIGHT
+    assert not models.started["m-d"].is_set()
+
+    # The losing request finishes later; nothing reads or records its answer.
+    models.release["m-c"].set()
+    assert models.finished["m-c"].wait(5)
+    state = _state()
+    assert state["last_good"] == "m-b"
+    assert state["models"]["m-c"] == {"ok": 3, "fail": 0, "ema_ms": 4000.0}
+    assert state["models"]["m-a"]["fail"] == 1 and state["models"]["m-b"]["ok"] == 1
+
+
+def test_at_most_two_requests_in_flight(hedge):
+    """With two requests pending no third is started until one of them fails"""
+    models = hedge({"m-a": "tarde", "m-b": RuntimeError("Model m-b error 503"), "m-c": "texto c", "m-d": "texto d"})
+
+    third_started_early = []
+
+    def _fail_b_once_both_run():
+        models.started["m-b"].wait(5)
+        third_started_early.append(models.started["m-c"].is_set())
+        models.release["m-b"].set()
+        models.started["m-c"].wait(5)
+        models.release["m-c"].set()
+
+    helper = threading.Thread(target=_fail_b_once_both_run)
+    helper.start()
+    result = genai_summary.call_gemini("prompt", "key")
+    helper.join(5)
+
+    # No state yet: the hedge waits HEDGE_MAX_S, then m-b runs beside m-a; m-c only replaces m-b.
+    assert _InstantTimeoutQueue.waits == [genai_summary.HEDGE_MAX_S]
+    assert result["ok"] and result["model"] == "m-c" and result["attempts"] == ["m-a", "m-b", "m-c"]
+    assert third_started_early == [False] and models.max_in_flight == 2
+    assert not models.started["m-d"].is_set()
+    models.release["m-a"].set()
+    assert models.finished["m-a"].wait(5)
+
+
+def test_all_models_fail(hedge):
+    """Every model failing returns the last error and counts each failure"""
+    models = hedge({m: RuntimeError(f"Model {m} error 429") for m in MODELS})
+    for m in MODELS:
+        models.release[m].set()
+    result = genai_summary.call_gemini("prompt", "key")
+    assert not result["ok"] and result["attempts"] == MODELS
+    assert "error 429" in result["error"]
+    state = _state()
+    assert state["last_good"] is None
+    assert all(state["models"][m]["fail"] == 1 for m in MODELS)
+
+
+def test_model_state_ema_is_persisted(hedge):
+    """Each success updates last_good and the latency EMA (0.7 old + 0.3 new) in model_state.json"""
+    genai_summary._record_attempt("m-b", True, 1000.0)
+    genai_summary._record_attempt("m-b", True, 2000.0)
+    genai_summary._record_attempt("m-a", False, 50.0)
+    state = json.loads(genai_summary._state_path().read_text(encoding="utf-8"))
+    assert state["last_good"] == "m-b"
+    assert state["models"]["m-b"] == {"ok": 2, "fail": 0, "ema_ms": 1300.0}
+    assert state["models"]["m-a"] == {"ok": 0, "fail": 1, "ema_ms": None}
+    assert genai_summary._model_order(state) == ["m-b", "m-a", "m-c", "m-d"]
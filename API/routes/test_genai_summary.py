@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for the map-reduce session summary (genai_summary.py).
+
+Covers how transcripts are cut into chunks and how the partial summaries are
+merged. Gemini is replaced by a local function, so no API key is used.
+
+    python -m pytest API/routes/test_genai_summary.py
+"""
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+os.environ["SUMMARY_CACHE_DIR"] = tempfile.mkdtemp(prefix="summary_cache_test_")
+
+import genai_summary
+from genai_summary import chunk_transcript, estimate_tokens, split_long_turn, split_turns
+
+
+def _transcript(n_turns):
+    speakers = ["Psicólogo", "Paciente"]
+    return "\n".join(
+        f"{speakers[i % 2]}: turno {i} " + "palabra " * (5 + (i * 7) % 40)
+        for i in range(n_turns)
+    )
+
+
+def test_split_turns():
+    """One turn per speaker line; continuation lines join the previous turn"""
+    text = "Paciente: hola.\nsigo hablando\n\nPsicólogo: ¿y luego?\n[ruido]\nPaciente: nada más."
+    assert split_turns(text) == [
+        "Paciente: hola. sigo hablando",
+        "Psicólogo: ¿y luego? [ruido]",
+        "Paciente: nada más.",
+    ]
+    # Without line breaks (plain Whisper output), sentences are the units.
+    assert split_turns("Uno. Dos? Tres… Cuatro") == ["Uno.", "Dos?", "Tres…", "Cuatro"]
+
+
+def test_chunks_stay_within_budget():
+    """Chunks are turns in order, each chunk within max_tokens; only turns over the budget are split"""
+    text = _transcript(200)
+    turns = split_turns(text)
+    for max_tokens in (30, 100, 500, 100000):
+        chunks = chunk_transcript(text, max_tokens=max_tokens)
+        pieces = [t for c in chunks for t in c.split("\n")]
+        assert pieces == [p for t in turns for p in split_long_turn(t, max_tokens)], max_tokens
+        assert all(t in pieces for t in turns if estimate_tokens(t) <= max_tokens), max_tokens
+        for c in chunks:
+            assert sum(estimate_tokens(t) for t in c.split("\n")) <= max_tokens, (max_tokens, c)
+        # Greedy packing: the next piece would not have fit in the previous chunk.
+        for prev, nxt in zip(chunks, chunks[1:]):
+            used = sum(estimate_tokens(t) for t in prev.split("\n"))
+            assert used + estimate_tokens(nxt.split("\n")[0]) > max_tokens
+    assert len(chunk_transcript(text, max_tokens=100000)) == 1
+
+
+def test_long_turn_is_split_by_sentences():
+    """A turn longer than max_tokens is split on sentences, keeping the speaker label"""
+    sentences = [f"Frase número {i} sobre lo que pasó con mi padre." for i in range(30)]
+    long_turn = "Paciente: " + " ".join(sentences)
+    text = f"Psicólogo: ¿cómo estás?\n{long_turn}\nPsicólogo: entiendo."
+    chunks = chunk_transcript(text, max_tokens=50)
+    assert all(estimate_tokens(c) <= 50 for c in chunks), chunks
+    assert chunks[0].startswith("Psicólogo: ¿cómo estás?") and chunks[-1].endswith("Psicólogo: entiendo.")
+    pieces = split_long_turn(long_turn, 50)
+    assert len(pieces) > 1 and all(p.startswith("Paciente: ") for p in pieces)
+    # Cuts fall between sentences and nothing is lost.
+    assert all(p.endswith(".") for p in pieces)
+    assert " ".join(p[len("Paciente: "):] for p in pieces) == " ".join(sentences)
+    assert chunk_transcript("", max_tokens=50) == []
+
+
+def test_sentence_over_budget_is_hard_cut():
+    """A single sentence over max_tokens is cut at spaces, or mid-word when there are none"""
+    long_turn = "Paciente: " + "muy " * 200
+    pieces = split_long_turn(long_turn, 50)
+    assert len(pieces) > 1 and all(estimate_tokens(p) <= 50 for p in pieces)
+    assert " ".join(p[len("Paciente: "):] for p in pieces) == long_turn[len("Paciente: "):].strip()
+
+    word = "a" * 1000
+    pieces = split_long_turn(word, 50)
+    assert all(estimate_tokens(p) <= 50 for p in pieces) and "".join(pieces) == word
+
+
+def test_map_reduce_merges_parts_in_order():
+    """Partial summaries reach the reduce prompt in transcript order; chunks are cached"""
+    prompts = []
+
+    def _fake_gemini(prompt_text, api_key):
+        prompts.append(prompt_text)
+        if "Puntos por parte:" in prompt_text:
+            return {"ok": True, "text": "resumen final", "model": "fake"}
+        first_turn = prompt_text.split("Transcripción (parte ", 1)[1].split("\n", 2)[1].strip()
+        return {"ok": True, "text": f"puntos de {first_turn.split(' palabra')[0]}", "model": "fake"}
+
+    saved = genai_summary.call_gemini
+    genai_summary.call_gemini = _fake_gemini
+    try:
+        text = _transcript(400)
+        chunks = chunk_transcript(text)
+        assert len(chunks) > 2
+        result = genai_summary.generate_summary_chunked(text, "test-key")
+        assert result["ok"] and result["summary"] == "resumen final", result
+        assert result["chunks"] == len(chunks) and result["chunks_cached"] == 0
+
+        reduce_prompt = prompts[-1]
+        positions = [reduce_prompt.index(f"Parte {i}:\npuntos de {c.split(chr(10))[0].split(' palabra')[0]}")
+                     for i, c in enumerate(chunks, 1)]
+        assert positions == sorted(positions)
+
+        prompts.clear()
+        again = genai_summary.generate_summary_chunked(text, "test-key")
+        assert again["chunks_cached"] == len(chunks) and len(prompts) == 1
+    finally:
+        genai_summary.call_gemini = saved
+
+
+
+def test_summary_cache_survives_model_list_changes(monkeypatch):
+    """The summary cache keys on the transcript and prompt versions, not on MODELS"""
+    calls = []
+
+    def _fake_gemini(prompt_text, api_key):
+        calls.append(prompt_text)
+        return {"ok": True, "text": "resumen", "model": "gemini-2.0-flash"}
+
+    monkeypatch.setattr(genai_summary, "call_gemini", _fake_gemini)
+    monkeypatch.setenv("GEMINI_API_KEY", "test-key")
+    text = "Paciente: hoy dormí mal otra vez."
+    first = genai_summary.generate_summary(text, chunked=False)
+    assert first["ok"] and not first["cached"] and len(calls) == 1
+
+    monkeypatch.setattr(genai_summary, "MODELS", list(reversed(genai_summary.MODELS)) + ["gemini-nuevo"])
+    again = genai_summary.generate_summary(text, chunked=False)
+    assert again["cached"] and again["model"] == "gemini-2.0-flash" and len(calls) == 1
+
+    monkeypatch.setattr(genai_summary, "SUMMARY_PROMPT_VERSION", genai_summary.SUMMARY_PROMPT_VERSION + 1)
+    assert not genai_summary.generate_summary(text, chunked=False)["cached"] and len(calls) == 2
@@ -3663,7 +3663,7 @@ async function openSessionDetail(sessionIndex, patientId) {
                         search_query: searchQuery,
                         out_top: 5,
                         k: 8,
-                        top_n: 40,
+                        // top_n omitted: the backend picks 12 with the hybrid lexical index, 40 without it.
                         collection: 'rag_ics_enfermedadesmundiales'
                     })
                 });
@@ -3725,7 +3725,7 @@ async function openSessionDetail(sessionIndex, patientId) {
                         const rr = await fetch(`${API_BASE}/api/icd11/score`, {
                             method: 'POST',
                             headers: { 'Content-Type': 'application/json' },
-                            body: JSON.stringify({ clinical_text: clinicalText, search_query: subjetivo, out_top: 5, k: 8, top_n: 40, collection: picked })
+                            body: JSON.stringify({ clinical_text: clinicalText, search_query: subjetivo, out_top: 5, k: 8, collection: picked })
                         });
                         const dd = await rr.json().catch(() => null);
                         if (rr.ok && dd && dd.ok) {
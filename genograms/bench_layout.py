@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark de los layouts del genograma sobre familias sintéticas.
+
+Genera familias de tamaño creciente (parejas que se casan con personas de
+fuera de la familia, varios hijos, separaciones con segundas parejas y
+padres solteros) y compara `_calculate_positions_simple` con
+`_calculate_positions_layered`:
+
+    layout_ms     organizar generaciones + calcular posiciones (mediana)
+    crossings     cruces entre líneas padre-hijo de generaciones contiguas
+                  (una línea por hijo, desde el punto medio de sus padres)
+    long_edges    hijos cuyos padres no están todos en la generación de arriba
+    width         ancho del lienzo en px
+    center_err    distancia media en px entre el centro de cada pareja/padre
+                  y el centro de sus hijos
+
+No llama a Gemini ni escribe HTML.
+
+Uso:
+    python genograms/bench_layout.py [--sizes 25,50,100,250,500,1000] [--repeats 5] [--seed 7]
+"""
+
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from genogram_model import FamilyGraph, GenogramGenerator, _count_inversions
+
+ICON_SIZE, SPACING_X, SPACING_Y, COUPLE_SPACING, START_X, START_Y = 50, 180, 180, 120, 100, 100
+
+
+def synthetic_family(n: int, seed: int = 7) -> Dict:
+    """Familia de ~n personas: un linaje que crece por generaciones."""
+    rnd = random.Random(seed * 100003 + n)
+    personas: List[Dict] = []
+    relaciones: List[Dict] = []
+
+    def person(gen: str) -> str:
+        pid = f"p{len(personas)}"
+        personas.append({'id': pid, 'nombre': pid.upper(), 'genero': gen, 'edad': rnd.randint(1, 90)})
+        return pid
+
+    founders = [person('masculino'), person('femenino')]
+    relaciones.append({'tipo': 'pareja', 'persona1_id': founders[0], 'persona2_id': founders[1], 'estado_civil': 'casados'})
+    generation = [tuple(founders)]
+    while len(personas) < n:
+        next_generation = []
+        for couple in generation:
+            for _ in range(rnd.randint(1, 4)):
+                if len(personas) >= n:
+                    break
+                child = person(rnd.choice(['masculino', 'femenino']))
+                for parent in couple:
+                    relaciones.append({'tipo': 'padre-hijo', 'persona1_id': parent, 'persona2_id': child})
+                roll = rnd.random()
+                if roll < 0.65 and len(personas) < n:
+                    spouse = person('femenino' if personas[-1]['genero'] == 'masculino' else 'masculino')
+                    relaciones.append({'tipo': 'pareja', 'persona1_id': child, 'persona2_id': spouse,
+                                       'estado_civil': rnd.choice(['casados', 'union_libre', 'divorciado'])})
+                    next_generation.append((child, spouse))
+                    if rnd.random() < 0.15 and len(personas) < n:
+                        second = person(personas[-1]['genero'])
+                        relaciones.append({'tipo': 'pareja', 'persona1_id': child, 'persona2_id': second, 'estado_civil': 'casados'})
+                        next_generation.append((child, second))
+                elif roll < 0.75:
+                    next_generation.append((child,))
+        if not next_generation:
+            next_generation = [(personas[-1]['id'],)]
+        generation = next_generation
+    personas[0]['condiciones'] = ['consultante']
+    return {'personas': personas, 'relaciones': relaciones}
+
+
+def layout_quality(posiciones: Dict, graph: FamilyGraph) -> Dict:
+    levels = sorted({p['y'] for p in posiciones.values()})
+    above = {b: a for a, b in zip(levels, levels[1:])}
+    by_level: Dict[float, List[tuple]] = {}
+    errors = []
+    split = 0
+    for child, parents in graph.parents.items():
+        placed = [p for p in parents if p in posiciones]
+        if child not in posiciones or not placed:
+            continue
+        # The renderer draws one line per child from the middle of its parents.
+        src = sum(posiciones[p]['x'] for p in placed) / len(placed)
+        errors.append(abs(src - posiciones[child]['x']))
+        ys = {posiciones[p]['y'] for p in placed}
+        if len(ys) == 1 and above.get(posiciones[child]['y']) in ys:
+            by_level.setdefault(posiciones[child]['y'], []).append((src, posiciones[child]['x']))
+        else:
+            split += 1
+    crossings = 0
+    for edges in by_level.values():
+        edges.sort()
+        crossings += _count_inversions([c for _, c in edges])
+    xs = [p['x'] for p in posiciones.values()]
+    return {
+        'crossings': crossings,
+        'long_edges': split,
+        'width': round(max(xs) - min(xs) + ICON_SIZE) if xs else 0,
+        'center_err': round(statistics.mean(errors), 1) if errors else 0.0,
+    }
+
+
+def run_layout(gen: GenogramGenerator, family: Dict, name: str) -> Dict:
+    personas, relaciones = family['personas'], family['relaciones']
+    graph = FamilyGraph(personas, relaciones)
+    generaciones = gen._organize_generations(personas, relaciones, graph)
+    if name == 'simple':
+        return gen._calculate_positions_simple(generaciones, ICON_SIZE, SPACING_X, SPACING_Y, START_X, START_Y)
+    return gen._calculate_positions_layered(generaciones, graph, ICON_SIZE, SPACING_X, SPACING_Y, COUPLE_SPACING, START_X, START_Y)
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument('--sizes', default='25,50,100,250,500,1000')
+    ap.add_argument('--repeats', type=int, default=5)
+    ap.add_argument('--seed', type=int, default=7)
+    args = ap.parse_args()
+
+    gen = GenogramGenerator(api_key=None)
+    rows = []
+    for n in [int(x) for x in args.sizes.split(',') if x.strip()]:
+        family = synthetic_family(n, args.seed)
+        graph = FamilyGraph(family['personas'], family['relaciones'])
+        for name in ('simple', 'layered'):
+            times = []
+            for _ in range(max(1, args.repeats)):
+                t0 = time.perf_counter()
+                posiciones = run_layout(gen, family, name)
+                times.append((time.perf_counter() - t0) * 1000.0)
+            row = {
+                'personas': len(family['personas']),
+                'relaciones': len(family['relaciones']),
+                'layout': name,
+                'layout_ms': round(statistics.median(times), 2),
+                **layout_quality(posiciones, graph),
+            }
+            rows.append(row)
+            print(json.dumps(row, ensure_ascii=False), file=sys.stderr)
+
+    print(json.dumps({'ok': True, 'seed': args.seed, 'repeats': args.repeats, 'results': rows}, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
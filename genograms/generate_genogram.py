@@ -3,6 +3,12 @@
 """
 Script para generar genogramas desde línea de comandos
 Uso: python generate_genogram.py <transcription_file> <output_file>
+     python generate_genogram.py --patient <patient_folder> [output_file]
+
+Con --patient se actualiza el grafo familiar del paciente
+(outputs/<patient_folder>/family_graph.json, sólo las sesiones nuevas van a
+Gemini) y se dibuja con todo lo acumulado. Por defecto escribe
+outputs/<patient_folder>/genograma.html.
 """
 
 import sys
@@ -15,24 +21,30 @@ sys.path.insert(0, str(Path(__file__).parent))
 from genogram_model import GenogramGenerator
 
 def main():
-    if len(sys.argv) < 3:
+    patient_folder = None
+    if len(sys.argv) >= 3 and sys.argv[1] == '--patient':
+        patient_folder = sys.argv[2]
+        output_file = sys.argv[3] if len(sys.argv) > 3 else None
+    elif len(sys.argv) >= 3:
+        transcription_file = sys.argv[1]
+        output_file = sys.argv[2]
+    else:
         print("Uso: python generate_genogram.py <transcription_file> <output_file>")
+        print("     python generate_genogram.py --patient <patient_folder> [output_file]")
         sys.exit(1)
     
-    transcription_file = sys.argv[1]
-    output_file = sys.argv[2]
-    
-    # Leer transcripción
-    if not os.path.exists(transcription_file):
-        print(f"Error: No se encontró el archivo {transcription_file}")
-        sys.exit(1)
-    
-    with open(transcription_file, 'r', encoding='utf-8') as f:
-        transcription = f.read()
-    
-    if not transcription.strip():
-        print("Error: La transcripción está vacía")
-        sys.exit(1)
+    if patient_folder is None:
+        # Leer transcripción
+        if not os.path.exists(transcription_file):
+            print(f"Error: No se encontró el archivo {transcription_file}")
+            sys.exit(1)
+        
+        with open(transcription_file, 'r', encoding='utf-8') as f:
+            transcription = f.read()
+        
+        if not transcription.strip():
+            print("Error: La transcripción está vacía")
+            sys.exit(1)
     
     # Cargar variables de entorno desde el archivo .env en el directorio raíz
     from dotenv import load_dotenv
@@ -48,7 +60,10 @@ def main():
     # Generar genograma
     try:
         generator = GenogramGenerator(api_key=API_KEY)
-        output_path = generator.process_transcription(transcription, output_file)
+        if patient_folder is not None:
+            output_path = generator.generate_genogram_from_family_graph(patient_folder, output_file)
+        else:
+            output_path = generator.process_transcription(transcription, output_file)
         print(f"SUCCESS: {output_path}")
     except Exception as e:
         print(f"ERROR: {str(e)}")
@@ -1,4 +1,3 @@
-import google.genai as genai
 import json
 import ast
 import re
@@ -7,19 +6,541 @@ import os
 import base64
 import datetime
 import sys
-from typing import Dict, List, Optional
+import hashlib
+import gzip
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
 from pathlib import Path
 
+try:
+    import graphviz
+except ImportError:  # layout='graphviz' vuelve al layout por capas
+    graphviz = None
+
+
+# --- configuración y rutas ---------------------------------------------------
+
+DEFAULT_MODEL_ID = 'gemini-2.5-flash'
+# Subir cuando cambie el prompt de extract_family_info: invalida la caché de extracciones.
+EXTRACTION_PROMPT_VERSION = 2
+
+FAMILY_GRAPH_VERSION = 1
+FAMILY_GRAPH_FILENAME = 'family_graph.json'
+# Archivos y carpetas que escribe el propio pipeline dentro de outputs/<paciente>:
+# no son transcripciones.
+GENERATED_FILES = {FAMILY_GRAPH_FILENAME}
+GENERATED_DIRS = {'turn_index'}
+# create_genogram guarda la familia normalizada junto al HTML: genograma.html -> genograma.family.json
+FAMILY_JSON_SUFFIX = '.family.json'
+# Formatos de export_genogram_graphviz (render_genogram.py: options.format).
+GRAPHVIZ_EXPORT_FORMATS = ('pdf', 'png', 'svg')
+
+
+def extraction_cache_dir() -> Path:
+    return Path(os.environ.get('GENOGRAM_CACHE_DIR') or (Path(__file__).resolve().parents[1] / 'outputs' / '.genogram_cache'))
+
+
+# --- transcripciones: elección y limpieza de fuentes -------------------------
+
+# Artefactos que escribe process_all.py por sesión, de mejor a peor fuente para
+# el prompt: el texto etiquetado (con hablantes identificados si hubo
+# referencias) antes que la salida cruda de Whisper. `_diarization.txt` sólo
+# tiene tiempos por hablante y nunca se envía.
+TRANSCRIPT_SOURCE_SUFFIXES = ('_labeled.txt', '_labeled.json', '_transcription.txt', '_transcription.json')
+SKIPPED_SOURCE_SUFFIXES = ('_diarization.txt',)
+
+_TIMESTAMP_RE = re.compile(r'^\[\d+(?:\.\d+)?s\s*-\s*\d+(?:\.\d+)?s\]\s*')
+_RULE_RE = re.compile(r'^[=\-]{5,}$')
+_LABELED_SPEAKER_RE = re.compile(r'^(?:【(.+)】|(\S.{0,40}):)$')
+_BOILERPLATE_LINES = {
+    'TRANSCRIPCIÓN ETIQUETADA POR HABLANTE',
+    'TRANSCRIPCIÓN CON HABLANTES IDENTIFICADOS',
+    'TRANSCRIPCIÓN COMPLETA',
+    'SEGMENTOS CON TIMESTAMPS',
+}
+# Resumen de intervenciones por hablante al final de `_labeled.txt`.
+_SUMMARY_PREFIXES = ('RESUMEN:', 'HABLANTES IDENTIFICADOS:')
+
+
+def _join_turns(turns) -> str:
+    """Une los fragmentos consecutivos de un mismo hablante: una línea por turno."""
+    lines: List[str] = []
+    last = None
+    for speaker, text in turns:
+        text = text.strip()
+        if not text:
+            continue
+        if lines and speaker == last:
+            lines[-1] += ' ' + text
+        else:
+            lines.append(f"{speaker}: {text}" if speaker else text)
+            last = speaker
+    return '\n'.join(lines)
+
+
+def clean_transcript_text(text: str, name: str = '') -> str:
+    """Texto de una transcripción sin tiempos, cabeceras ni resúmenes del pipeline.
+
+    - `_transcription.json` (Whisper): sólo `text`, sin segmentos ni tiempos por palabra.
+    - `_labeled.json`: una línea `Hablante: ...` por turno.
+    - `_transcription.txt`: el bloque de texto completo (los segmentos lo repiten).
+    - `_labeled.txt`: como el JSON etiquetado.
+    Otros archivos (notas, JSON de perfil) sólo pierden los prefijos `[1.0s - 2.0s]`.
+    """
+    stripped = (text or '').strip()
+    lower = name.lower()
+    if lower.endswith('.json'):
+        try:
+            data = json.loads(stripped)
+        except ValueError:
+            return stripped
+        if isinstance(data, list) and data and all(isinstance(s, dict) and 'text' in s for s in data):
+            return _join_turns((str(s.get('speaker') or ''), str(s.get('text') or '')) for s in data)
+        if isinstance(data, dict) and ('segments' in data or 'text' in data):
+            full = str(data.get('text') or '').strip()
+            return full or ' '.join(str(s.get('text') or '').strip() for s in data.get('segments') or []).strip()
+        return stripped
+
+    lines = [ln.strip() for ln in stripped.splitlines()]
+    if lines and lines[0] == 'TRANSCRIPCIÓN COMPLETA':
+        body = []
+        for ln in lines[1:]:
+            if ln == 'SEGMENTOS CON TIMESTAMPS':
+                break
+            if ln and not _RULE_RE.match(ln):
+                body.append(ln)
+        if body:
+            return '\n'.join(body)
+
+    labeled = lower.endswith('_labeled.txt')
+    turns = []
+    speaker = ''
+    for ln in lines:
+        if not ln or _RULE_RE.match(ln) or ln in _BOILERPLATE_LINES:
+            continue
+        if labeled:
+            if ln.startswith(_SUMMARY_PREFIXES):
+                break
+            m = _LABELED_SPEAKER_RE.match(ln)
+            if m and not _TIMESTAMP_RE.match(ln):
+                speaker = m.group(1) or m.group(2)
+                continue
+        turns.append((speaker, _TIMESTAMP_RE.sub('', ln)))
+    if labeled:
+        return _join_turns(turns)
+    return '\n'.join(t for _, t in turns if t)
+
+
+def transcript_session_key(path: Path) -> Tuple[str, int]:
+    """(sesión, prioridad) de un archivo; menor prioridad = mejor fuente.
+
+    Los archivos que no son artefactos del pipeline (notas, perfil del
+    paciente...) forman su propio grupo.
+    """
+    name = path.name
+    lower = name.lower()
+    for rank, suffix in enumerate(TRANSCRIPT_SOURCE_SUFFIXES):
+        if lower.endswith(suffix):
+            return str(path.parent / name[:-len(suffix)]), rank
+    return str(path), len(TRANSCRIPT_SOURCE_SUFFIXES)
+
+
+def load_transcript_sources(files: List[Path]) -> Tuple[List[Tuple[Path, str]], Dict]:
+    """Elige un solo archivo por sesión y devuelve `([(ruta, texto limpio)], stats)`.
+
+    Si la mejor fuente de una sesión está vacía o no se puede leer se usa la
+    siguiente. `stats` compara el tamaño de todos los archivos (lo que se
+    enviaba antes) con el de los textos elegidos, en tokens aproximados
+    (4 bytes por token).
+    """
+    groups: Dict[str, List[Tuple[int, Path]]] = {}
+    raw_bytes = 0
+    for p in files:
+        try:
+            raw_bytes += p.stat().st_size
+        except OSError:
+            pass
+        if p.name.lower().endswith(SKIPPED_SOURCE_SUFFIXES):
+            continue
+        key, rank = transcript_session_key(p)
+        groups.setdefault(key, []).append((rank, p))
+
+    sources: List[Tuple[Path, str]] = []
+    for candidates in groups.values():
+        for _, p in sorted(candidates, key=lambda c: c[0]):
+            try:
+                with open(p, 'r', encoding='utf-8') as fh:
+                    text = clean_transcript_text(fh.read(), p.name)
+            except Exception as e:
+                print(f"DEBUG: no se pudo leer {p}: {e}", file=sys.stderr)
+                continue
+            if text:
+                sources.append((p, text))
+                break
+
+    clean_bytes = sum(len(t.encode('utf-8')) for _, t in sources)
+    raw_tokens, tokens = (raw_bytes + 3) // 4, (clean_bytes + 3) // 4
+    stats = {
+        'files': len(files),
+        'sessions': len(sources),
+        'raw_tokens': raw_tokens,
+        'tokens': tokens,
+        'reduction': round(raw_tokens / tokens, 1) if tokens else 0.0,
+    }
+    return sources, stats
+
+
+# --- filtro de parentesco ----------------------------------------------------
+
+# Filtro de parentesco antes de extract_family_info (GENOGRAM_KIN_FILTER=0 lo desactiva).
+# Sólo se envían las frases que nombran a un familiar, a una persona ya nombrada
+# como familiar o que siguen con un pronombre, más `window` frases alrededor.
+KINSHIP_BUDGET_TOKENS = 6000
+KINSHIP_WINDOW = 1
+# Si el presupuesto deja fuera más de esta fracción de menciones, se envía el texto completo.
+KINSHIP_MIN_COVERAGE = 0.6
+# Con menos menciones que esto el filtro no es fiable (ASR raro, otro idioma...): texto completo.
+KINSHIP_MIN_HITS = 3
+# Textos cortos se envían enteros: el ahorro no compensa el riesgo de perder algo.
+KINSHIP_MIN_TOKENS = 1500
+
+_KINSHIP_RE = re.compile(
+    r"\b(?:"
+    r"pap[áa]s?|mam[áa]s?|padres?|madres?|padrastros?|madrastras?|"
+    r"(?:bis|tatara)?abuel[oa]s?|herman[oa]s?|hermanastr[oa]s?|melliz[oa]s?|gemel[oa]s?|"
+    r"hij[oa]s?|hijastr[oa]s?|(?:bis)?niet[oa]s?|t[íi][oa]s?|prim[oa]s?|sobrin[oa]s?|"
+    r"espos[oa]s?|marido|mujer|pareja|novi[oa]s?|ex|suegr[oa]s?|cuñad[oa]s?|yerno|nuera|"
+    r"padrino|madrina|familias?|familiares?|parientes?|"
+    r"casad[oa]s?|cas[oó]|casaron|divorci\w*|separad[oa]s?|separaron|viud[oa]s?|"
+    r"falleci\w*|muri[oó]|murieron|embarazad[oa]|adoptad[oa]s?"
+    r")\b", re.I)
+_PRONOUN_RE = re.compile(r"\b(?:él|ella|ellos|ellas|su|sus|le|les)\b", re.I)
+_NAME_RE = re.compile(r"\b[A-ZÁÉÍÓÚÑ][a-záéíóúñü]{2,}\b")
+_NAME_STOPWORDS = {
+    'Bueno', 'Pues', 'Entonces', 'Claro', 'Vale', 'Dios', 'Paciente', 'Psicólogo', 'Psicóloga',
+    'Terapeuta', 'Doctor', 'Doctora', 'Speaker', 'Lunes', 'Martes', 'Miércoles', 'Jueves',
+    'Viernes', 'Sábado', 'Domingo', 'Navidad',
+}
+_SENTENCE_SPLIT_RE = re.compile(r'(?<=[.!?…])\s+')
+_TURN_PREFIX_RE = re.compile(r'^([^\s:\[][^:]{0,40}):\s+')
+MAX_SENTENCE_WORDS = 40
+
+
+def _approx_tokens(text: str) -> int:
+    return (len(text.encode('utf-8')) + 3) // 4
+
+
+def _split_sentences(body: str) -> List[str]:
+    out = []
+    for sent in _SENTENCE_SPLIT_RE.split(body.strip()):
+        words = sent.split()
+        # Whisper a veces no puntúa: trozos de MAX_SENTENCE_WORDS para que la ventana siga siendo local.
+        for i in range(0, len(words), MAX_SENTENCE_WORDS):
+            out.append(' '.join(words[i:i + MAX_SENTENCE_WORDS]))
+    return out
+
+
+def kinship_prefilter(text: str, budget_tokens: Optional[int] = None, window: Optional[int] = None,
+                      min_coverage: Optional[float] = None) -> Tuple[str, Dict]:
+    """Reduce una transcripción a los pasajes que hablan de la familia.
+
+    Devuelve `(texto, stats)`. El texto conserva las cabeceras `--- SESSION:`,
+    el bloque PACIENTE_INFO y el hablante de cada turno; los cortes se marcan
+    con `[...]`. Con pocas menciones, sin ahorro o si el presupuesto
+    (`budget_tokens`, GENOGRAM_KIN_BUDGET) deja fuera demasiadas menciones
+    (`min_coverage`) devuelve el texto completo; `stats['mode']` lo indica.
+    """
+    budget = int(budget_tokens or os.environ.get('GENOGRAM_KIN_BUDGET') or KINSHIP_BUDGET_TOKENS)
+    window = int(window if window is not None else os.environ.get('GENOGRAM_KIN_WINDOW') or KINSHIP_WINDOW)
+    min_coverage = float(min_coverage if min_coverage is not None else
+                         os.environ.get('GENOGRAM_KIN_MIN_COVERAGE') or KINSHIP_MIN_COVERAGE)
+    tokens_in = _approx_tokens(text)
+    stats = {'mode': 'full', 'reason': None, 'tokens_in': tokens_in, 'tokens_out': tokens_in,
+             'hits': 0, 'kept_hits': 0, 'coverage': 1.0}
+    if tokens_in < KINSHIP_MIN_TOKENS:
+        stats['reason'] = 'short'
+        return text, stats
+
+    # generate_genogram_from_specific_session antepone el perfil del paciente: va entero.
+    head, body = '', text
+    marker = text.find('SESION_TRANSCRIPCION:')
+    if marker >= 0:
+        head, body = text[:marker + len('SESION_TRANSCRIPCION:')], text[marker + len('SESION_TRANSCRIPCION:'):]
+
+    units: List[Tuple[int, str, str, bool]] = []  # (línea, hablante, frase, estructural)
+    for ln_no, line in enumerate(body.splitlines()):
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('--- ') or line == '[...]':
+            units.append((ln_no, '', line, True))
+            continue
+        m = _TURN_PREFIX_RE.match(line)
+        speaker, rest = (m.group(1), line[m.end():]) if m else ('', line)
+        for sent in _split_sentences(rest):
+            units.append((ln_no, speaker, sent, False))
+
+    speakers = {u[1] for u in units}
+    scores = [0] * len(units)
+    names = set()
+    for i, (_, _, sent, structural) in enumerate(units):
+        if not structural and _KINSHIP_RE.search(sent):
+            scores[i] = 2
+            names.update(n for n in _NAME_RE.findall(sent.split(' ', 1)[1] if ' ' in sent else '')
+                         if n not in _NAME_STOPWORDS and n not in speakers)
+    if names:
+        name_re = re.compile(r"\b(?:" + '|'.join(re.escape(n) for n in sorted(names)) + r")\b")
+        for i, (_, _, sent, structural) in enumerate(units):
+            if not structural and not scores[i] and name_re.search(sent):
+                scores[i] = 1
+
+    hits = [i for i, s in enumerate(scores) if s]
+    stats['hits'] = len(hits)
+    if len(hits) < KINSHIP_MIN_HITS:
+        stats['reason'] = 'few_hits'
+        return text, stats
+
+    def context(i: int) -> List[int]:
+        idx = list(range(max(0, i - window), min(len(units), i + window + 1)))
+        # "Ella nunca me llamó": seguir mientras las frases siguientes hablen de esa persona.
+        j = i + window + 1
+        while j < len(units) and j <= i + 3 and not units[j][3] and _PRONOUN_RE.search(units[j][2]):
+            idx.append(j)
+            j += 1
+        return [k for k in idx if not units[k][3]]
+
+    cost = [_approx_tokens(u[2]) + 1 for u in units]
+    used = sum(cost[i] for i, u in enumerate(units) if u[3])
+    kept = set()
+    for i in sorted(hits, key=lambda k: (-scores[k], k)):
+        if used + cost[i] > budget:
+            continue
+        kept.add(i)
+        used += cost[i]
+    kept_hits = len(kept)
+    coverage = kept_hits / len(hits)
+    stats.update(kept_hits=kept_hits, coverage=round(coverage, 2))
+    if coverage < min_coverage:
+        stats['reason'] = 'low_coverage'
+        return text, stats
+    for i in sorted(kept):
+        for k in context(i):
+            if k not in kept and used + cost[k] <= budget:
+                kept.add(k)
+                used += cost[k]
+    kept.update(i for i, u in enumerate(units) if u[3])
+
+    lines: List[str] = []
+    prev = None
+    for i in sorted(kept):
+        ln_no, speaker, sent, structural = units[i]
+        gap = prev is None and i > 0 or prev is not None and i != prev + 1
+        if structural:
+            if gap and not units[i - 1][3] and lines and lines[-1] != '[...]':
+                lines.append('[...]')
+            lines.append(sent)
+        elif prev is not None and not gap and units[prev][0] == ln_no:
+            lines[-1] += ' ' + sent
+        else:
+            if gap and lines and lines[-1] != '[...]' and not units[i - 1][3]:
+                lines.append('[...]')
+            lines.append(f"{speaker}: {sent}" if speaker else sent)
+        prev = i
+    filtered = '\n'.join(lines)
+    if head:
+        filtered = head + '\n' + filtered
+    tokens_out = _approx_tokens(filtered)
+    stats['tokens_out'] = tokens_out
+    if tokens_out > tokens_in * 0.8:
+        stats.update(reason='no_gain', tokens_out=tokens_in)
+        return text, stats
+    stats['mode'] = 'filtered'
+    return filtered, stats
+
+
+# --- cuota de Gemini: límite de llamadas y reintentos ------------------------
+
+class TokenBucket:
+    """Limitador de llamadas por minuto compartido entre hilos.
+
+    `defer()` aplica a todos los hilos el tiempo de espera que indica el
+    servidor en un error de cuota: la cuota es del proyecto, no de la llamada.
+    """
+
+    def __init__(self, rate_per_min: float, burst: int = 1):
+        self.rate = max(float(rate_per_min), 0.001) / 60.0
+        self.capacity = max(1, int(burst))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                elif self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                else:
+                    wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def defer(self, delay_s: float) -> None:
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay_s)
+            self.tokens = 0.0
+
+
+def _is_quota_error(msg: str) -> bool:
+    return 'RESOURCE_EXHAUSTED' in msg or 'quota' in msg.lower() or '429' in msg
+
+
+def _retry_delay(msg: str, attempts: int, base_delay: float = 10.0) -> float:
+    # "Please retry in 37.5s" / "'retryDelay': '37s'" en los errores de cuota de Gemini.
+    m = re.search(r"retry.*?(\d+\.?\d*)s", msg, re.IGNORECASE)
+    if m:
+        return float(m.group(1)) + 1.0
+    return base_delay * (2 ** attempts)
+
+
+# --- grafo familiar y layout -------------------------------------------------
+
+class FamilyGraph:
+    """Índices de adyacencia de la familia, construidos una sola vez.
+
+    - `parents[hijo]` / `children[padre]`: relaciones padre-hijo, en el orden
+      en que aparecen (una relación sin `tipo` cuenta como padre-hijo).
+    - `partners[persona]`: parejas, en el orden de las relaciones de pareja.
+    - `couples`: {(id_a, id_b) ordenado: relación de pareja}, primera aparición.
+    Las consultas (`is_parent`, `shared_children`...) son O(1) o O(grado).
+    """
+
+    def __init__(self, personas: List[Dict], relaciones: List[Dict]):
+        self.ids: List[str] = [p['id'] for p in personas if p.get('id')]
+        self.id_set = set(self.ids)
+        self.parents: Dict[str, List[str]] = {}
+        self.children: Dict[str, List[str]] = {}
+        self.partners: Dict[str, List[str]] = {}
+        self.couples: Dict[tuple, Dict] = {}
+        # (padre, hijo) -> posición de la relación, para conservar el orden original.
+        self.edge_order: Dict[tuple, int] = {}
+        for rel in relaciones:
+            self.add_relation(rel)
+
+    def add_relation(self, rel: Dict) -> None:
+        tipo = rel.get('tipo', 'padre-hijo')
+        a, b = rel.get('persona1_id'), rel.get('persona2_id')
+        if not a or not b:
+            return
+        if tipo == 'padre-hijo':
+            if (a, b) in self.edge_order:
+                return
+            self.edge_order[(a, b)] = len(self.edge_order)
+            self.children.setdefault(a, []).append(b)
+            self.parents.setdefault(b, []).append(a)
+        elif tipo == 'pareja':
+            key = tuple(sorted((a, b)))
+            if key in self.couples:
+                return
+            self.couples[key] = rel
+            self.partners.setdefault(a, []).append(b)
+            self.partners.setdefault(b, []).append(a)
+
+    def is_parent(self, parent: str, child: str) -> bool:
+        return (parent, child) in self.edge_order
+
+    def are_partners(self, a: str, b: str) -> bool:
+        return tuple(sorted((a, b))) in self.couples
+
+    def shared_children(self, a: str, b: str) -> List[str]:
+        return [c for c in self.children.get(a, []) if (b, c) in self.edge_order]
+
+    def roots(self) -> List[str]:
+        """Personas sin padres conocidos, en el orden de `personas`."""
+        return [pid for pid in self.ids if pid not in self.parents]
+
+    def next_generation(self, generation: List[str], done: set) -> List[str]:
+        """Hijos aún no colocados de `generation`, en el orden de las relaciones."""
+        edges = []
+        for pid in generation:
+            for child in self.children.get(pid, []):
+                if child not in done:
+                    edges.append((self.edge_order[(pid, child)], child))
+        edges.sort()
+        return list(dict.fromkeys(child for _, child in edges))
+
+
+def _count_inversions(seq: List[float]) -> int:
+    """Pares (i < j) con seq[i] > seq[j], por mergesort: O(n log n)."""
+    if len(seq) < 2:
+        return 0
+    mid = len(seq) // 2
+    left, right = seq[:mid], seq[mid:]
+    inv = _count_inversions(left) + _count_inversions(right)
+    left.sort()
+    right.sort()
+    i = 0
+    for r in right:
+        while i < len(left) and left[i] <= r:
+            i += 1
+        inv += len(left) - i
+    return inv
+
+
+def _pav_non_decreasing(targets: List[float], weights: List[float]) -> List[float]:
+    """Sucesión no decreciente más cercana (mínimos cuadrados ponderados) a `targets`."""
+    blocks: List[List[float]] = []  # [valor, peso, tamaño]
+    for t, w in zip(targets, weights):
+        blocks.append([t, w, 1])
+        while len(blocks) > 1 and blocks[-2][0] > blocks[-1][0]:
+            v2, w2, n2 = blocks.pop()
+            v1, w1, n1 = blocks[-1]
+            blocks[-1] = [(v1 * w1 + v2 * w2) / (w1 + w2), w1 + w2, n1 + n2]
+    out: List[float] = []
+    for v, _, n in blocks:
+        out.extend([v] * n)
+    return out
+
+
+# --- SVG ---------------------------------------------------------------------
+
+_SVG_ROOT_RE = re.compile(r'<svg\b([^>]*)>(.*)</svg>', re.S | re.I)
+_SVG_PROLOG_RE = re.compile(r'<\?xml.*?\?>|<!DOCTYPE[^>]*>|<!--.*?-->', re.S | re.I)
+
+
+def _svg_attr(attrs: str, name: str) -> Optional[str]:
+    m = re.search(r'(?:^|\s)' + name + r'\s*=\s*"([^"]*)"', attrs)
+    return m.group(1) if m else None
+
+
+def minify_svg(svg: str) -> str:
+    """Quita comentarios y espacios entre etiquetas (no toca el texto de <text>)."""
+    svg = re.sub(r'<!--.*?-->', '', svg, flags=re.S)
+    svg = re.sub(r'>\s+<', '><', svg)
+    return re.sub(r'[ \t]*\n[ \t]*', ' ', svg).strip()
+
+
+# --- generador ---------------------------------------------------------------
+
 class GenogramGenerator:
     
-    def __init__(self, api_key: Optional[str] = None, icons_path: str = None):
+    def __init__(self, api_key: Optional[str] = None, icons_path: str = None, offline: bool = False):
         # New google.genai SDK uses a Client object. Make api_key optional so
         # generator can be instantiated for local/demo rendering without
         # contacting the model service.
         # If api_key not provided, try to find it in environment variables
         # or in a project `.env` file (simple KEY=VALUE parser).
-        key = api_key or os.environ.get('GEMINI_API_KEY') or os.environ.get('GENAI_API_KEY') or os.environ.get('API_KEY')
-        if not key:
+        # offline=True no crea el cliente (ni importa google.genai): quien sólo
+        # vuelve a dibujar nunca llama al modelo.
+        key = None if offline else (api_key or os.environ.get('GEMINI_API_KEY') or os.environ.get('GENAI_API_KEY') or os.environ.get('API_KEY'))
+        if not key and not offline:
             # Try to read a .env file in project root
             try:
                 project_root = Path(__file__).resolve().parents[1]
@@ -42,9 +563,10 @@ class GenogramGenerator:
                 key = None
 
         if key:
+            import google.genai as genai
             self.client = genai.Client(api_key=key)
             # Use gemini-2.5-flash which was verified to have quota
-            self.model_id = 'gemini-2.5-flash'
+            self.model_id = DEFAULT_MODEL_ID
         else:
             self.client = None
             self.model_id = None
@@ -57,8 +579,77 @@ class GenogramGenerator:
         
         # Cache de SVGs cargados
         self.svg_cache = {}
-    
-    def extract_family_info(self, transcription: str) -> Dict:
+        # Iconos convertidos a <symbol> y los usados en el genograma en curso
+        self.svg_symbol_cache = {}
+        self.svg_symbols = {}
+        # Fuentes usadas por la última lectura de transcripciones (ver load_transcript_sources).
+        self.last_source_stats: Optional[Dict] = None
+        # Resultado del filtro de parentesco de la última extracción (ver kinship_prefilter).
+        self.last_prefilter_stats: Optional[Dict] = None
+
+    def _prepare_extraction(self, transcription: str, prefilter: Optional[bool] = None) -> Tuple[str, str, Optional[Dict]]:
+        """Texto que se enviará a Gemini: `(texto, nota_para_el_prompt, stats_del_filtro)`."""
+        if not (prefilter if prefilter is not None else os.environ.get('GENOGRAM_KIN_FILTER', '1') != '0'):
+            return transcription, '', None
+        text, kin = kinship_prefilter(transcription)
+        note = ' (sólo los fragmentos que hablan de la familia; "[...]" marca texto omitido)' if kin['mode'] == 'filtered' else ''
+        return text, note, kin
+
+    def _extraction_cache_path(self, sent_text: str, source_note: str = '') -> Path:
+        """Ruta de la extracción cacheada para el texto enviado, versión de prompt y modelo."""
+        h = hashlib.sha1()
+        for part in (str(EXTRACTION_PROMPT_VERSION), self.model_id or DEFAULT_MODEL_ID, source_note, sent_text):
+            h.update(part.encode('utf-8'))
+            h.update(b'\0')
+        return extraction_cache_dir() / f"{h.hexdigest()}.json"
+
+    def _read_extraction_cache(self, path: Path) -> Optional[Dict]:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception:
+            return None
+        if not isinstance(data, dict) or not isinstance(data.get('personas'), list):
+            return None
+        return data
+
+    def _write_extraction_cache(self, path: Path, data: Dict) -> None:
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp, path)
+        except Exception as e:
+            print(f"DEBUG: no se pudo guardar la extracción en caché: {e}", file=sys.stderr)
+
+    def extract_family_info(self, transcription: str, use_cache: bool = True,
+                            prefilter: Optional[bool] = None) -> Dict:
+        """Extrae personas y relaciones con Gemini.
+
+        Con `prefilter` (GENOGRAM_KIN_FILTER, activado por defecto) sólo se envían
+        los pasajes sobre la familia (ver `kinship_prefilter`).
+
+        El resultado se guarda en `outputs/.genogram_cache` (o GENOGRAM_CACHE_DIR)
+        con clave hash(texto enviado, EXTRACTION_PROMPT_VERSION, modelo): regenerar
+        el genograma de una sesión sin cambios no vuelve a llamar al modelo, y
+        cambiar el filtro o sus parámetros no reutiliza extracciones de otro texto.
+        """
+        transcription, source_note, kin = self._prepare_extraction(transcription, prefilter)
+        self.last_prefilter_stats = kin
+        if kin is not None:
+            print(f"DEBUG: filtro de parentesco: {kin['mode']} ({kin['reason'] or 'ok'}), "
+                  f"~{kin['tokens_in']} -> ~{kin['tokens_out']} tokens, menciones {kin['kept_hits']}/{kin['hits']}", file=sys.stderr)
+        cache_path = self._extraction_cache_path(transcription, source_note)
+        if use_cache:
+            cached = self._read_extraction_cache(cache_path)
+            if cached is not None:
+                print(f"DEBUG: extracción desde caché ({cache_path.name}). Persons: {len(cached.get('personas', []))}", file=sys.stderr)
+                return cached
+
+        if self.client is None:
+            raise RuntimeError("Gemini API key not configured (GEMINI_API_KEY)")
+
         prompt = f"""
         Analiza la siguiente transcripción (que puede incluir múltiples sesiones de terapia o información previa del paciente) y extrae la información familiar COMPLETA para un genograma profesional.
         
@@ -71,7 +662,7 @@ class GenogramGenerator:
         - Si no se menciona la edad o ocupación, usa null.
         - Sé muy preciso con los nombres y los géneros.
         
-        Transcripciones e Información:
+        Transcripciones e Información{source_note}:
         {transcription}
         
         Extrae la siguiente información estrictamente en formato JSON:
@@ -169,6 +760,8 @@ class GenogramGenerator:
             raise ValueError("La respuesta del modelo no contiene un formato JSON procesable.")
 
         print(f"DEBUG: JSON extracted. Persons: {len(data.get('personas', []))}", file=sys.stderr)
+        if isinstance(data, dict) and isinstance(data.get('personas'), list):
+            self._write_extraction_cache(cache_path, data)
         return data
 
     
@@ -187,6 +780,41 @@ class GenogramGenerator:
             self.svg_cache[path] = content
             return content
     
+    def _svg_symbol(self, path: str) -> Optional[Dict]:
+        """Convierte un icono en `<symbol>` (id, viewBox y tamaño del <svg> raíz)."""
+        if path in self.svg_symbol_cache:
+            return self.svg_symbol_cache[path]
+        symbol = None
+        m = _SVG_ROOT_RE.search(_SVG_PROLOG_RE.sub('', self.load_svg(path)))
+        if m:
+            attrs, inner = m.group(1), m.group(2).strip()
+            symbol_id = 'icon-' + re.sub(r'[^A-Za-z0-9]+', '-', path.rsplit('.', 1)[0]).strip('-')
+            sym_attrs = ''.join(
+                f' {name}="{value}"' for name in ('viewBox', 'preserveAspectRatio')
+                for value in [_svg_attr(attrs, name)] if value
+            )
+            use_attrs = ''.join(
+                f' {name}="{value}"' for name in ('width', 'height')
+                for value in [_svg_attr(attrs, name)] if value
+            )
+            symbol = {
+                'id': symbol_id,
+                'symbol': f'<symbol id="{symbol_id}"{sym_attrs}>{inner}</symbol>',
+                'use': f'<use href="#{symbol_id}" xlink:href="#{symbol_id}"{use_attrs}/>',
+            }
+        self.svg_symbol_cache[path] = symbol
+        return symbol
+
+    def icon_reference(self, path: str) -> str:
+        """Marcado para dibujar un icono: un `<use>` a su `<symbol>` (que se
+        emite una sola vez en `<defs>`), o el SVG completo si no se pudo
+        convertir."""
+        symbol = self._svg_symbol(path)
+        if symbol is None:
+            return self.load_svg(path)
+        self.svg_symbols.setdefault(path, (symbol['id'], symbol['symbol']))
+        return symbol['use']
+
     def get_person_icon_path(self, persona: Dict) -> str:
         """Determina qué icono SVG usar para una persona"""
         genero = persona.get('genero', 'masculino')
@@ -310,8 +938,9 @@ class GenogramGenerator:
         
         return None
     
-    def create_genogram(self, family_data: Dict, output_file: str = "genograma") -> str:
-        """Genera un HTML interactivo con el genograma usando SVGs personalizados"""
+    def _prepare_family(self, family_data: Dict) -> Tuple[List[Dict], List[Dict], FamilyGraph]:
+        """Normaliza ids, añade las parejas implícitas (dos padres de un mismo
+        hijo) y construye el FamilyGraph. Modifica `family_data` en sitio."""
         
         personas = family_data.get('personas', [])
         relaciones = family_data.get('relaciones', [])
@@ -348,72 +977,98 @@ class GenogramGenerator:
                 r['persona2_id'] = id_map.get(r['persona2_id'], _norm_id(r.get('persona2_id')))
 
         # FILTER: KEEP ALL relationships for processing (do not filter here)
-        # 1. Inferir parejas faltantes si comparten el mismo hijo
-        hijos_map = {} # hijo_id -> set(padres_ids)
-        for r in relaciones:
-            if r.get('tipo', 'padre-hijo') == 'padre-hijo':
-                p, h = r.get('persona1_id'), r.get('persona2_id')
-                if p and h:
-                    if h not in hijos_map: hijos_map[h] = set()
-                    hijos_map[h].add(p)
-        
+        graph = FamilyGraph(personas, relaciones)
+
         # Si dos personas comparten un hijo, crear relación de pareja implícita si no existe
-        parejas_existentes = set()
-        for r in relaciones:
-            if r.get('tipo') == 'pareja':
-                parejas_existentes.add(tuple(sorted([r['persona1_id'], r['persona2_id']])))
-        
-        for h, padres in hijos_map.items():
+        for h, padres in list(graph.parents.items()):
             if len(padres) == 2:
-                p_list = sorted(list(padres))
-                pair = tuple(p_list)
-                if pair not in parejas_existentes:
-                    relaciones.append({'tipo': 'pareja', 'persona1_id': p_list[0], 'persona2_id': p_list[1], 'estado_civil': 'union_libre'})
-                    parejas_existentes.add(pair)
+                p_list = sorted(padres)
+                if not graph.are_partners(p_list[0], p_list[1]):
+                    rel = {'tipo': 'pareja', 'persona1_id': p_list[0], 'persona2_id': p_list[1], 'estado_civil': 'union_libre'}
+                    relaciones.append(rel)
+                    graph.add_relation(rel)
 
         if not personas:
             raise ValueError("No hay personas en los datos familiares")
+        return personas, relaciones, graph
+
+    def create_genogram(self, family_data: Dict, output_file: str = "genograma",
+                        minify: Optional[bool] = None, gzip_output: Optional[bool] = None,
+                        layout: Optional[str] = None, options: Optional[Dict] = None,
+                        save_family: bool = True) -> str:
+        """Genera un HTML interactivo con el genograma usando SVGs personalizados.
+
+        `layout` (GENOGRAM_LAYOUT): 'layered' (por defecto), 'graphviz' o 'simple'.
+        `options` puede cambiar icon_size, spacing_x, spacing_y y couple_spacing.
+
+        Con `save_family` la familia normalizada se guarda en
+        `<output_file>.family.json`, para volver a dibujarla sin llamar al
+        modelo (`render_genogram_from_json`).
+
+        `minify` (GENOGRAM_MINIFY, desactivado por defecto) compacta el SVG;
+        `gzip_output` (GENOGRAM_GZIP, activado por defecto) escribe además
+        `<output_file>.html.gz`.
+        """
+
+        personas, relaciones, graph = self._prepare_family(family_data)
+        if save_family:
+            self._save_family_json(Path(f"{output_file}{FAMILY_JSON_SUFFIX}"), personas, relaciones)
         
         # Constantes de diseño (ajustadas para mejor visualización profesional)
-        ICON_SIZE = 50  # Tamaño mediano para símbolos
-        SPACING_X = 180  # Más espacio horizontal entre personas
-        SPACING_Y = 180  # Más espacio vertical entre generaciones
-        COUPLE_SPACING = 120  # Espacio entre pareja
+        options = options or {}
+        ICON_SIZE = options.get('icon_size') or 50  # Tamaño mediano para símbolos
+        SPACING_X = options.get('spacing_x') or 180  # Más espacio horizontal entre personas
+        SPACING_Y = options.get('spacing_y') or 180  # Más espacio vertical entre generaciones
+        COUPLE_SPACING = options.get('couple_spacing') or 120  # Espacio entre pareja
         START_X = 100
         START_Y = 100
         
         # Organizar personas por generaciones basadas únicamente en padre-hijo
-        generaciones = self._organize_generations(personas, relaciones)
-
-        # Calcular posiciones basadas en generaciones (simple jerárquico)
-        posiciones = self._calculate_positions_simple(generaciones, ICON_SIZE, SPACING_X, SPACING_Y, START_X, START_Y)
+        generaciones = self._organize_generations(personas, relaciones, graph)
+
+        # Calcular posiciones: por capas con mínimo de cruces (por defecto), Graphviz o simple jerárquico
+        layout = (layout or os.environ.get('GENOGRAM_LAYOUT') or 'layered').lower()
+        posiciones = None
+        if layout == 'simple':
+            posiciones = self._calculate_positions_simple(generaciones, ICON_SIZE, SPACING_X, SPACING_Y, START_X, START_Y)
+        elif layout == 'graphviz':
+            try:
+                posiciones = self._calculate_positions_graphviz(generaciones, graph, ICON_SIZE, SPACING_X, SPACING_Y, COUPLE_SPACING, START_X, START_Y)
+            except Exception as e:
+                print(f"DEBUG: layout graphviz no disponible ({e}); usando layout por capas", file=sys.stderr)
+        if posiciones is None:
+            posiciones = self._calculate_positions_layered(generaciones, graph, ICON_SIZE, SPACING_X, SPACING_Y, COUPLE_SPACING, START_X, START_Y)
         
         # Calcular dimensiones del SVG
         max_x = max([pos['x'] for pos in posiciones.values()], default=START_X) + ICON_SIZE + 200
         max_y = max([pos['y'] for pos in posiciones.values()], default=START_Y) + ICON_SIZE + 200
         
-        # Construir SVG
-        svg_content = f'<svg id="genogram-svg" width="{max_x}" height="{max_y}" xmlns="http://www.w3.org/2000/svg">\n'
+        # Construir SVG (las partes se escriben en orden; los iconos van una vez en <defs>)
+        self.svg_symbols = {}
+        svg_parts: List[str] = [f'<svg id="genogram-svg" width="{max_x}" height="{max_y}" xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink">\n']
         
         # Fondo
-        svg_content += f'  <rect width="100%" height="100%" fill="#ffffff"/>\n'
+        svg_parts.append(f'  <rect width="100%" height="100%" fill="#ffffff"/>\n')
+        defs_idx = len(svg_parts)
         
         # Dibujar relaciones primero (para que queden detrás)
-        svg_content += '  <!-- Relaciones -->\n'
-        svg_content += self._render_all_relations(relaciones, posiciones, personas, ICON_SIZE)
+        svg_parts.append('  <!-- Relaciones -->\n')
+        svg_parts.append(self._render_all_relations(relaciones, posiciones, personas, ICON_SIZE, graph))
         
         # Dibujar personas
-        svg_content += '  <!-- Personas -->\n'
+        svg_parts.append('  <!-- Personas -->\n')
         for persona in personas:
             persona_id = persona['id']
             if persona_id in posiciones:
                 pos = posiciones[persona_id]
-                svg_content += self._render_person(persona, pos['x'], pos['y'], ICON_SIZE)
+                svg_parts.append(self._render_person(persona, pos['x'], pos['y'], ICON_SIZE))
         
-        svg_content += '</svg>\n'
+        svg_parts.append('</svg>\n')
+        if self.svg_symbols:
+            svg_parts.insert(defs_idx, '  <defs>\n' + ''.join(f'    {sym}\n' for _, sym in self.svg_symbols.values()) + '  </defs>\n')
         
         # Crear HTML completo con svg-pan-zoom
-        html_content = f'''<!DOCTYPE html>
+        html_head = '''<!DOCTYPE html>
 <html lang="es">
 <head>
     <meta charset="UTF-8">
@@ -421,30 +1076,30 @@ class GenogramGenerator:
     <title>Genograma Familiar</title>
     <script src="https://cdn.jsdelivr.net/npm/svg-pan-zoom@3.6.1/dist/svg-pan-zoom.min.js"></script>
     <style>
-        body {{
+        body {
             margin: 0;
             padding: 20px;
             font-family: Arial, sans-serif;
             background: #f0f0f0;
-        }}
-        #genogram-container {{
+        }
+        #genogram-container {
             background: white;
             border-radius: 8px;
             box-shadow: 0 2px 10px rgba(0,0,0,0.1);
             padding: 20px;
             max-width: 100%;
             overflow: hidden;
-        }}
-        #genogram-svg {{
+        }
+        #genogram-svg {
             border: 1px solid #ddd;
             cursor: move;
-        }}
-        .controls {{
+        }
+        .controls {
             margin-bottom: 15px;
             display: flex;
             gap: 10px;
-        }}
-        button {{
+        }
+        button {
             padding: 10px 20px;
             background: #4CAF50;
             color: white;
@@ -452,14 +1107,14 @@ class GenogramGenerator:
             border-radius: 5px;
             cursor: pointer;
             font-size: 14px;
-        }}
-        button:hover {{
+        }
+        button:hover {
             background: #45a049;
-        }}
-        h1 {{
+        }
+        h1 {
             margin-top: 0;
             color: #333;
-        }}
+        }
     </style>
 </head>
 <body>
@@ -471,17 +1126,18 @@ class GenogramGenerator:
             <button onclick="panZoom.reset()">🔄 Reset</button>
             <button onclick="panZoom.fit()">📐 Ajustar</button>
         </div>
-        {svg_content}
+        '''
+        html_tail = '''
     </div>
     <script>
-        var panZoom = svgPanZoom('#genogram-svg', {{
+        var panZoom = svgPanZoom('#genogram-svg', {
             zoomEnabled: true,
             controlIconsEnabled: false,
             fit: true,
             center: true,
             minZoom: 0.5,
             maxZoom: 10
-        }});
+        });
     </script>
 </body>
 </html>'''
@@ -490,32 +1146,113 @@ class GenogramGenerator:
         output_path = f"{output_file}.html"
         out_p = Path(output_path)
         out_p.parent.mkdir(parents=True, exist_ok=True)
-        
-        with open(out_p, 'w', encoding='utf-8') as f:
-            f.write(html_content)
+
+        if minify is None:
+            minify = os.environ.get('GENOGRAM_MINIFY', '0') not in ('0', 'false', '')
+        if gzip_output is None:
+            gzip_output = os.environ.get('GENOGRAM_GZIP', '1') not in ('0', 'false', '')
+        if minify:
+            svg_parts = [minify_svg(''.join(svg_parts))]
+        self._write_html(out_p, [html_head] + svg_parts + [html_tail], gzip_output)
         
         return str(out_p.absolute())
+
+    def _write_html(self, out_p: Path, parts: List[str], gzip_output: bool) -> None:
+        """Escribe las partes con un writer con buffer y, si se pide, una copia
+        precomprimida `<archivo>.html.gz` que el servidor entrega a navegadores
+        que aceptan gzip. Si no se pide se borra la copia anterior para que no
+        quede desactualizada.
+        """
+        gz_path = out_p.with_name(out_p.name + '.gz')
+        gz_tmp = gz_path.with_name(f"{gz_path.name}.{os.getpid()}.tmp")
+        gz = gzip.GzipFile(filename=out_p.name, mode='wb', fileobj=open(gz_tmp, 'wb'), compresslevel=9, mtime=0) if gzip_output else None
+        try:
+            with open(out_p, 'wb', buffering=1 << 16) as f:
+                for part in parts:
+                    data = part.encode('utf-8')
+                    f.write(data)
+                    if gz is not None:
+                        gz.write(data)
+        finally:
+            if gz is not None:
+                fileobj = gz.fileobj
+                gz.close()
+                fileobj.close()
+        if gz is not None:
+            os.replace(gz_tmp, gz_path)
+        elif gz_path.exists():
+            try:
+                gz_path.unlink()
+            except OSError:
+                pass
     
-    def _organize_family_structure(self, personas: List[Dict], relaciones: List[Dict]) -> Dict:
+    def _save_family_json(self, path: Path, personas: List[Dict], relaciones: List[Dict]) -> None:
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'version': 1,
+                    'generated_at': datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+                    'personas': personas,
+                    'relaciones': relaciones,
+                }, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, path)
+        except Exception as e:
+            print(f"DEBUG: no se pudo guardar {path}: {e}", file=sys.stderr)
+
+    def render_genogram_from_json(self, family_json: str, output_file: Optional[str] = None,
+                                  options: Optional[Dict] = None) -> str:
+        """Vuelve a dibujar un genograma desde su `.family.json`, sin Gemini.
+
+        `options`: layout ('layered'/'graphviz'/'simple'), icon_size, spacing_x,
+        spacing_y, couple_spacing, minify, gzip, hide_ids (ids a ocultar) y
+        hide_unconnected (ocultar personas sin ninguna relación). El JSON no se
+        modifica: las opciones sólo afectan a este HTML. Por defecto escribe
+        junto al JSON (`genograma.family.json` -> `genograma.html`).
+
+        Con `format` 'pdf', 'png' o 'svg' exporta con Graphviz en lugar del HTML
+        (ver `export_genogram_graphviz`).
+        """
+        path = Path(family_json)
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        options = options or {}
+        personas = [dict(p) for p in data.get('personas', []) if p.get('id')]
+        relaciones = [dict(r) for r in data.get('relaciones', [])]
+
+        hidden = set(options.get('hide_ids') or [])
+        if options.get('hide_unconnected'):
+            connected = {r.get('persona1_id') for r in relaciones} | {r.get('persona2_id') for r in relaciones}
+            hidden |= {p['id'] for p in personas if p['id'] not in connected and 'consultante' not in (p.get('condiciones') or [])}
+        if hidden:
+            personas = [p for p in personas if p['id'] not in hidden]
+            relaciones = [r for r in relaciones if r.get('persona1_id') not in hidden and r.get('persona2_id') not in hidden]
+
+        if output_file is None:
+            name = path.name[:-len(FAMILY_JSON_SUFFIX)] if path.name.endswith(FAMILY_JSON_SUFFIX) else path.stem
+            output_file = str(path.with_name(name))
+        fmt = options.get('format') or 'html'
+        if fmt != 'html':
+            return self.export_genogram_graphviz({'personas': personas, 'relaciones': relaciones}, output_file, fmt, options)
+        return self.create_genogram(
+            {'personas': personas, 'relaciones': relaciones},
+            output_file,
+            minify=options.get('minify'),
+            gzip_output=options.get('gzip'),
+            layout=options.get('layout'),
+            options=options,
+            save_family=False,
+        )
+
+    def _organize_family_structure(self, personas: List[Dict], relaciones: List[Dict],
+                                   graph: Optional[FamilyGraph] = None) -> Dict:
         """Organiza la estructura familiar en generaciones con parejas agrupadas"""
+        graph = graph or FamilyGraph(personas, relaciones)
         # Crear mapas de relaciones
-        parejas = {}  # {persona_id: pareja_id}
-        hijos_de = {}  # {padre_id: [hijo_ids]}
-        padres_de = {}  # {hijo_id: [padre_ids]}
-        
-        for rel in relaciones:
-            if rel['tipo'] == 'pareja':
-                p1, p2 = rel['persona1_id'], rel['persona2_id']
-                parejas[p1] = p2
-                parejas[p2] = p1
-            elif rel['tipo'] == 'padre-hijo':
-                padre, hijo = rel['persona1_id'], rel['persona2_id']
-                if padre not in hijos_de:
-                    hijos_de[padre] = []
-                hijos_de[padre].append(hijo)
-                if hijo not in padres_de:
-                    padres_de[hijo] = []
-                padres_de[hijo].append(padre)
+        parejas = {pid: ps[-1] for pid, ps in graph.partners.items()}  # {persona_id: pareja_id}
+        hijos_de = graph.children  # {padre_id: [hijo_ids]}
+        padres_de = graph.parents  # {hijo_id: [padre_ids]}
         # Strategy: if there is a consultante (patient), build centered generations
         # up to grandparents (2 ancestor levels) and direct children. Otherwise
         # fall back to previous root->children BFS.
@@ -599,16 +1336,14 @@ class GenogramGenerator:
             generacion_actual = raices
             while generacion_actual:
                 generaciones_ids.append(list(generacion_actual))
-                for pid in generacion_actual:
-                    procesadas.add(pid)
+                procesadas.update(generacion_actual)
 
                 siguiente = []
                 for persona_id in generacion_actual:
-                    if persona_id in hijos_de:
-                        for hijo_id in hijos_de[persona_id]:
-                            if hijo_id not in procesadas and hijo_id not in siguiente:
-                                siguiente.append(hijo_id)
-                generacion_actual = siguiente
+                    for hijo_id in hijos_de.get(persona_id, []):
+                        if hijo_id not in procesadas:
+                            siguiente.append(hijo_id)
+                generacion_actual = list(dict.fromkeys(siguiente))
 
             no_procesadas = [p['id'] for p in personas if p['id'] not in procesadas]
             if no_procesadas:
@@ -638,28 +1373,25 @@ class GenogramGenerator:
         # If we have detected grandparents, ensure they appear in the first generation
         if grandparents_set:
             # remove grandparents from any existing generation lists
-            for gen in generaciones_ids:
-                for gid in list(gen):
-                    if gid in grandparents_set:
-                        gen.remove(gid)
+            generaciones_ids = [[gid for gid in gen if gid not in grandparents_set] for gen in generaciones_ids]
 
             # insert or prepend first generation
             if generaciones_ids:
-                first = generaciones_ids[0]
                 # prepend unique grandparents
-                for gid in grandparents_set:
-                    if gid not in first:
-                        first.insert(0, gid)
+                generaciones_ids[0] = list(reversed(list(grandparents_set))) + generaciones_ids[0]
             else:
                 generaciones_ids.insert(0, list(grandparents_set))
         for gen in generaciones_ids:
-            pendientes = list(gen)
             grupos: List[List[str]] = []
-            while pendientes:
-                pid = pendientes.pop(0)
-                if pid in parejas and parejas[pid] in pendientes:
-                    pareja_id = parejas[pid]
-                    pendientes.remove(pareja_id)
+            agrupadas = set()
+            en_gen = set(gen)
+            for pid in gen:
+                if pid in agrupadas:
+                    continue
+                agrupadas.add(pid)
+                pareja_id = parejas.get(pid)
+                if pareja_id in en_gen and pareja_id not in agrupadas:
+                    agrupadas.add(pareja_id)
                     grupos.append([pid, pareja_id])
                 else:
                     grupos.append([pid])
@@ -737,50 +1469,393 @@ class GenogramGenerator:
                 
         return posiciones
     
-    def _render_all_relations(self, relaciones: List[Dict], posiciones: Dict, personas: List[Dict], icon_size: float) -> str:
+    def _assign_layers(self, generaciones: List[List[str]], graph: FamilyGraph) -> List[List[str]]:
+        """Capa (generación) de cada persona para el layout por capas.
+
+        Camino más largo desde las raíces, con tres ajustes: una raíz baja a la
+        capa justo encima de su primer hijo, una pareja sin padres conocidos
+        pasa a la capa de su pareja, y los hijos siempre quedan debajo de todos
+        sus padres. Dentro de cada capa se conserva el orden de `generaciones`.
+        """
+        ids = list(dict.fromkeys(pid for gen in generaciones for pid in gen))
+        idset = set(ids)
+        parents = {pid: [p for p in graph.parents.get(pid, []) if p in idset] for pid in ids}
+        children = {pid: [c for c in graph.children.get(pid, []) if c in idset] for pid in ids}
+        partners = {pid: [p for p in graph.partners.get(pid, []) if p in idset and p != pid] for pid in ids}
+
+        # Kahn; quien esté en un ciclo de padres (datos erróneos) se queda en la capa 0.
+        indeg = {pid: len(parents[pid]) for pid in ids}
+        topo = [pid for pid in ids if indeg[pid] == 0]
+        for pid in topo:
+            for c in children[pid]:
+                indeg[c] -= 1
+                if indeg[c] == 0:
+                    topo.append(c)
+
+        layer = {pid: 0 for pid in ids}
+
+        def _propagate() -> None:
+            for pid in topo:
+                for c in children[pid]:
+                    if layer[c] <= layer[pid]:
+                        layer[c] = layer[pid] + 1
+
+        _propagate()
+        for pid in ids:
+            if not parents[pid] and children[pid]:
+                layer[pid] = max(layer[pid], min(layer[c] for c in children[pid]) - 1)
+        for pid in ids:
+            if not parents[pid] and partners[pid]:
+                layer[pid] = max([layer[pid]] + [layer[p] for p in partners[pid]])
+        _propagate()
+
+        used = sorted(set(layer.values()))
+        remap = {v: i for i, v in enumerate(used)}
+        layers: List[List[str]] = [[] for _ in used]
+        for pid in ids:
+            layers[remap[layer[pid]]].append(pid)
+        return layers
+
+    def _calculate_positions_layered(self, generaciones: List[List[str]], graph: FamilyGraph, icon_size: float,
+                                     spacing_x: float, spacing_y: float, couple_spacing: float,
+                                     start_x: float, start_y: float, sweeps: int = 8) -> Dict:
+        """Layout por capas (estilo Sugiyama) para familias grandes.
+
+        1. Capas: `_assign_layers`.
+        2. Bloques: las parejas de una misma capa se colocan juntas.
+        3. Orden: barridos del baricentro (padres hacia abajo, hijos hacia
+           arriba), conservando el orden con menos cruces padre-hijo.
+        4. Coordenada x: cada bloque busca quedar centrado bajo sus padres o
+           sobre sus hijos; los solapamientos se resuelven por capa con
+           regresión isotónica, que mueve lo mínimo respetando el orden y la
+           separación. El último paso centra a los padres sobre sus hijos.
+        Lineal en personas y relaciones por barrido, salvo la ordenación.
+        """
+        layers = self._assign_layers(generaciones, graph)
+        layer_of = {pid: li for li, ids in enumerate(layers) for pid in ids}
+
+        # Bloques: parejas en la misma capa (union-find), en el orden inicial.
+        blocks_by_layer: List[List[List[str]]] = []
+        for ids in layers:
+            root = {pid: pid for pid in ids}
+
+            def _find(x: str) -> str:
+                while root[x] != x:
+                    root[x] = root[root[x]]
+                    x = root[x]
+                return x
+
+            for pid in ids:
+                for q in graph.partners.get(pid, []):
+                    if q in root:
+                        root[_find(q)] = _find(pid)
+            groups: Dict[str, List[str]] = {}
+            for pid in ids:
+                groups.setdefault(_find(pid), []).append(pid)
+            blocks = []
+            for members in groups.values():
+                if len(members) > 2:
+                    # Quien tiene varias parejas queda en medio de ellas.
+                    hub = max(members, key=lambda m: len(graph.partners.get(m, [])))
+                    rest = [m for m in members if m != hub]
+                    members = rest[:len(rest) // 2] + [hub] + rest[len(rest) // 2:]
+                blocks.append(members)
+            blocks_by_layer.append(blocks)
+
+        rank: Dict[str, float] = {}
+
+        def _set_ranks(li: int) -> None:
+            for bi, members in enumerate(blocks_by_layer[li]):
+                for mi, pid in enumerate(members):
+                    rank[pid] = bi + mi / (len(members) + 1.0)
+
+        for li in range(len(layers)):
+            _set_ranks(li)
+
+        def _crossings() -> int:
+            # Una línea por hijo desde el punto medio de sus padres (como la dibuja _render_all_relations).
+            total = 0
+            for li in range(1, len(layers)):
+                edges = []
+                for c in layers[li]:
+                    ps = [p for p in graph.parents.get(c, []) if layer_of.get(p) == li - 1]
+                    if ps:
+                        edges.append((sum(rank[p] for p in ps) / len(ps), rank[c]))
+                edges.sort()
+                total += _count_inversions([c for _, c in edges])
+            return total
+
+        def _sweep(li: int, neighbours: Dict[str, List[str]], other: int) -> None:
+            keyed = []
+            for bi, members in enumerate(blocks_by_layer[li]):
+                near = [rank[n] for m in members for n in neighbours.get(m, []) if layer_of.get(n) == other]
+                keyed.append((sum(near) / len(near) if near else float(bi), bi, members))
+            keyed.sort(key=lambda t: (t[0], t[1]))
+            blocks_by_layer[li] = [members for _, _, members in keyed]
+            _set_ranks(li)
+
+        best = _crossings()
+        best_blocks = [list(b) for b in blocks_by_layer]
+        for it in range(sweeps):
+            if best == 0:
+                break
+            if it % 2 == 0:
+                for li in range(1, len(layers)):
+                    _sweep(li, graph.parents, li - 1)
+            else:
+                for li in range(len(layers) - 2, -1, -1):
+                    _sweep(li, graph.children, li + 1)
+            c = _crossings()
+            if c < best:
+                best, best_blocks = c, [list(b) for b in blocks_by_layer]
+        blocks_by_layer = best_blocks
+
+        # Colocación horizontal.
+        gap = max(spacing_x - icon_size, icon_size)
+        offset: Dict[str, float] = {}
+        widths: List[List[float]] = []
+        lefts: List[List[float]] = []
+        for blocks in blocks_by_layer:
+            w_layer, l_layer, x = [], [], 0.0
+            for members in blocks:
+                for mi, pid in enumerate(members):
+                    offset[pid] = mi * couple_spacing
+                w = (len(members) - 1) * couple_spacing + icon_size
+                w_layer.append(w)
+                l_layer.append(x)
+                x += w + gap
+            widths.append(w_layer)
+            lefts.append(l_layer)
+
+        center: Dict[str, float] = {}
+
+        def _update_centers(li: int) -> None:
+            for members, left in zip(blocks_by_layer[li], lefts[li]):
+                for pid in members:
+                    center[pid] = left + offset[pid] + icon_size / 2
+
+        for li in range(len(layers)):
+            _update_centers(li)
+
+        def _place(li: int, neighbours: Dict[str, List[str]], above: bool) -> None:
+            targets, weights = [], []
+            for members, left in zip(blocks_by_layer[li], lefts[li]):
+                wanted = []
+                for m in members:
+                    near = [center[n] for n in neighbours.get(m, [])
+                            if n in layer_of and (layer_of[n] < li if above else layer_of[n] > li)]
+                    if near:
+                        wanted.append(sum(near) / len(near) - offset[m] - icon_size / 2)
+                if wanted:
+                    targets.append(sum(wanted) / len(wanted))
+                    weights.append(1.0)
+                else:
+                    targets.append(left)
+                    weights.append(0.05)
+            # left[j] >= left[j-1] + width[j-1] + gap  <=>  left[j] - shift[j] no decreciente
+            shift, acc = [], 0.0
+            for w in widths[li]:
+                shift.append(acc)
+                acc += w + gap
+            z = _pav_non_decreasing([t - s for t, s in zip(targets, shift)], weights)
+            lefts[li] = [zi + s for zi, s in zip(z, shift)]
+            _update_centers(li)
+
+        for _ in range(3):
+            for li in range(1, len(layers)):
+                _place(li, graph.parents, True)
+            for li in range(len(layers) - 2, -1, -1):
+                _place(li, graph.children, False)
+
+        min_left = min((l for layer_lefts in lefts for l in layer_lefts), default=0.0)
+        posiciones = {}
+        for li, blocks in enumerate(blocks_by_layer):
+            y = start_y + li * spacing_y
+            for members, left in zip(blocks, lefts[li]):
+                for pid in members:
+                    posiciones[pid] = {'x': round(start_x + left - min_left + offset[pid], 1), 'y': y}
+        return posiciones
+
+    def _graphviz_digraph(self, layers: List[List[str]], graph: FamilyGraph, icon_size: float,
+                          spacing_x: float, spacing_y: float, couple_spacing: float,
+                          personas: Optional[List[Dict]] = None) -> Tuple["graphviz.Digraph", Dict[str, str], Dict[tuple, str]]:
+        """Grafo `dot` de la familia: una fila (rank=same) por generación, un
+        nodo punto entre cada pareja del que cuelgan sus hijos comunes.
+
+        Sin `personas` los nodos son cajas vacías del tamaño del icono (sólo
+        interesan sus coordenadas); con `personas` llevan nombre y edad, con
+        cuadrado/círculo según el género, para exportar a PDF/PNG.
+        `dot` no acerca una pareja más que `nodesep`: `couple_spacing` se aplica
+        como `minlen` de las aristas de pareja (distancia mínima entre ellos).
+        Devuelve el grafo, {id persona: nombre de nodo} y {pareja: nodo unión}.
+        """
+        if graphviz is None:
+            raise RuntimeError("el paquete 'graphviz' no está instalado")
+        inch = 72.0
+        gap = max(spacing_x - icon_size, icon_size)
+        # Separación mínima de cada mitad (persona-unión) en múltiplos de nodesep.
+        couple_len = max(1, math.ceil((couple_spacing - icon_size) / 2 / gap))
+        dot = graphviz.Digraph('genograma', graph_attr={
+            'rankdir': 'TB',
+            'splines': 'ortho',
+            'nodesep': f"{gap / inch:.3f}",
+            'ranksep': f"{(spacing_y - icon_size) / inch:.3f}",
+        }, node_attr={
+            'shape': 'box',
+            'fixedsize': 'true',
+            'width': f"{icon_size / inch:.3f}",
+            'height': f"{icon_size / inch:.3f}",
+            'label': '',
+        }, edge_attr={'arrowhead': 'none'})
+
+        # Nombres de nodo seguros: los ids pueden traer cualquier cosa que haya escrito el modelo.
+        names = {pid: f"n{i}" for i, pid in enumerate(pid for ids in layers for pid in ids)}
+        by_id = {p['id']: p for p in (personas or [])}
+        unions: Dict[tuple, str] = {}
+        for ids in layers:
+            with dot.subgraph() as row:
+                row.attr(rank='same')
+                for pid in ids:
+                    p = by_id.get(pid)
+                    if p is None:
+                        row.node(names[pid])
+                        continue
+                    label = str(p.get('nombre') or pid)
+                    if p.get('edad'):
+                        label += f"\\n{p.get('edad')}"
+                    row.node(names[pid], label=label, fixedsize='false',
+                             shape='circle' if p.get('genero') == 'femenino' else 'box',
+                             peripheries='2' if 'consultante' in (p.get('condiciones') or []) else '1')
+                in_row = set(ids)
+                for key in graph.couples:
+                    if key[0] in in_row and key[1] in in_row:
+                        u = unions[key] = f"u{len(unions)}"
+                        row.node(u, shape='point', width='0.02', height='0.02')
+                        # a -> u -> b mantiene a la pareja junta con la unión en medio.
+                        row.edge(names[key[0]], u, minlen=str(couple_len))
+                        row.edge(u, names[key[1]], minlen=str(couple_len))
+
+        for key in graph.couples:
+            if key not in unions and key[0] in names and key[1] in names:
+                # Pareja en generaciones distintas: se dibuja, sin restricción de fila.
+                dot.edge(names[key[0]], names[key[1]], constraint='false', style='dashed')
+        for child, parents in graph.parents.items():
+            if child not in names:
+                continue
+            placed = [p for p in parents if p in names]
+            key = tuple(sorted(placed)) if len(placed) == 2 else None
+            if key in unions:
+                dot.edge(unions[key], names[child])
+            else:
+                for p in placed:
+                    dot.edge(names[p], names[child])
+        return dot, names, unions
+
+    def _calculate_positions_graphviz(self, generaciones: List[List[str]], graph: FamilyGraph, icon_size: float,
+                                      spacing_x: float, spacing_y: float, couple_spacing: float,
+                                      start_x: float, start_y: float) -> Dict:
+        """Posiciones calculadas por Graphviz `dot` (mismas generaciones que el
+        layout por capas). Lanza una excepción si no está el paquete o el
+        ejecutable `dot`; `create_genogram` vuelve entonces al layout por capas.
+        Las parejas que `dot` deja más separadas que `couple_spacing` se acercan
+        a su nodo unión.
+        """
+        layers = self._assign_layers(generaciones, graph)
+        dot, names, unions = self._graphviz_digraph(layers, graph, icon_size, spacing_x, spacing_y, couple_spacing)
+        plain = dot.pipe(format='plain', encoding='utf-8')
+        # "node <nombre> <x> <y> <w> <h> ..." en pulgadas, origen abajo a la izquierda.
+        coords: Dict[str, float] = {}
+        for line in plain.splitlines():
+            parts = line.split()
+            if len(parts) >= 4 and parts[0] == 'node':
+                coords[parts[1]] = float(parts[2]) * 72.0
+        if not coords:
+            raise RuntimeError("dot no devolvió coordenadas")
+        min_x = min(coords.get(names[pid], 0.0) for ids in layers for pid in ids)
+        posiciones = {}
+        for li, ids in enumerate(layers):
+            for pid in ids:
+                cx = coords.get(names[pid], min_x)
+                posiciones[pid] = {'x': round(start_x + cx - min_x, 1), 'y': start_y + li * spacing_y}
+
+        # Sólo personas con una única pareja en su fila: al acercarlas no pisan a nadie.
+        per_person: Dict[str, int] = {}
+        for key in unions:
+            for pid in key:
+                per_person[pid] = per_person.get(pid, 0) + 1
+        for key, u in unions.items():
+            a, b = key
+            if per_person[a] > 1 or per_person[b] > 1 or u not in coords:
+                continue
+            left, right = sorted(key, key=lambda pid: posiciones[pid]['x'])
+            if posiciones[right]['x'] - posiciones[left]['x'] > couple_spacing:
+                mid = start_x + coords[u] - min_x
+                posiciones[left]['x'] = round(mid - couple_spacing / 2, 1)
+                posiciones[right]['x'] = round(mid + couple_spacing / 2, 1)
+        return posiciones
+
+    def export_genogram_graphviz(self, family_data: Dict, output_file: str = "genograma", fmt: str = 'pdf',
+                                 options: Optional[Dict] = None) -> str:
+        """Exporta el genograma con Graphviz a `<output_file>.<fmt>` (pdf, png, svg).
+
+        Dibuja cuadrados/círculos con nombre y edad, no los iconos SVG del HTML.
+        `options` admite icon_size, spacing_x, spacing_y y couple_spacing, como
+        `create_genogram`. Requiere el paquete `graphviz` y el ejecutable `dot`
+        en el PATH.
+        """
+        if fmt not in GRAPHVIZ_EXPORT_FORMATS:
+            raise ValueError(f"formato no soportado: {fmt}")
+        options = options or {}
+        personas, relaciones, graph = self._prepare_family(family_data)
+        layers = self._assign_layers(self._organize_generations(personas, relaciones, graph), graph)
+        dot, _, _ = self._graphviz_digraph(
+            layers, graph,
+            options.get('icon_size') or 50,
+            options.get('spacing_x') or 180,
+            options.get('spacing_y') or 180,
+            options.get('couple_spacing') or 120,
+            personas=personas,
+        )
+        out_p = Path(f"{output_file}.{fmt}")
+        out_p.parent.mkdir(parents=True, exist_ok=True)
+        return str(Path(dot.render(outfile=str(out_p), format=fmt, cleanup=True)).absolute())
+
+    def _render_all_relations(self, relaciones: List[Dict], posiciones: Dict, personas: List[Dict], icon_size: float,
+                              graph: Optional[FamilyGraph] = None) -> str:
         """
         Renderiza relaciones de manera robusta:
         - Línea horizontal para cada pareja
         - Línea T-junction hacia sus hijos comunes
         - Línea directa para padres solteros
         """
-        svg = ""
+        graph = graph or FamilyGraph(personas, relaciones)
+        svg: List[str] = []
         
         # 1. Identificar parejas y agrupar hijos por unidad familiar
         unidades_familiares = {}
         hijos_para_solteros = {}  # padre_id -> set([hijos])
         
         # Primero buscar relaciones de pareja explícitas
-        for rel in relaciones:
-            if rel.get('tipo', 'pareja') == 'pareja':
-                p1, p2 = rel.get('persona1_id'), rel.get('persona2_id')
-                if p1 in posiciones and p2 in posiciones:
-                    key = tuple(sorted([p1, p2]))
-                    if key not in unidades_familiares:
-                        unidades_familiares[key] = {'hijos': set(), 'rel_pareja': rel}
+        for key, rel in graph.couples.items():
+            if key[0] in posiciones and key[1] in posiciones:
+                unidades_familiares[key] = {'hijos': set(), 'rel_pareja': rel}
 
         # Asociar hijos a parejas (si ambos son padres) o a solteros
-        for rel in relaciones:
-            if rel.get('tipo', 'padre-hijo') == 'padre-hijo':
-                padre, hijo = rel.get('persona1_id'), rel.get('persona2_id')
-                if padre in posiciones and hijo in posiciones:
-                    encontrada_unidad = False
-                    for key in unidades_familiares:
-                        if padre in key:
-                            # Strict association: only if both members of the unit are parents of the same child
-                            other_parent = key[1] if key[0] == padre else key[0]
-                            is_shared = any(r.get('tipo', 'padre-hijo') == 'padre-hijo' and 
-                                           r.get('persona1_id') == other_parent and 
-                                           r.get('persona2_id') == hijo for r in relaciones)
-                            if is_shared:
-                                unidades_familiares[key]['hijos'].add(hijo)
-                                encontrada_unidad = True
-                                break # avoid adding to other pairs the parent might have
-                    
-                    if not encontrada_unidad:
-                        if padre not in hijos_para_solteros:
-                            hijos_para_solteros[padre] = set()
-                        hijos_para_solteros[padre].add(hijo)
+        for padre, hijo in graph.edge_order:
+            if padre in posiciones and hijo in posiciones:
+                encontrada_unidad = False
+                for other_parent in graph.partners.get(padre, []):
+                    key = tuple(sorted((padre, other_parent)))
+                    # Strict association: only if both members of the unit are parents of the same child
+                    if key in unidades_familiares and graph.is_parent(other_parent, hijo):
+                        unidades_familiares[key]['hijos'].add(hijo)
+                        encontrada_unidad = True
+                        break # avoid adding to other pairs the parent might have
+
+                if not encontrada_unidad:
+                    if padre not in hijos_para_solteros:
+                        hijos_para_solteros[padre] = set()
+                    hijos_para_solteros[padre].add(hijo)
 
         # 2. Renderizar Unidades Familiares (Parejas + Hijos comunes)
         for i, (pair_key, info) in enumerate(unidades_familiares.items()):
@@ -797,17 +1872,17 @@ class GenogramGenerator:
             y_joint = max(p1_pos['y'], p2_pos['y']) + icon_size + offset_y
             
             # Dibujar conexión de pareja
-            svg += f'  <line x1="{x1}" y1="{p1_pos["y"] + icon_size}" x2="{x1}" y2="{y_joint}" stroke="black" stroke-width="2"/>\n'
-            svg += f'  <line x1="{x2}" y1="{p2_pos["y"] + icon_size}" x2="{x2}" y2="{y_joint}" stroke="black" stroke-width="2"/>\n'
-            svg += f'  <line x1="{x1}" y1="{y_joint}" x2="{x2}" y2="{y_joint}" stroke="black" stroke-width="2"/>\n'
+            svg.append(f'  <line x1="{x1}" y1="{p1_pos["y"] + icon_size}" x2="{x1}" y2="{y_joint}" stroke="black" stroke-width="2"/>\n')
+            svg.append(f'  <line x1="{x2}" y1="{p2_pos["y"] + icon_size}" x2="{x2}" y2="{y_joint}" stroke="black" stroke-width="2"/>\n')
+            svg.append(f'  <line x1="{x1}" y1="{y_joint}" x2="{x2}" y2="{y_joint}" stroke="black" stroke-width="2"/>\n')
             
             # Icono estado civil centrado
             cx = (x1 + x2) / 2
             estado_icon = self.get_relation_icon_path(rel_pareja)
             if estado_icon:
-                icon_svg = self.load_svg(estado_icon)
+                icon_svg = self.icon_reference(estado_icon)
                 if icon_svg:
-                    svg += f'  <g transform="translate({cx - 15}, {y_joint - 15}) scale(0.6)">{icon_svg}</g>\n'
+                    svg.append(f'  <g transform="translate({cx - 15}, {y_joint - 15}) scale(0.6)">{icon_svg}</g>\n')
 
             # Dibujar conexión a hijos (solo si están ABAJO de los padres)
             hijos_descendientes = [h for h in hijos if posiciones[h]['y'] > max(p1_pos['y'], p2_pos['y'])]
@@ -816,15 +1891,15 @@ class GenogramGenerator:
                 y_hijos_dist = y_min_hijos - 30 
                 
                 # Center vertical line to distribution
-                svg += f'  <line x1="{cx}" y1="{y_joint}" x2="{cx}" y2="{y_hijos_dist}" stroke="black" stroke-width="2"/>\n'
+                svg.append(f'  <line x1="{cx}" y1="{y_joint}" x2="{cx}" y2="{y_hijos_dist}" stroke="black" stroke-width="2"/>\n')
                 
                 hx_coords = [posiciones[h]['x'] + icon_size/2 for h in hijos_descendientes]
                 if len(hijos_descendientes) > 1:
-                    svg += f'  <line x1="{min(hx_coords)}" y1="{y_hijos_dist}" x2="{max(hx_coords)}" y2="{y_hijos_dist}" stroke="black" stroke-width="2"/>\n'
+                    svg.append(f'  <line x1="{min(hx_coords)}" y1="{y_hijos_dist}" x2="{max(hx_coords)}" y2="{y_hijos_dist}" stroke="black" stroke-width="2"/>\n')
                 
                 for h_id in hijos_descendientes:
                     h_pos = posiciones[h_id]
-                    svg += f'  <line x1="{h_pos["x"] + icon_size/2}" y1="{y_hijos_dist}" x2="{h_pos["x"] + icon_size/2}" y2="{h_pos["y"]}" stroke="black" stroke-width="1.5"/>\n'
+                    svg.append(f'  <line x1="{h_pos["x"] + icon_size/2}" y1="{y_hijos_dist}" x2="{h_pos["x"] + icon_size/2}" y2="{h_pos["y"]}" stroke="black" stroke-width="1.5"/>\n')
 
         # 3. Renderizar Solteros (Padres con hijos no compartidos)
         for padre_id, hijos_ids in hijos_para_solteros.items():
@@ -839,30 +1914,27 @@ class GenogramGenerator:
                 y_min_h = min([posiciones[h]['y'] for h in hijos_desc])
                 y_dist = y_min_h - 25
                 
-                svg += f'  <line x1="{px}" y1="{p_pos["y"] + icon_size}" x2="{px}" y2="{y_dist}" stroke="black" stroke-width="2"/>\n'
+                svg.append(f'  <line x1="{px}" y1="{p_pos["y"] + icon_size}" x2="{px}" y2="{y_dist}" stroke="black" stroke-width="2"/>\n')
                 
                 hx_c = [posiciones[h]['x'] + icon_size/2 for h in hijos_desc]
                 if len(hijos_desc) > 1:
-                    svg += f'  <line x1="{min(hx_c)}" y1="{y_dist}" x2="{max(hx_c)}" y2="{y_dist}" stroke="black" stroke-width="2"/>\n'
+                    svg.append(f'  <line x1="{min(hx_c)}" y1="{y_dist}" x2="{max(hx_c)}" y2="{y_dist}" stroke="black" stroke-width="2"/>\n')
                 
                 for h_id in hijos_desc:
                     h_p = posiciones[h_id]
-                    svg += f'  <line x1="{h_p["x"] + icon_size/2}" y1="{y_dist}" x2="{h_p["x"] + icon_size/2}" y2="{h_p["y"]}" stroke="black" stroke-width="1.5"/>\n'
+                    svg.append(f'  <line x1="{h_p["x"] + icon_size/2}" y1="{y_dist}" x2="{h_p["x"] + icon_size/2}" y2="{h_p["y"]}" stroke="black" stroke-width="1.5"/>\n')
                     
-        return svg
+        return ''.join(svg)
     
-    def _organize_generations(self, personas: List[Dict], relaciones: List[Dict]) -> List[List[str]]:
+    def _organize_generations(self, personas: List[Dict], relaciones: List[Dict],
+                              graph: Optional[FamilyGraph] = None) -> List[List[str]]:
         """Organiza personas en generaciones basándose en relaciones padre-hijo"""
+        graph = graph or FamilyGraph(personas, relaciones)
         generaciones = []
         personas_procesadas = set()
         
         # Encontrar raíces (personas sin padres mencionados)
-        personas_con_padres = set()
-        for rel in relaciones:
-            if rel.get('tipo', 'padre-hijo') == 'padre-hijo':
-                personas_con_padres.add(rel['persona2_id'])
-        
-        raices = [p['id'] for p in personas if p['id'] not in personas_con_padres]
+        raices = graph.roots()
         
         if not raices:
             return [[p['id'] for p in personas]]
@@ -875,14 +1947,7 @@ class GenogramGenerator:
             personas_procesadas.update(generacion_actual)
             
             # Encontrar hijos de la generación actual
-            siguiente_generacion = []
-            for rel in relaciones:
-                if rel.get('tipo', 'padre-hijo') == 'padre-hijo' and rel['persona1_id'] in generacion_actual:
-                    hijo_id = rel['persona2_id']
-                    if hijo_id not in personas_procesadas and hijo_id not in siguiente_generacion:
-                        siguiente_generacion.append(hijo_id)
-            
-            generacion_actual = siguiente_generacion
+            generacion_actual = graph.next_generation(generacion_actual, personas_procesadas)
         
         # Agregar personas no procesadas (como hijos que no tienen padres en la lista)
         no_procesadas = [p['id'] for p in personas if p['id'] not in personas_procesadas]
@@ -1087,54 +2152,42 @@ class GenogramGenerator:
 
         - `patient_folder` es el nombre de la carpeta del paciente (ej: 'patient_elisa').
         - `base_paths` lista de carpetas raíz donde buscar (por defecto ['outputs','recordings']).
-        Retorna una sola cadena con todo el texto concatenado.
+        Retorna una sola cadena con todo el texto concatenado: un solo archivo por
+        sesión, sin tiempos ni cabeceras (ver `load_transcript_sources`).
         """
         if base_paths is None:
             base_paths = ['outputs', 'recordings']
 
         project_root = Path(__file__).resolve().parents[1]
-        collected = []
-        found_files = []
+        sources, stats = self._load_sources(self.list_transcription_files(patient_folder, base_paths))
 
-        for base in base_paths:
-            candidate_dir = project_root / base / patient_folder
-            if not candidate_dir.exists():
-                continue
-
-            for root, _, files in os.walk(candidate_dir):
-                for fname in sorted(files):
-                    if not fname.lower().endswith(('.txt', '.json', '.md')):
-                        continue
-                    fpath = Path(root) / fname
-                    try:
-                        with open(fpath, 'r', encoding='utf-8') as fh:
-                            text = fh.read().strip()
-                            if text:
-                                header = f"\n\n--- SESSION: {fpath.relative_to(project_root)} ---\n\n"
-                                collected.append(header + text)
-                                found_files.append(str(fpath))
-                    except Exception as e:
-                        print(f"No se pudo leer {fpath}: {e}")
-
-        if not collected:
+        if not sources:
             raise FileNotFoundError(f"No se encontraron transcripciones para '{patient_folder}' en {base_paths}")
 
+        collected = []
+        for fpath, text in sources:
+            try:
+                rel = fpath.resolve().relative_to(project_root)
+            except ValueError:
+                rel = fpath
+            collected.append(f"\n\n--- SESSION: {rel} ---\n\n" + text)
+
         # Loguear qué archivos se tomaron (rutas y tamaños)
-        try:
-            print(f"DEBUG: collect_transcriptions patient_folder={patient_folder} base_paths={base_paths}")
-            print(f"DEBUG: archivos encontrados: {len(found_files)}")
-            for f in found_files:
-                try:
-                    sz = os.path.getsize(f)
-                except Exception:
-                    sz = 'unknown'
-                print(f"  - {f} (size={sz} bytes)")
-        except Exception as e:
-            print(f"DEBUG: error al imprimir detalles de transcripciones: {e}")
+        print(f"DEBUG: collect_transcriptions patient_folder={patient_folder} base_paths={base_paths}")
+        print(f"DEBUG: archivos usados: {len(sources)} de {stats['files']}")
+        for fpath, text in sources:
+            print(f"  - {fpath} ({len(text)} caracteres)")
 
         # Concatenar en orden cronológico si fuera necesario (ya usamos sorted filenames)
         return '\n'.join(collected)
 
+    def _load_sources(self, files: List[Path]) -> Tuple[List[Tuple[Path, str]], Dict]:
+        sources, stats = load_transcript_sources(files)
+        self.last_source_stats = stats
+        print(f"DEBUG: transcripciones: {stats['sessions']} fuentes de {stats['files']} archivos, "
+              f"~{stats['raw_tokens']} -> ~{stats['tokens']} tokens (x{stats['reduction']})", file=sys.stderr)
+        return sources, stats
+
     def process_patient_sessions(self, patient_folder: str, output_file: str = "genograma") -> str:
         """Genera el genograma usando todas las transcripciones encontradas para `patient_folder`.
 
@@ -1208,86 +2261,218 @@ class GenogramGenerator:
             if not candidate_dir.exists():
                 continue
 
-            for root, _, files in os.walk(candidate_dir):
+            for root, dirs, files in os.walk(candidate_dir):
+                dirs[:] = sorted(d for d in dirs if d not in GENERATED_DIRS and not d.startswith('.'))
                 for fname in sorted(files):
-                    if not fname.lower().endswith(('.txt', '.json', '.md')):
+                    if (not fname.lower().endswith(('.txt', '.json', '.md')) or fname in GENERATED_FILES
+                            or fname.endswith(FAMILY_JSON_SUFFIX)):
                         continue
                     found_files.append(Path(root) / fname)
 
         return found_files
 
-    def build_family_from_transcriptions_chunked(self, patient_folder: str, base_paths: Optional[List[str]] = None) -> Dict:
-        """Similar a `build_family_from_transcriptions` pero procesa cada sesión
-        por separado (evita enviar todo el texto en una sola llamada a Gemini).
+    def _save_failed_extraction(self, fpath: Path, text: str, msg: str) -> Path:
+        ts = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S%fZ')
+        outpath = Path(__file__).resolve().parents[1] / 'outputs' / f'failed_extraction_{ts}.txt'
+        outpath.parent.mkdir(parents=True, exist_ok=True)
+        with open(outpath, 'w', encoding='utf-8') as of:
+            of.write(f"ERROR: {msg}\n\nFILE: {fpath}\n\n{text[:1000]}")
+        return outpath
+
+    def _extract_sessions(self, items: List[tuple], max_workers: Optional[int] = None,
+                          rpm: Optional[float] = None) -> Dict[str, Dict]:
+        """Extrae la familia de varias sesiones `(clave, ruta, texto)`.
+
+        Las sesiones ya extraídas salen de la caché sin llamar al modelo; el
+        resto se envía en paralelo (`max_workers`, GENOGRAM_WORKERS) bajo un
+        límite de llamadas por minuto (`rpm`, GENOGRAM_RPM) ajustado a la cuota
+        de Gemini. Un error de cuota pausa las llamadas el tiempo que indica el
+        servidor y reintenta esa sesión. Devuelve {clave: familia}; las sesiones
+        que fallan por otro motivo no aparecen.
+        """
+        max_workers = max_workers or int(os.environ.get('GENOGRAM_WORKERS') or 4)
+        rpm = rpm or float(os.environ.get('GENOGRAM_RPM') or 10)
+        max_retries = 4
 
-        Esto ayuda a no exceder cuotas/token limits; aún usa Gemini para cada
-        sesión y agrega resultados deduplicando.
+        results: Dict[str, Dict] = {}
+        pending = []
+        for key, fpath, text in items:
+            sent, note, _ = self._prepare_extraction(text)
+            cached = self._read_extraction_cache(self._extraction_cache_path(sent, note))
+            if cached is not None:
+                results[key] = cached
+            else:
+                pending.append((key, fpath, text))
+
+        print(f"DEBUG: extracción por sesión: {len(items)} sesiones, {len(results)} en caché, {len(pending)} a Gemini", file=sys.stderr)
+        if not pending:
+            return results
+
+        limiter = TokenBucket(rpm, burst=max_workers)
+        stop = threading.Event()
+
+        def _extract(fpath: Path, text: str) -> Optional[Dict]:
+            attempts = 0
+            while True:
+                limiter.acquire()
+                if stop.is_set():
+                    return None
+                try:
+                    return self.extract_family_info(text, use_cache=False)
+                except Exception as e:
+                    msg = str(e)
+                    if not _is_quota_error(msg):
+                        # Error que no es de cuota: se guarda la transcripción y se sigue
+                        self._save_failed_extraction(fpath, text, msg)
+                        return None
+                    attempts += 1
+                    if attempts > max_retries:
+                        outpath = self._save_failed_extraction(fpath, text, msg)
+                        raise RuntimeError(f"Gemini quota exhausted repeatedly; saved failing transcription to {outpath}")
+                    limiter.defer(_retry_delay(msg, attempts - 1))
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(pending))) as pool:
+            futures = {pool.submit(_extract, fpath, text): key for key, fpath, text in pending}
+            try:
+                for fut in as_completed(futures):
+                    data = fut.result()
+                    if data is not None:
+                        results[futures[fut]] = data
+            except Exception:
+                stop.set()
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise
+        return results
+
+    def family_graph_path(self, patient_folder: str) -> Path:
+        return Path(__file__).resolve().parents[1] / 'outputs' / patient_folder / FAMILY_GRAPH_FILENAME
+
+    def _load_family_graph(self, path: Path) -> Dict:
+        model = self.model_id or DEFAULT_MODEL_ID
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                graph = json.load(f)
+            if (graph.get('version') == FAMILY_GRAPH_VERSION and graph.get('model') == model
+                    and graph.get('prompt_version') == EXTRACTION_PROMPT_VERSION):
+                return graph
+        except Exception:
+            pass
+        return {'version': FAMILY_GRAPH_VERSION, 'model': model, 'prompt_version': EXTRACTION_PROMPT_VERSION, 'sessions': {}}
+
+    @staticmethod
+    def merge_session_families(sessions: Dict[str, Dict]) -> Dict:
+        """Combina las personas y relaciones de cada sesión, en el orden de `sessions`.
+
+        Un dato de una sesión posterior sustituye al anterior sólo si no está
+        vacío; `condiciones` se acumulan. Cada persona y relación lleva en
+        `fuentes` las sesiones que la mencionan.
+        """
+        personas: Dict[str, Dict] = {}
+        relaciones: Dict[tuple, Dict] = {}
+        for source, family in sessions.items():
+            for p in family.get('personas', []):
+                pid = p.get('id')
+                if not pid:
+                    continue
+                cur = personas.setdefault(pid, {'id': pid, 'fuentes': []})
+                for k, v in p.items():
+                    if k == 'condiciones':
+                        cur['condiciones'] = list(dict.fromkeys((cur.get('condiciones') or []) + list(v or [])))
+                    elif k != 'fuentes' and (v not in (None, '', []) or k not in cur):
+                        cur[k] = v
+                if source not in cur['fuentes']:
+                    cur['fuentes'].append(source)
+            for r in family.get('relaciones', []):
+                key = (r.get('tipo'), r.get('persona1_id'), r.get('persona2_id'))
+                if not key[1] or not key[2]:
+                    continue
+                cur = relaciones.setdefault(key, {'fuentes': []})
+                for k, v in r.items():
+                    if k != 'fuentes' and (v not in (None, '', []) or k not in cur):
+                        cur[k] = v
+                if source not in cur['fuentes']:
+                    cur['fuentes'].append(source)
+        return {'personas': list(personas.values()), 'relaciones': list(relaciones.values())}
+
+    def update_family_graph(self, patient_folder: str, base_paths: Optional[List[str]] = None,
+                            max_workers: Optional[int] = None, rpm: Optional[float] = None) -> Dict:
+        """Actualiza `outputs/<paciente>/family_graph.json` y lo devuelve.
+
+        El grafo guarda, por archivo de sesión, el hash de su contenido y las
+        personas/relaciones extraídas de él. Sólo las sesiones nuevas o
+        modificadas se envían a Gemini; las que ya no existen se eliminan. Si la
+        extracción de una sesión modificada falla se conserva la anterior. Las
+        listas `personas`/`relaciones` del grafo son la combinación de todas las
+        sesiones con su procedencia (ver `merge_session_families`).
         """
         files = self.list_transcription_files(patient_folder, base_paths)
         if not files:
             raise FileNotFoundError(f"No se encontraron transcripciones para '{patient_folder}'")
 
-        personas_map: Dict[str, Dict] = {}
-        relaciones_set = set()
-        # Process sessions in small batches with retry/backoff on quota errors
-        batch_size = 3
-        max_retries = 4
-        base_delay = 10
-
-        for i in range(0, len(files), batch_size):
-            batch = files[i:i+batch_size]
-            for fpath in batch:
-                try:
-                    with open(fpath, 'r', encoding='utf-8') as fh:
-                        text = fh.read().strip()
-                    if not text:
-                        continue
+        project_root = Path(__file__).resolve().parents[1]
+        graph_path = self.family_graph_path(patient_folder)
+        graph = self._load_family_graph(graph_path)
+        known = graph.get('sessions') or {}
+
+        sources, _ = self._load_sources(files)
+        current: Dict[str, tuple] = {}
+        for fpath, text in sources:
+            key = fpath.resolve().relative_to(project_root).as_posix() if project_root in fpath.resolve().parents else str(fpath)
+            current[key] = (fpath, text, hashlib.sha1(text.encode('utf-8')).hexdigest())
+
+        changed = [k for k, (_, _, h) in current.items() if (known.get(k) or {}).get('hash') != h]
+        extracted = self._extract_sessions([(k, current[k][0], current[k][1]) for k in changed], max_workers, rpm) if changed else {}
+
+        sessions: Dict[str, Dict] = {}
+        now = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+        for key, (_, _, h) in current.items():
+            if key in extracted:
+                family = extracted[key]
+                sessions[key] = {
+                    'hash': h,
+                    'extracted_at': now,
+                    'personas': family.get('personas', []),
+                    'relaciones': family.get('relaciones', []),
+                }
+            elif key in known:
+                # Si la nueva extracción falla se conserva la anterior; el hash viejo hace que se reintente.
+                sessions[key] = known[key]
+
+        merged = self.merge_session_families(sessions)
+        removed = [k for k in known if k not in current]
+        graph.update({
+            'updated_at': now,
+            'sessions': sessions,
+            'personas': merged['personas'],
+            'relaciones': merged['relaciones'],
+        })
+        # Una sesión que sólo ha fallado no cambia nada que merezca reescribir el archivo.
+        if extracted or removed:
+            try:
+                graph_path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = graph_path.with_name(f"{graph_path.name}.{os.getpid()}.tmp")
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    json.dump(graph, f, ensure_ascii=False, indent=2)
+                os.replace(tmp, graph_path)
+            except Exception as e:
+                print(f"DEBUG: no se pudo guardar {graph_path}: {e}", file=sys.stderr)
+        print(f"DEBUG: family_graph {patient_folder}: {len(sessions)} sesiones, nuevas/modificadas={len(extracted)}, "
+              f"fallidas={len(changed) - len(extracted)}, eliminadas={len(removed)}", file=sys.stderr)
+        return graph
+
+    def build_family_from_transcriptions_chunked(self, patient_folder: str, base_paths: Optional[List[str]] = None,
+                                                 max_workers: Optional[int] = None, rpm: Optional[float] = None) -> Dict:
+        """Similar a `build_family_from_transcriptions` pero procesa cada sesión
+        por separado (evita enviar todo el texto en una sola llamada a Gemini).
 
-                    attempts = 0
-                    while True:
-                        try:
-                            session_family = self.extract_family_info(text)
-                            for p in session_family.get('personas', []):
-                                personas_map[p['id']] = p
-                            for r in session_family.get('relaciones', []):
-                                if r.get('tipo') == 'padre-hijo':
-                                    relaciones_set.add((r.get('tipo'), r.get('persona1_id'), r.get('persona2_id')))
-                            break
-                        except Exception as e:
-                            msg = str(e)
-                            # Detect quota errors and retry with backoff
-                            if 'RESOURCE_EXHAUSTED' in msg or 'quota' in msg.lower():
-                                # Try to parse retry seconds from message
-                                m = re.search(r"retry.*?(\d+\.?\d*)s", msg, re.IGNORECASE)
-                                if m:
-                                    delay = float(m.group(1)) + 1.0
-                                else:
-                                    delay = base_delay * (2 ** attempts)
-                                attempts += 1
-                                if attempts > max_retries:
-                                    # Save failing transcription for inspection and continue
-                                    ts = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
-                                    outpath = Path(__file__).resolve().parents[1] / 'outputs' / f'failed_extraction_{ts}.txt'
-                                    outpath.parent.mkdir(parents=True, exist_ok=True)
-                                    with open(outpath, 'w', encoding='utf-8') as of:
-                                        of.write(f"ERROR: {msg}\n\nFILE: {fpath}\n\n{text[:1000]}")
-                                    raise RuntimeError(f"Gemini quota exhausted repeatedly; saved failing transcription to {outpath}")
-                                time.sleep(delay)
-                                continue
-                            else:
-                                # Non-quota error: save transcription and continue
-                                ts = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
-                                outpath = Path(__file__).resolve().parents[1] / 'outputs' / f'failed_extraction_{ts}.txt'
-                                outpath.parent.mkdir(parents=True, exist_ok=True)
-                                with open(outpath, 'w', encoding='utf-8') as of:
-                                    of.write(f"ERROR: {msg}\n\nFILE: {fpath}\n\n{text[:1000]}")
-                                break
-                except Exception:
-                    # If the outer read/open fails, continue to next file
-                    continue
+        Las extracciones por sesión salen del grafo familiar persistido
+        (`update_family_graph`): sólo las sesiones nuevas llaman al modelo.
+        """
+        graph = self.update_family_graph(patient_folder, base_paths, max_workers, rpm)
 
-        personas = list(personas_map.values())
-        relaciones = [{'tipo': t, 'persona1_id': a, 'persona2_id': b} for (t, a, b) in relaciones_set]
+        # La combinación de las sesiones es la del grafo (`merge_session_families`); aquí sólo se filtra.
+        personas = [dict(p) for p in graph.get('personas', []) if p.get('id')]
+        relaciones = [dict(r) for r in graph.get('relaciones', [])]
 
         # Filter out grandparents like before
         gp_keywords = ('abuelo', 'abuela', 'abuelos')
@@ -1316,6 +2501,20 @@ class GenogramGenerator:
         family = self.build_family_from_transcriptions_chunked(patient_folder)
         return self.create_genogram(family, output_file)
 
+    def generate_genogram_from_family_graph(self, patient_folder: str, output_file: Optional[str] = None) -> str:
+        """Actualiza el grafo familiar del paciente (sólo sesiones nuevas) y
+        genera el genograma con todas las personas y relaciones acumuladas.
+        Por defecto escribe `outputs/<paciente>/genograma.html`.
+        """
+        graph = self.update_family_graph(patient_folder)
+        if output_file is None:
+            output_file = str(Path(__file__).resolve().parents[1] / 'outputs' / patient_folder / 'genograma')
+        family = {
+            'personas': [dict(p) for p in graph.get('personas', [])],
+            'relaciones': [dict(r) for r in graph.get('relaciones', [])],
+        }
+        return self.create_genogram(family, output_file)
+
     def _find_session_with_note(self, patient_folder: str, note_keyword: str = 'árbol') -> Optional[Path]:
         """Recorre las sesiones del paciente y devuelve la path a la transcripción
         de la sesión cuya información contenga `note_keyword` (case-insensitive).
@@ -1439,25 +2638,18 @@ class GenogramGenerator:
             print(f"ERROR: No existe la carpeta de sesión: {session_dir}")
             return None
         
-        # Buscar archivo de transcripción en la carpeta de sesión
-        transcription_file = None
-        for pattern in ['*_labeled.txt', '*_transcription.txt', '*.txt']:
-            matches = list(session_dir.glob(pattern))
-            if matches:
-                transcription_file = matches[0]
-                break
+        # Artefactos del pipeline de la sesión; si no hay, cualquier .txt (notas sueltas).
+        files = sorted(p for p in session_dir.iterdir()
+                       if p.is_file() and p.name.lower().endswith(TRANSCRIPT_SOURCE_SUFFIXES))
+        if not files:
+            files = sorted(p for p in session_dir.glob('*.txt') if not p.name.lower().endswith(SKIPPED_SOURCE_SUFFIXES))
         
-        if not transcription_file:
+        # Una fuente limpia por audio (sin tiempos, cabeceras ni resumen de hablantes)
+        sources, _ = self._load_sources(files)
+        if not sources:
             print(f"ERROR: No se encontró archivo de transcripción en {session_dir}")
             return None
-        
-        # Leer transcripción
-        try:
-            with open(transcription_file, 'r', encoding='utf-8') as fh:
-                session_text = fh.read()
-        except Exception as e:
-            print(f"ERROR leyendo transcripción: {e}")
-            return None
+        session_text = '\n\n'.join(text for _, text in sources)
         
         # Extraer información del paciente (similar al método anterior)
         patient_info = None
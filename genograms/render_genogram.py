@@ -0,0 +1,64 @@
+import sys
+import json
+import time
+import warnings
+from pathlib import Path
+
+# Silenciar advertencias en stdout para no romper el parser JSON del servidor
+warnings.filterwarnings("ignore")
+
+from genogram_model import GenogramGenerator, FAMILY_JSON_SUFFIX, GRAPHVIZ_EXPORT_FORMATS
+
+# Vuelve a dibujar un genograma desde su .family.json (guardado al generarlo),
+# junto al mismo JSON. No llama a Gemini. Acepta la ruta al .family.json que
+# devuelven los generadores o una carpeta de paciente
+# (outputs/<paciente>/genograma.family.json).
+#
+#   python genograms/render_genogram.py <patient_folder | ruta.family.json> ['{"layout": "simple", "spacing_x": 220}']
+#
+# Con "format": "pdf" | "png" | "svg" exporta con Graphviz (necesita el ejecutable `dot`).
+
+def main():
+    if len(sys.argv) < 2:
+        print(json.dumps({"ok": False, "error": "missing_patient_folder"}))
+        sys.exit(2)
+
+    target = sys.argv[1]
+    try:
+        options = json.loads(sys.argv[2]) if len(sys.argv) > 2 and sys.argv[2].strip() else {}
+    except Exception as e:
+        print(json.dumps({"ok": False, "error": "bad_options", "detail": str(e)}))
+        sys.exit(2)
+    fmt = options.get('format') or 'html'
+    if fmt != 'html' and fmt not in GRAPHVIZ_EXPORT_FORMATS:
+        print(json.dumps({"ok": False, "error": "bad_options", "detail": f"format: {fmt}"}))
+        sys.exit(2)
+
+    if target.endswith(FAMILY_JSON_SUFFIX):
+        family_json = Path(target)
+    else:
+        family_json = Path(__file__).resolve().parents[1] / 'outputs' / target / f'genograma{FAMILY_JSON_SUFFIX}'
+    if not family_json.exists():
+        print(json.dumps({"ok": False, "error": "family_json_not_found"}))
+        sys.exit(0)
+
+    g = GenogramGenerator(offline=True)
+    try:
+        t0 = time.perf_counter()
+        out = g.render_genogram_from_json(str(family_json), options=options)
+        render_ms = round((time.perf_counter() - t0) * 1000.0, 1)
+        print(json.dumps({"ok": True, "output": str(Path(out).resolve()), "render_ms": render_ms}))
+        sys.exit(0)
+    except RuntimeError as e:
+        if fmt == 'html':
+            print(json.dumps({"ok": False, "error": "exception", "detail": str(e)}))
+            sys.exit(1)
+        # Falta el paquete graphviz o el ejecutable `dot`.
+        print(json.dumps({"ok": False, "error": "graphviz_unavailable", "detail": str(e)}))
+        sys.exit(0)
+    except Exception as e:
+        print(json.dumps({"ok": False, "error": "exception", "detail": str(e)}))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -6,7 +6,7 @@ from pathlib import Path
 # Silenciar advertencias en stdout para no romper el parser JSON del servidor
 warnings.filterwarnings("ignore")
 
-from genogram_model import GenogramGenerator
+from genogram_model import GenogramGenerator, FAMILY_JSON_SUFFIX
 
 def main():
     if len(sys.argv) < 2:
@@ -15,7 +15,8 @@ def main():
     
     patient_folder = sys.argv[1]
     session_number = sys.argv[2] if len(sys.argv) > 2 else None
-    output_file = sys.argv[3] if len(sys.argv) > 3 else f'genograma_{patient_folder}_by_note'
+    # Misma ruta que generate_genogram_from_specific_session y /api/genograma: render_genogram.py la encuentra.
+    output_file = sys.argv[3] if len(sys.argv) > 3 else str(Path(__file__).resolve().parents[1] / 'outputs' / patient_folder / 'genograma')
 
     g = GenogramGenerator()
     try:
@@ -29,7 +30,8 @@ def main():
         if out:
             # Return relative path
             p = Path(out).resolve()
-            print(json.dumps({"ok": True, "output": str(p)}))
+            family_json = p.with_name(p.stem + FAMILY_JSON_SUFFIX)
+            print(json.dumps({"ok": True, "output": str(p), "family_json": str(family_json) if family_json.exists() else None}))
             sys.exit(0)
         else:
             print(json.dumps({"ok": False, "error": "no_session_with_note"}))
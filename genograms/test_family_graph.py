@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Prueba de regresión de FamilyGraph: las generaciones y las líneas de relación
+deben salir idénticas a las de la implementación anterior (que recorría la
+lista de relaciones en cada consulta) para familias aleatorias.
+
+No llama a Gemini. Los iconos de estado civil se desactivan en ambos lados.
+"""
+
+import copy
+import random
+import sys
+from pathlib import Path
+
+# Agregar el directorio actual al path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from genogram_model import GenogramGenerator
+
+
+# --- implementación anterior (referencia) ----------------------------------
+
+def _old_organize_generations(personas, relaciones):
+    generaciones = []
+    personas_procesadas = set()
+    personas_con_padres = set()
+    for rel in relaciones:
+        if rel.get('tipo', 'padre-hijo') == 'padre-hijo':
+            personas_con_padres.add(rel['persona2_id'])
+
+    raices = [p['id'] for p in personas if p['id'] not in personas_con_padres]
+    if not raices:
+        return [[p['id'] for p in personas]]
+
+    generacion_actual = raices
+    while generacion_actual:
+        generaciones.append(list(generacion_actual))
+        personas_procesadas.update(generacion_actual)
+        siguiente_generacion = []
+        for rel in relaciones:
+            if rel.get('tipo', 'padre-hijo') == 'padre-hijo' and rel['persona1_id'] in generacion_actual:
+                hijo_id = rel['persona2_id']
+                if hijo_id not in personas_procesadas and hijo_id not in siguiente_generacion:
+                    siguiente_generacion.append(hijo_id)
+        generacion_actual = siguiente_generacion
+
+    no_procesadas = [p['id'] for p in personas if p['id'] not in personas_procesadas]
+    if no_procesadas:
+        generaciones.append(no_procesadas)
+    return generaciones
+
+
+def _old_render_all_relations(relaciones, posiciones, icon_size):
+    svg = ""
+    unidades_familiares = {}
+    hijos_para_solteros = {}
+
+    for rel in relaciones:
+        if rel.get('tipo', 'pareja') == 'pareja':
+            p1, p2 = rel.get('persona1_id'), rel.get('persona2_id')
+            if p1 in posiciones and p2 in posiciones:
+                key = tuple(sorted([p1, p2]))
+                if key not in unidades_familiares:
+                    unidades_familiares[key] = {'hijos': set(), 'rel_pareja': rel}
+
+    for rel in relaciones:
+        if rel.get('tipo', 'padre-hijo') == 'padre-hijo':
+            padre, hijo = rel.get('persona1_id'), rel.get('persona2_id')
+            if padre in posiciones and hijo in posiciones:
+                encontrada_unidad = False
+                for key in unidades_familiares:
+                    if padre in key:
+                        other_parent = key[1] if key[0] == padre else key[0]
+                        is_shared = any(r.get('tipo', 'padre-hijo') == 'padre-hijo' and
+                                        r.get('persona1_id') == other_parent and
+                                        r.get('persona2_id') == hijo for r in relaciones)
+                        if is_shared:
+                            unidades_familiares[key]['hijos'].add(hijo)
+                            encontrada_unidad = True
+                            break
+                if not encontrada_unidad:
+                    hijos_para_solteros.setdefault(padre, set()).add(hijo)
+
+    for i, (pair_key, info) in enumerate(unidades_familiares.items()):
+        p1_id, p2_id = pair_key
+        hijos = sorted([h for h in info['hijos'] if h in posiciones])
+        p1_pos, p2_pos = posiciones[p1_id], posiciones[p2_id]
+        x1, x2 = p1_pos['x'] + icon_size/2, p2_pos['x'] + icon_size/2
+        offset_y = 30 + (i % 3 * 10)
+        y_joint = max(p1_pos['y'], p2_pos['y']) + icon_size + offset_y
+        svg += f'  <line x1="{x1}" y1="{p1_pos["y"] + icon_size}" x2="{x1}" y2="{y_joint}" stroke="black" stroke-width="2"/>\n'
+        svg += f'  <line x1="{x2}" y1="{p2_pos["y"] + icon_size}" x2="{x2}" y2="{y_joint}" stroke="black" stroke-width="2"/>\n'
+        svg += f'  <line x1="{x1}" y1="{y_joint}" x2="{x2}" y2="{y_joint}" stroke="black" stroke-width="2"/>\n'
+        cx = (x1 + x2) / 2
+        hijos_descendientes = [h for h in hijos if posiciones[h]['y'] > max(p1_pos['y'], p2_pos['y'])]
+        if hijos_descendientes:
+            y_hijos_dist = min([posiciones[h]['y'] for h in hijos_descendientes]) - 30
+            svg += f'  <line x1="{cx}" y1="{y_joint}" x2="{cx}" y2="{y_hijos_dist}" stroke="black" stroke-width="2"/>\n'
+            hx_coords = [posiciones[h]['x'] + icon_size/2 for h in hijos_descendientes]
+            if len(hijos_descendientes) > 1:
+                svg += f'  <line x1="{min(hx_coords)}" y1="{y_hijos_dist}" x2="{max(hx_coords)}" y2="{y_hijos_dist}" stroke="black" stroke-width="2"/>\n'
+            for h_id in hijos_descendientes:
+                h_pos = posiciones[h_id]
+                svg += f'  <line x1="{h_pos["x"] + icon_size/2}" y1="{y_hijos_dist}" x2="{h_pos["x"] + icon_size/2}" y2="{h_pos["y"]}" stroke="black" stroke-width="1.5"/>\n'
+
+    for padre_id, hijos_ids in hijos_para_solteros.items():
+        p_pos = posiciones[padre_id]
+        px = p_pos['x'] + icon_size/2
+        hijos = sorted([h for h in hijos_ids if h in posiciones])
+        hijos_desc = [h for h in hijos if posiciones[h]['y'] > p_pos['y']]
+        if hijos_desc:
+            y_dist = min([posiciones[h]['y'] for h in hijos_desc]) - 25
+            svg += f'  <line x1="{px}" y1="{p_pos["y"] + icon_size}" x2="{px}" y2="{y_dist}" stroke="black" stroke-width="2"/>\n'
+            hx_c = [posiciones[h]['x'] + icon_size/2 for h in hijos_desc]
+            if len(hijos_desc) > 1:
+                svg += f'  <line x1="{min(hx_c)}" y1="{y_dist}" x2="{max(hx_c)}" y2="{y_dist}" stroke="black" stroke-width="2"/>\n'
+            for h_id in hijos_desc:
+                h_p = posiciones[h_id]
+                svg += f'  <line x1="{h_p["x"] + icon_size/2}" y1="{y_dist}" x2="{h_p["x"] + icon_size/2}" y2="{h_p["y"]}" stroke="black" stroke-width="1.5"/>\n'
+    return svg
+
+
+# --- familias de prueba ----------------------------------------------------
+
+def random_family(seed):
+    """Familia aleatoria con hijos de uno o dos padres, parejas y relaciones duplicadas."""
+    r = random.Random(seed)
+    n = r.randrange(3, 60)
+    personas = [{'id': f'p{i}', 'nombre': f'P{i}', 'genero': r.choice(['masculino', 'femenino'])}
+                for i in range(n)]
+    relaciones = []
+    for i in range(1, n):
+        if r.random() < 0.7:
+            a = r.randrange(i)
+            relaciones.append({'tipo': 'padre-hijo', 'persona1_id': f'p{a}', 'persona2_id': f'p{i}'})
+            b = r.randrange(i)
+            if r.random() < 0.6 and b != a:
+                relaciones.append({'tipo': 'padre-hijo', 'persona1_id': f'p{b}', 'persona2_id': f'p{i}'})
+        if r.random() < 0.3:
+            b = r.randrange(n)
+            if b != i:
+                relaciones.append({'tipo': 'pareja', 'persona1_id': f'p{i}', 'persona2_id': f'p{b}'})
+    if relaciones and r.random() < 0.3:
+        relaciones.append(dict(r.choice(relaciones)))
+    return {'personas': personas, 'relaciones': relaciones}
+
+
+def test_family_graph_matches_old_implementation():
+    """Generaciones y SVG de relaciones iguales a la implementación anterior"""
+    generator = GenogramGenerator(offline=True)
+    generator.get_relation_icon_path = lambda relacion: None
+    icon_size = 50
+
+    for seed in range(200):
+        personas, relaciones, graph = generator._prepare_family(copy.deepcopy(random_family(seed)))
+
+        generaciones = generator._organize_generations(personas, relaciones, graph)
+        assert generaciones == _old_organize_generations(personas, relaciones), f"generaciones distintas (semilla {seed})"
+
+        posiciones = generator._calculate_positions_simple(generaciones, icon_size, 180, 180, 100, 100)
+        svg = generator._render_all_relations(relaciones, posiciones, personas, icon_size, graph)
+        assert svg == _old_render_all_relations(relaciones, posiciones, icon_size), f"SVG distinto (semilla {seed})"
+
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Pruebas del grafo familiar por sesión: merge_session_families,
+update_family_graph (qué sesiones se reextraen y cuándo se reescribe el
+archivo) y build_family_from_transcriptions_chunked.
+
+No llama a Gemini: _extract_sessions se sustituye por una función local y el
+grafo se guarda en un directorio temporal.
+"""
+
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+# Agregar el directorio actual al path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from genogram_model import GenogramGenerator
+
+FAMILIAS = {
+    'sesion_1': {
+        'personas': [
+            {'id': 'ana', 'nombre': 'Ana', 'genero': 'femenino', 'edad': 30, 'condiciones': ['ansiedad']},
+            {'id': 'luis', 'nombre': 'Luis', 'genero': 'masculino', 'notas': 'padre'},
+        ],
+        'relaciones': [{'tipo': 'padre-hijo', 'persona1_id': 'luis', 'persona2_id': 'ana'}],
+    },
+    'sesion_2': {
+        'personas': [
+            {'id': 'ana', 'nombre': 'Ana', 'genero': 'femenino', 'edad': None, 'condiciones': ['insomnio', 'ansiedad']},
+            {'id': 'rosa', 'nombre': 'Rosa', 'genero': 'femenino', 'notas': 'abuela paterna'},
+        ],
+        'relaciones': [
+            {'tipo': 'padre-hijo', 'persona1_id': 'rosa', 'persona2_id': 'luis'},
+            {'tipo': 'pareja', 'persona1_id': 'ana', 'persona2_id': 'pedro'},
+        ],
+    },
+}
+
+
+def test_merge_session_families():
+    """Una sesión posterior sólo sustituye datos no vacíos; condiciones y fuentes se acumulan"""
+    merged = GenogramGenerator.merge_session_families(FAMILIAS)
+    personas = {p['id']: p for p in merged['personas']}
+    assert list(personas) == ['ana', 'luis', 'rosa']
+    assert personas['ana']['edad'] == 30
+    assert personas['ana']['condiciones'] == ['ansiedad', 'insomnio']
+    assert personas['ana']['fuentes'] == ['sesion_1', 'sesion_2']
+    assert personas['rosa']['fuentes'] == ['sesion_2']
+    assert [(r['tipo'], r['persona1_id'], r['persona2_id'], r['fuentes']) for r in merged['relaciones']] == [
+        ('padre-hijo', 'luis', 'ana', ['sesion_1']),
+        ('padre-hijo', 'rosa', 'luis', ['sesion_2']),
+        ('pareja', 'ana', 'pedro', ['sesion_2']),
+    ]
+    # Una relación sin uno de sus extremos se descarta.
+    incompleta = {'s': {'relaciones': [{'tipo': 'pareja', 'persona1_id': 'ana', 'persona2_id': ''}]}}
+    assert GenogramGenerator.merge_session_families(incompleta)['relaciones'] == []
+
+
+class _Extractor:
+    """Sustituye a _extract_sessions: devuelve FAMILIAS por nombre de archivo salvo las sesiones en `fail`."""
+
+    def __init__(self):
+        self.calls = []
+        self.fail = set()
+
+    def __call__(self, items, max_workers=None, rpm=None):
+        self.calls.append([Path(fpath).stem for _, fpath, _ in items])
+        return {key: FAMILIAS[Path(fpath).stem] for key, fpath, _ in items if Path(fpath).stem not in self.fail}
+
+
+@pytest.fixture
+def patient(tmp_path, monkeypatch):
+    generator = GenogramGenerator(offline=True)
+    sessions_dir = tmp_path / 'paciente'
+    sessions_dir.mkdir()
+    for name in FAMILIAS:
+        (sessions_dir / f'{name}.txt').write_text(f'Paciente: texto de {name}.', encoding='utf-8')
+    graph_path = tmp_path / 'family_graph.json'
+    extractor = _Extractor()
+    monkeypatch.setattr(generator, 'list_transcription_files',
+                        lambda folder, base_paths=None: sorted(sessions_dir.iterdir()))
+    monkeypatch.setattr(generator, 'family_graph_path', lambda folder: graph_path)
+    monkeypatch.setattr(generator, '_extract_sessions', extractor)
+    return generator, sessions_dir, graph_path, extractor
+
+
+def test_update_family_graph_only_extracts_changes(patient):
+    """Sólo se reextraen sesiones nuevas o modificadas y el archivo no se reescribe si nada cambió"""
+    generator, sessions_dir, graph_path, extractor = patient
+    graph = generator.update_family_graph('paciente')
+    assert extractor.calls == [['sesion_1', 'sesion_2']]
+    assert len(graph['sessions']) == 2 and {p['id'] for p in graph['personas']} == {'ana', 'luis', 'rosa'}
+    assert json.loads(graph_path.read_text(encoding='utf-8'))['sessions'] == graph['sessions']
+
+    written = graph_path.stat().st_mtime_ns
+    generator.update_family_graph('paciente')
+    assert extractor.calls == [['sesion_1', 'sesion_2']]
+    assert graph_path.stat().st_mtime_ns == written
+
+    (sessions_dir / 'sesion_2.txt').unlink()
+    graph = generator.update_family_graph('paciente')
+    assert len(extractor.calls) == 1
+    assert [Path(k).stem for k in graph['sessions']] == ['sesion_1']
+    assert {p['id'] for p in graph['personas']} == {'ana', 'luis'}
+    assert len(json.loads(graph_path.read_text(encoding='utf-8'))['sessions']) == 1
+
+
+def test_failed_reextraction_keeps_previous_session(patient):
+    """Si la reextracción de una sesión modificada falla se conserva la anterior y no se reescribe el archivo"""
+    generator, sessions_dir, graph_path, extractor = patient
+    before = generator.update_family_graph('paciente')
+    saved = graph_path.read_text(encoding='utf-8')
+
+    (sessions_dir / 'sesion_2.txt').write_text('Paciente: texto nuevo de sesion_2.', encoding='utf-8')
+    extractor.fail = {'sesion_2'}
+    graph = generator.update_family_graph('paciente')
+    assert extractor.calls[-1] == ['sesion_2']
+    assert graph['sessions'] == before['sessions'] and graph['personas'] == before['personas']
+    assert graph_path.read_text(encoding='utf-8') == saved
+
+    # El hash anterior se conserva, así que la sesión se reintenta en la siguiente llamada.
+    extractor.fail = set()
+    graph = generator.update_family_graph('paciente')
+    assert extractor.calls[-1] == ['sesion_2']
+    key = next(k for k in graph['sessions'] if Path(k).stem == 'sesion_2')
+    assert graph['sessions'][key]['hash'] != before['sessions'][key]['hash']
+    assert graph_path.read_text(encoding='utf-8') != saved
+
+
+def test_chunked_family_comes_from_graph(patient):
+    """La familia por sesiones es la combinación del grafo sin abuelos, con marcadores para ids sin persona"""
+    generator, _, _, _ = patient
+    family = generator.build_family_from_transcriptions_chunked('paciente')
+    personas = {p['id']: p for p in family['personas']}
+    assert set(personas) == {'ana', 'luis', 'pedro'}
+    assert personas['ana']['edad'] == 30 and personas['ana']['condiciones'] == ['ansiedad', 'insomnio']
+    assert personas['pedro']['nombre'] == 'pedro'
+    assert [(r['tipo'], r['persona1_id'], r['persona2_id']) for r in family['relaciones']] == [
+        ('padre-hijo', 'luis', 'ana'),
+        ('pareja', 'ana', 'pedro'),
+    ]
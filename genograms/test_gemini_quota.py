@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Pruebas del manejo de cuota de Gemini: TokenBucket, _retry_delay y
+_extract_sessions (caché, reintentos tras un 429 y sesiones que fallan).
+
+No llama a Gemini ni espera de verdad: el reloj de genogram_model se sustituye
+por uno que sólo avanza cuando alguien duerme.
+"""
+
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+# Agregar el directorio actual al path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import genogram_model
+from genogram_model import GenogramGenerator, TokenBucket, _is_quota_error, _retry_delay
+
+QUOTA_MSG = "429 RESOURCE_EXHAUSTED. Please retry in 7.5s."
+
+
+class _Clock:
+    """Reloj falso: monotonic() fijo salvo que sleep() lo avance; guarda cada espera."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(round(seconds, 6))
+        self.now += seconds
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = _Clock()
+    monkeypatch.setattr(genogram_model, 'time', fake)
+    return fake
+
+
+def test_retry_delay():
+    """El tiempo que pide el servidor (+1 s) manda; si no lo indica, espera exponencial"""
+    assert _retry_delay(QUOTA_MSG, 0) == 8.5
+    assert _retry_delay("quota exceeded {'retryDelay': '37s'}", 3) == 38.0
+    assert [_retry_delay("429 Too Many Requests", n) for n in range(3)] == [10.0, 20.0, 40.0]
+    assert _retry_delay("429", 1, base_delay=2.0) == 4.0
+    assert _is_quota_error(QUOTA_MSG) and _is_quota_error("Quota exceeded")
+    assert not _is_quota_error("500 Internal error")
+
+
+def test_token_bucket_rate_and_burst(clock):
+    """Las primeras `burst` llamadas no esperan; después, una cada 60/rpm segundos"""
+    bucket = TokenBucket(rate_per_min=30, burst=2)
+    bucket.acquire()
+    bucket.acquire()
+    assert clock.sleeps == []
+    bucket.acquire()
+    bucket.acquire()
+    assert clock.sleeps == [2.0, 2.0]
+    # Con el tiempo se recupera como mucho `burst`.
+    clock.now += 3600
+    bucket.acquire()
+    bucket.acquire()
+    assert len(clock.sleeps) == 2
+
+
+def test_token_bucket_defer(clock):
+    """defer() bloquea el cubo hasta la pausa más larga pedida; luego vuelve el ritmo normal"""
+    bucket = TokenBucket(rate_per_min=60, burst=3)
+    bucket.defer(8.5)
+    bucket.defer(2.0)
+    bucket.acquire()
+    assert clock.sleeps == [8.5]
+    # Durante la pausa el cubo se ha rellenado hasta `burst`; después, un token por segundo.
+    bucket.acquire()
+    bucket.acquire()
+    assert clock.sleeps == [8.5]
+    bucket.acquire()
+    assert clock.sleeps == [8.5, 1.0]
+
+
+class _Gemini:
+    """Sustituye a extract_family_info: cada texto tiene su lista de respuestas (excepción o familia)."""
+
+    def __init__(self, script):
+        self.script = {k: list(v) for k, v in script.items()}
+        self.calls = []
+
+    def __call__(self, text, use_cache=True, **kwargs):
+        self.calls.append(text)
+        outcome = self.script[text].pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture
+def generator(tmp_path, monkeypatch, clock):
+    monkeypatch.setenv('GENOGRAM_CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setenv('GENOGRAM_KIN_FILTER', '0')
+    gen = GenogramGenerator(offline=True)
+    gen.saved_failures = []
+    monkeypatch.setattr(gen, '_save_failed_extraction',
+                        lambda fpath, text, msg: gen.saved_failures.append((fpath, msg)) or tmp_path / 'failed.txt')
+    return gen
+
+
+def _family(name):
+    return {'personas': [{'id': name, 'nombre': name}], 'relaciones': []}
+
+
+def test_extract_sessions_uses_cache_and_retries_quota(generator, clock, monkeypatch):
+    """Las sesiones en caché no llaman al modelo; un 429 pausa el tiempo pedido y reintenta"""
+    cached_text = 'Paciente: sesión ya extraída.'
+    generator._write_extraction_cache(generator._extraction_cache_path(cached_text), _family('ana'))
+    gemini = _Gemini({'s2': [RuntimeError(QUOTA_MSG), _family('luis')], 's3': [_family('rosa')]})
+    monkeypatch.setattr(generator, 'extract_family_info', gemini)
+
+    items = [('k1', Path('s1.txt'), cached_text), ('k2', Path('s2.txt'), 's2'), ('k3', Path('s3.txt'), 's3')]
+    results = generator._extract_sessions(items, max_workers=1, rpm=60)
+    assert results == {'k1': _family('ana'), 'k2': _family('luis'), 'k3': _family('rosa')}
+    assert gemini.calls == ['s2', 's2', 's3']
+    assert 8.5 in clock.sleeps
+    assert generator.saved_failures == []
+
+
+def test_extract_sessions_drops_non_quota_failures(generator, monkeypatch):
+    """Un error que no es de cuota guarda la transcripción y deja fuera esa sesión"""
+    gemini = _Gemini({'s1': [RuntimeError('500 Internal error')], 's2': [_family('luis')]})
+    monkeypatch.setattr(generator, 'extract_family_info', gemini)
+    items = [('k1', Path('s1.txt'), 's1'), ('k2', Path('s2.txt'), 's2')]
+    assert generator._extract_sessions(items, max_workers=1, rpm=60) == {'k2': _family('luis')}
+    assert gemini.calls == ['s1', 's2']
+    assert generator.saved_failures == [(Path('s1.txt'), '500 Internal error')]
+
+
+def test_extract_sessions_gives_up_after_repeated_quota(generator, clock, monkeypatch):
+    """Tras max_retries errores de cuota seguidos se aborta toda la extracción"""
+    gemini = _Gemini({'s1': [RuntimeError('429 quota exceeded')] * 5})
+    monkeypatch.setattr(generator, 'extract_family_info', gemini)
+    with pytest.raises(RuntimeError, match='quota exhausted repeatedly'):
+        generator._extract_sessions([('k1', Path('s1.txt'), 's1')], max_workers=1, rpm=60)
+    assert len(gemini.calls) == 5
+    # Espera exponencial entre intentos: 10, 20, 40 y 80 s.
+    assert [s for s in clock.sleeps if s >= 10] == [10.0, 20.0, 40.0, 80.0]
+    assert [msg for _, msg in generator.saved_failures] == ['429 quota exceeded']
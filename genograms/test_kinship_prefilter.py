@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Pruebas del filtro de parentesco (kinship_prefilter) que se aplica antes de
+extract_family_info: casos en que envía el texto completo y forma del texto
+filtrado.
+
+No llama a Gemini.
+"""
+
+import json
+import sys
+from pathlib import Path
+
+# Agregar el directorio actual al path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from genogram_model import kinship_prefilter
+
+FILLER = [
+    "Hablamos del trabajo y de la rutina diaria en la oficina.",
+    "Comenta que duerme poco y que el tráfico por las mañanas la agobia bastante.",
+    "Revisamos los ejercicios de respiración de la semana pasada.",
+    "Dice que ha vuelto a correr tres días por semana y que nota mejoría.",
+]
+KIN = [
+    "Mi madre Carmen tiene sesenta y cinco años y vive con nosotros.",
+    "Mi hermano Luis se casó el año pasado con Marta.",
+    "Mi padre falleció hace tres años de un infarto.",
+    "Tengo dos hijos, Sofía y Carlos.",
+]
+
+
+def _filler(n, start=0):
+    return [f"Paciente: {FILLER[(start + i) % len(FILLER)]}" for i in range(n)]
+
+
+def test_short_text_is_sent_whole():
+    """Texto corto: se envía entero"""
+    text = "\n".join(_filler(4) + [f"Paciente: {KIN[0]}"])
+    out, stats = kinship_prefilter(text, budget_tokens=6000)
+    assert out == text
+    assert stats['mode'] == 'full' and stats['reason'] == 'short', stats
+
+
+def test_few_hits_is_sent_whole():
+    """Menos de KINSHIP_MIN_HITS menciones: se envía entero"""
+    text = "\n".join(_filler(200) + [f"Paciente: {KIN[0]}"] + _filler(200, 1))
+    out, stats = kinship_prefilter(text, budget_tokens=6000)
+    assert out == text
+    assert stats['reason'] == 'few_hits' and stats['hits'] < 3, stats
+
+
+def test_low_coverage_is_sent_whole():
+    """El presupuesto deja fuera demasiadas menciones: se envía entero"""
+    lines = []
+    for i in range(40):
+        lines += _filler(10, i) + [f"Paciente: {KIN[i % len(KIN)]}"]
+    text = "\n".join(lines)
+    out, stats = kinship_prefilter(text, budget_tokens=100)
+    assert out == text
+    assert stats['reason'] == 'low_coverage' and stats['coverage'] < 0.6, stats
+
+
+def test_no_gain_is_sent_whole():
+    """Casi todo habla de la familia: el filtro no ahorra y se envía entero"""
+    text = "\n".join(f"Paciente: {KIN[i % len(KIN)]}" for i in range(200))
+    out, stats = kinship_prefilter(text, budget_tokens=100000)
+    assert out == text
+    assert stats['reason'] == 'no_gain' and stats['tokens_out'] == stats['tokens_in'], stats
+
+
+def test_filtered_keeps_structure():
+    """Texto filtrado: conserva PACIENTE_INFO, cabeceras de sesión, hablantes y marca los cortes"""
+    head = f"PACIENTE_INFO:\n{json.dumps({'nombre': 'Ana'})}\n\nSESION_TRANSCRIPCION:"
+    sessions = []
+    for s in range(2):
+        sessions.append(f"\n\n--- SESSION: sesion_{s + 1}.txt ---\n")
+        sessions += _filler(60, s) + [f"Paciente: {KIN[2 * s]}", f"Paciente: {KIN[2 * s + 1]}"] + _filler(60, s + 1)
+    text = head + "\n" + "\n".join(sessions)
+
+    out, stats = kinship_prefilter(text, budget_tokens=6000)
+    assert stats['mode'] == 'filtered', stats
+    assert stats['tokens_out'] < stats['tokens_in'] * 0.8, stats
+    assert out.startswith(head)
+    assert "--- SESSION: sesion_1.txt ---" in out and "--- SESSION: sesion_2.txt ---" in out
+    assert out.index("sesion_1.txt") < out.index(KIN[0]) < out.index("sesion_2.txt") < out.index(KIN[2])
+    for sent in KIN:
+        assert sent in out, sent
+    assert "[...]" in out
+    for line in out.splitlines()[4:]:
+        assert line.startswith(("Paciente: ", "--- SESSION:", "[...]")), line
+
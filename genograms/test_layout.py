@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Pruebas del layout por capas (_calculate_positions_layered) y de sus piezas:
+conteo de inversiones, regresión isotónica (PAV) y barridos del baricentro.
+
+No llama a Gemini.
+"""
+
+import copy
+import random
+import sys
+from pathlib import Path
+
+# Agregar el directorio actual al path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from genogram_model import GenogramGenerator, _count_inversions, _pav_non_decreasing
+from test_family_graph import random_family
+
+ICON_SIZE, SPACING_X, SPACING_Y, COUPLE_SPACING, START_X, START_Y = 50, 180, 180, 100, 100, 100
+
+
+def _layered(generator, family, generaciones=None):
+    personas, relaciones, graph = generator._prepare_family(copy.deepcopy(family))
+    if generaciones is None:
+        generaciones = generator._organize_generations(personas, relaciones, graph)
+    posiciones = generator._calculate_positions_layered(generaciones, graph, ICON_SIZE, SPACING_X, SPACING_Y,
+                                                        COUPLE_SPACING, START_X, START_Y)
+    return posiciones, graph
+
+
+def _crossings(posiciones, graph):
+    """Cruces padre-hijo con una línea por hijo desde el punto medio de sus padres."""
+    edges_by_row = {}
+    for c, ps in graph.parents.items():
+        ps = [p for p in ps if p in posiciones and posiciones[p]['y'] < posiciones[c]['y']]
+        if ps and c in posiciones:
+            mid = sum(posiciones[p]['x'] for p in ps) / len(ps)
+            edges_by_row.setdefault(posiciones[c]['y'], []).append((mid, posiciones[c]['x']))
+    total = 0
+    for edges in edges_by_row.values():
+        total += sum(1 for a in edges for b in edges if a[0] < b[0] and a[1] > b[1])
+    return total
+
+
+def test_count_inversions():
+    """_count_inversions coincide con el conteo por fuerza bruta (con repetidos)"""
+    r = random.Random(0)
+    for _ in range(300):
+        seq = [r.randrange(10) for _ in range(r.randrange(0, 40))]
+        brute = sum(1 for i in range(len(seq)) for j in range(i + 1, len(seq)) if seq[i] > seq[j])
+        assert _count_inversions(list(seq)) == brute, seq
+
+
+def test_pav_non_decreasing():
+    """PAV devuelve una sucesión no decreciente que conserva la media ponderada de cada tramo"""
+    r = random.Random(1)
+    for _ in range(300):
+        n = r.randrange(1, 30)
+        targets = [r.uniform(-100, 100) for _ in range(n)]
+        weights = [r.choice([1.0, 0.05, 2.5]) for _ in range(n)]
+        out = _pav_non_decreasing(targets, weights)
+        assert len(out) == n
+        assert all(a <= b + 1e-9 for a, b in zip(out, out[1:])), out
+        i = 0
+        while i < n:
+            j = i
+            while j + 1 < n and abs(out[j + 1] - out[i]) < 1e-9:
+                j += 1
+            mean = sum(t * w for t, w in zip(targets[i:j + 1], weights[i:j + 1])) / sum(weights[i:j + 1])
+            assert abs(mean - out[i]) < 1e-6, (targets, weights, out)
+            i = j + 1
+    ordered = [1.0, 2.0, 2.0, 5.0]
+    assert _pav_non_decreasing(ordered, [1.0] * 4) == ordered
+
+
+def test_layered_invariants():
+    """Capas bajo los padres, sin solapes y parejas a couple_spacing"""
+    generator = GenogramGenerator(offline=True)
+    for seed in range(150):
+        family = random_family(seed)
+        posiciones, graph = _layered(generator, family)
+        assert set(posiciones) == {p['id'] for p in family['personas']}, f"faltan personas (semilla {seed})"
+
+        for c, ps in graph.parents.items():
+            for p in ps:
+                assert posiciones[c]['y'] > posiciones[p]['y'], f"hijo no está debajo de su padre (semilla {seed})"
+        for pos in posiciones.values():
+            assert (pos['y'] - START_Y) % SPACING_Y == 0
+
+        rows = {}
+        for pid, pos in posiciones.items():
+            rows.setdefault(pos['y'], []).append(pid)
+        gap = max(SPACING_X - ICON_SIZE, ICON_SIZE)
+        for y, ids in rows.items():
+            # Bloques de pareja dentro de la fila (mismo criterio que el layout).
+            root = {pid: pid for pid in ids}
+
+            def _find(x):
+                while root[x] != x:
+                    x = root[x]
+                return x
+
+            for pid in ids:
+                for q in graph.partners.get(pid, []):
+                    if q in root:
+                        root[_find(q)] = _find(pid)
+            ids.sort(key=lambda pid: posiciones[pid]['x'])
+            for a, b in zip(ids, ids[1:]):
+                dist = posiciones[b]['x'] - posiciones[a]['x']
+                if _find(a) == _find(b):
+                    assert abs(dist - COUPLE_SPACING) <= 0.2, f"pareja a {dist} (semilla {seed})"
+                else:
+                    assert dist >= ICON_SIZE + gap - 0.2, f"solape: {a}, {b} a {dist} (semilla {seed})"
+
+
+def test_barycenter_removes_crossings():
+    """Hijos listados al revés que sus padres: el layout los reordena sin cruces"""
+    family = {
+        'personas': [{'id': pid, 'nombre': pid.upper()} for pid in ['a', 'b', 'c', 'd', 'a1', 'a2', 'c1', 'c2']],
+        'relaciones': [
+            {'tipo': 'pareja', 'persona1_id': 'a', 'persona2_id': 'b'},
+            {'tipo': 'pareja', 'persona1_id': 'c', 'persona2_id': 'd'},
+        ] + [
+            {'tipo': 'padre-hijo', 'persona1_id': p, 'persona2_id': h}
+            for p, hs in [('a', ['a1', 'a2']), ('b', ['a1', 'a2']), ('c', ['c1', 'c2']), ('d', ['c1', 'c2'])]
+            for h in hs
+        ],
+    }
+    generaciones = [['a', 'b', 'c', 'd'], ['c1', 'c2', 'a1', 'a2']]
+    posiciones, graph = _layered(GenogramGenerator(offline=True), family, generaciones)
+
+    assert _crossings(posiciones, graph) == 0
+    x = {pid: pos['x'] for pid, pos in posiciones.items()}
+    assert max(x['a1'], x['a2']) < min(x['c1'], x['c2'])
+    # Cada pareja queda centrada sobre sus hijos.
+    assert abs((x['a'] + x['b']) / 2 - (x['a1'] + x['a2']) / 2) <= 0.2
+    assert abs((x['c'] + x['d']) / 2 - (x['c1'] + x['c2']) / 2) <= 0.2
+
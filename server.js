@@ -531,7 +531,8 @@ app.post('/api/generate-genogram', express.json(), async (req, res) => {
             if (result && result.ok) {
                 // El script devuelve la ruta absoluta. La normalizamos para el cliente.
                 const relativePath = path.relative(path.join(__dirname, 'outputs'), result.output);
-                return res.json({ ok: true, output: result.output, relativePath: relativePath });
+                const familyJson = result.family_json ? path.relative(path.join(__dirname, 'outputs'), result.family_json) : null;
+                return res.json({ ok: true, output: result.output, relativePath: relativePath, familyJson });
             }
             // Not ok: e.g., no session with note
             return res.json({ ok: false, error: result && result.error ? result.error : 'unknown' });
@@ -549,6 +550,84 @@ app.post('/api/generate-genogram', express.json(), async (req, res) => {
     }
 });
 
+// Re-render a genogram from its persisted .family.json (no Gemini call).
+// Body: { patientFolder | familyJson, options: { layout, icon_size, spacing_x, spacing_y, couple_spacing, hide_ids, hide_unconnected, format } }
+// options.format 'pdf' | 'png' | 'svg' exports with Graphviz next to the JSON instead of writing the HTML.
+// familyJson is the path (relative to outputs/) returned by /api/generate-genogram and /api/genograma/:patientId;
+// patientFolder re-renders outputs/<patientFolder>/genograma.html.
+app.post('/api/genogram/render', express.json(), (req, res) => {
+    try {
+        const patientFolder = req.body.patientFolder || req.body.patient_folder || null;
+        const familyJson = req.body.familyJson || req.body.family_json || null;
+        const options = req.body.options || {};
+
+        let target = null;
+        if (familyJson) {
+            const resolved = path.resolve(outputsDir, String(familyJson));
+            if (!resolved.startsWith(outputsDir + path.sep) || !resolved.endsWith('.family.json')) {
+                return res.status(400).json({ ok: false, error: 'bad_family_json' });
+            }
+            target = resolved;
+        } else {
+            if (!patientFolder || !/^[\w.-]+$/.test(patientFolder) || patientFolder.startsWith('.')) {
+                return res.status(400).json({ ok: false, error: 'bad_patient_folder' });
+            }
+            target = patientFolder;
+        }
+
+        const py = pythonExecutable();
+        const script = path.join(__dirname, 'genograms', 'render_genogram.py');
+        const args = [script, target, JSON.stringify(options)];
+
+        const childEnv = { ...process.env };
+        const venvDir = path.dirname(py);
+        if (process.platform === 'win32') {
+            childEnv['Path'] = `${venvDir}${path.delimiter}${childEnv['Path'] || ''}`;
+            childEnv['PATH'] = `${venvDir}${path.delimiter}${childEnv['PATH'] || ''}`;
+        } else {
+            childEnv['PATH'] = `${venvDir}${path.delimiter}${childEnv['PATH'] || ''}`;
+        }
+        const child = execFile(py, args, { env: childEnv, windowsHide: true, maxBuffer: 10 * 1024 * 1024 }, (err, stdout, stderr) => {
+            if (err && err.code === 2) {
+                let error = 'bad_request';
+                try { error = JSON.parse(stdout).error || error; } catch (e) { }
+                return res.status(400).json({ ok: false, error });
+            }
+            if (err) {
+                let detail = stderr || String(err.message || 'error');
+                try { detail = JSON.parse(stdout).detail || detail; } catch (e) { }
+                return res.status(500).json({ ok: false, error: 'script_exception', detail });
+            }
+
+            let result = null;
+            try {
+                const jsonMatch = (stdout || '').match(/\{[\s\S]*\}/);
+                result = JSON.parse(jsonMatch ? jsonMatch[0] : (stdout || '{}'));
+            } catch (e) {
+                console.error('[genogram] Failed to parse render output:', stdout);
+                result = { ok: false, error: 'bad_json', raw: stdout };
+            }
+
+            if (result && result.ok) {
+                const relativePath = path.relative(path.join(__dirname, 'outputs'), result.output);
+                return res.json({ ok: true, output: result.output, relativePath: relativePath, render_ms: result.render_ms });
+            }
+            const status = result && result.error === 'family_json_not_found' ? 404
+                : result && result.error === 'graphviz_unavailable' ? 501 : 200;
+            return res.status(status).json({ ok: false, error: result && result.error ? result.error : 'unknown' });
+        });
+
+        const timeout = setTimeout(() => {
+            try { child.kill(); } catch (e) { }
+        }, 30000);
+        child.on('exit', () => clearTimeout(timeout));
+
+    } catch (error) {
+        console.error('[genogram] Render error:', error);
+        res.status(500).json({ ok: false, error: 'internal_server_error' });
+    }
+});
+
 // Check if genogram exists for patient
 app.get('/api/check-genogram/:patientFolder', async (req, res) => {
     try {
@@ -601,6 +680,31 @@ app.use(express.urlencoded({ extended: true }));
 // Enable CORS for frontend running on different port (e.g. live-server:5500)
 app.use(cors());
 
+// Genograms are written with a precompressed copy next to them (genograma.html.gz).
+// Serve it to browsers that accept gzip, unless it is older than the .html.
+app.get(/^\/outputs\/.+\.html$/, (req, res, next) => {
+    if (!/\bgzip\b/.test(req.headers['accept-encoding'] || '')) return next();
+    let htmlPath;
+    try {
+        htmlPath = path.join(__dirname, decodeURIComponent(req.path));
+    } catch (e) {
+        return next();
+    }
+    if (!htmlPath.startsWith(path.join(__dirname, 'outputs') + path.sep)) return next();
+    fs.stat(htmlPath + '.gz', (gzErr, gzStat) => {
+        if (gzErr) return next();
+        fs.stat(htmlPath, (htmlErr, htmlStat) => {
+            if (htmlErr || gzStat.mtimeMs < htmlStat.mtimeMs) return next();
+            res.set({
+                'Content-Type': 'text/html; charset=utf-8',
+                'Content-Encoding': 'gzip',
+                'Vary': 'Accept-Encoding',
+            });
+            res.sendFile(htmlPath + '.gz');
+        });
+    });
+});
+
 // Serve static files (CSS, JS, images)
 app.use(express.static(path.join(__dirname), {
     index: false  // No servir index.html automáticamente
@@ -1058,11 +1162,46 @@ app.post('/api/transcribe-recording', express.json(), (req, res) => {
     }
 });
 
+// Single-flight for the retrieval routes (single-flight.js).
+const { singleFlight, coalesceStats } = require('./single-flight');
+
+function normalizeQueryText(v) {
+    return String(v || '').normalize('NFC').trim().replace(/\s+/g, ' ').toLowerCase();
+}
+
+app.get('/api/metrics/coalescing', (req, res) => {
+    const out = {};
+    for (const [name, s] of Object.entries(coalesceStats)) {
+        const total = s.executions + s.coalesced;
+        out[name] = Object.assign({}, s, { coalesced_ratio: total ? +(s.coalesced / total).toFixed(4) : 0 });
+    }
+    res.json({ ok: true, routes: out });
+});
+
+const ragSingleFlight = singleFlight('rag_ask', (b) => ({
+    collections: [...new Set([].concat(b.collections || [], b.collection || []).map(c => String(c).trim()).filter(Boolean))].sort(),
+    query: normalizeQueryText(b.query),
+    k: Number(b.k) || 6,
+    top_n: Number(b.top_n) || 25,
+    context_tokens: Number(b.context_tokens) || 0,
+}));
+
+const icd11SingleFlight = singleFlight('icd11_score', (b) => ({
+    collection: String(b.collection || '').trim(),
+    clinical_text: normalizeQueryText(b.clinical_text),
+    search_query: normalizeQueryText(b.search_query),
+    k: Number(b.k) || 8,
+    top_n: Number(b.top_n) || 0,
+    out_top: Number(b.out_top) || 5,
+    context_tokens: Number(b.context_tokens) || 0,
+}));
+
 // RAG endpoint: query Qdrant (already populated) and generate answer
-app.post('/api/rag/ask', express.json({ limit: '1mb' }), (req, res) => {
+app.post('/api/rag/ask', express.json({ limit: '1mb' }), ragSingleFlight, (req, res) => {
     try {
-        const { collection, query, k, top_n } = req.body || {};
-        if (!collection || !query) {
+        const { collection, collections, query, k, top_n, context_tokens } = req.body || {};
+        const hasCollections = Array.isArray(collections) && collections.length > 0;
+        if ((!collection && !hasCollections) || !query) {
             return res.status(400).json({ ok: false, error: 'missing_collection_or_query' });
         }
 
@@ -1086,7 +1225,7 @@ app.post('/api/rag/ask', express.json({ limit: '1mb' }), (req, res) => {
         try { childEnv.PYTHONIOENCODING = childEnv.PYTHONIOENCODING || 'utf-8'; } catch (e) { }
         try { childEnv.PYTHONUTF8 = childEnv.PYTHONUTF8 || '1'; } catch (e) { }
 
-        const inputStr = JSON.stringify({ collection, query, k, top_n });
+        const inputStr = JSON.stringify({ collection, collections, query, k, top_n, context_tokens });
 
         // Spawn python with fallbacks (common in Windows where only `py` exists).
         const candidates = [];
@@ -1189,6 +1328,111 @@ app.post('/api/rag/ask', express.json({ limit: '1mb' }), (req, res) => {
     }
 });
 
+// RAG streaming endpoint: relays rag_query.py NDJSON events (sources, delta, done, error) as SSE
+app.post('/api/rag/ask/stream', express.json({ limit: '1mb' }), (req, res) => {
+    try {
+        const { collection, collections, query, k, top_n, context_tokens } = req.body || {};
+        const hasCollections = Array.isArray(collections) && collections.length > 0;
+        if ((!collection && !hasCollections) || !query) {
+            return res.status(400).json({ ok: false, error: 'missing_collection_or_query' });
+        }
+
+        const pyExec = pythonExecutable();
+        const scriptPath = path.join(__dirname, 'tools', 'rag_query.py');
+
+        const childEnv = { ...process.env };
+        const venvDir = (pyExec && (pyExec.includes('\\') || pyExec.includes('/'))) ? path.dirname(pyExec) : '';
+        const pathKey = process.platform === 'win32' ? 'Path' : 'PATH';
+        if (venvDir) {
+            childEnv[pathKey] = `${venvDir}${path.delimiter}${childEnv[pathKey] || ''}`;
+            if (process.platform === 'win32') {
+                childEnv['PATH'] = childEnv['Path'];
+            }
+        }
+        childEnv.PYTHONIOENCODING = childEnv.PYTHONIOENCODING || 'utf-8';
+        childEnv.PYTHONUTF8 = childEnv.PYTHONUTF8 || '1';
+        // Unbuffered so each delta reaches us as soon as Python prints it.
+        childEnv.PYTHONUNBUFFERED = '1';
+
+        let child = null;
+        try {
+            child = spawn(pyExec, [scriptPath, '--stream'], { env: childEnv, cwd: __dirname });
+        } catch (e) {
+            return res.status(500).json({ ok: false, error: 'rag_spawn_error', detail: String(e && e.message) });
+        }
+
+        res.set({
+            'Content-Type': 'text/event-stream; charset=utf-8',
+            'Cache-Control': 'no-cache',
+            'Connection': 'keep-alive',
+            'X-Accel-Buffering': 'no'
+        });
+        res.flushHeaders();
+
+        const sendEvent = (name, data) => {
+            res.write(`event: ${name}\ndata: ${JSON.stringify(data)}\n\n`);
+        };
+
+        let buffered = '';
+        let err = '';
+        let finished = false;
+        const relayLine = (line) => {
+            if (!line.trim()) return;
+            let parsed = null;
+            try { parsed = JSON.parse(line); } catch (e) { return; /* stray log line */ }
+            if (!parsed || typeof parsed !== 'object') return;
+            // Errors raised before streaming starts are plain JSON objects without `event`.
+            const name = parsed.event || (parsed.ok === false ? 'error' : 'message');
+            if (name === 'done' || name === 'error') finished = true;
+            sendEvent(name, parsed);
+        };
+
+        child.stdout.on('data', (d) => {
+            buffered += d.toString();
+            let idx;
+            while ((idx = buffered.indexOf('\n')) >= 0) {
+                relayLine(buffered.slice(0, idx));
+                buffered = buffered.slice(idx + 1);
+            }
+        });
+        if (child.stderr) child.stderr.on('data', (d) => { err += d.toString(); });
+
+        child.on('error', (e) => {
+            if (!finished) sendEvent('error', { ok: false, error: 'rag_spawn_error', detail: String(e && e.message) });
+            finished = true;
+            res.end();
+        });
+
+        child.on('close', (code) => {
+            relayLine(buffered);
+            if (!finished) {
+                sendEvent('error', { ok: false, error: 'rag_failed', code, detail: (err || '').slice(0, 8000) || `exit_${code}` });
+            }
+            res.end();
+        });
+
+        // Stop generation if the browser goes away.
+        res.on('close', () => {
+            if (!finished) {
+                try { child.kill(); } catch (e) { }
+            }
+        });
+
+        try {
+            child.stdin.write(JSON.stringify({ collection, collections, query, k, top_n, context_tokens, stream: true }));
+            child.stdin.end();
+        } catch (e) {
+            sendEvent('error', { ok: false, error: 'rag_stdin_error', detail: String(e && e.message) });
+            res.end();
+        }
+    } catch (e) {
+        if (!res.headersSent) {
+            return res.status(500).json({ ok: false, error: 'server_error', detail: String(e && e.message) });
+        }
+        res.end();
+    }
+});
+
 // Diagnostic endpoint to check Python environment
 app.get('/api/diag/python', async (req, res) => {
     try {
@@ -1222,7 +1466,7 @@ app.get('/api/diag/python', async (req, res) => {
 });
 
 // ICD-11 scoring endpoint: query ICD-11 collection in Qdrant and return normalized scores (JSON)
-app.post('/api/icd11/score', express.json({ limit: '1mb' }), (req, res) => {
+app.post('/api/icd11/score', express.json({ limit: '1mb' }), icd11SingleFlight, (req, res) => {
     try {
         const {
             clinical_text,
@@ -1231,6 +1475,7 @@ app.post('/api/icd11/score', express.json({ limit: '1mb' }), (req, res) => {
             top_n,
             out_top,
             collection,
+            context_tokens,
         } = req.body || {};
 
         if (!clinical_text || !String(clinical_text).trim()) {
@@ -1262,6 +1507,7 @@ app.post('/api/icd11/score', express.json({ limit: '1mb' }), (req, res) => {
             top_n,
             out_top,
             collection,
+            context_tokens,
         });
 
         const candidates = [];
@@ -1344,6 +1590,62 @@ app.post('/api/icd11/score', express.json({ limit: '1mb' }), (req, res) => {
     }
 });
 
+// Semantic search over a patient's transcribed sessions (index built by process_all.py)
+app.post('/api/sessions/search', express.json({ limit: '1mb' }), (req, res) => {
+    try {
+        const { patient_folder, query, k, session, speaker } = req.body || {};
+        if (!patient_folder || !query) {
+            return res.status(400).json({ ok: false, error: 'missing_patient_or_query' });
+        }
+
+        const pyExec = pythonExecutable();
+        const scriptPath = path.join(__dirname, 'tools', 'session_index.py');
+        const childEnv = { ...process.env };
+        const venvDir = (pyExec && (pyExec.includes('\\') || pyExec.includes('/'))) ? path.dirname(pyExec) : '';
+        const pathKey = process.platform === 'win32' ? 'Path' : 'PATH';
+        if (venvDir) {
+            childEnv[pathKey] = `${venvDir}${path.delimiter}${childEnv[pathKey] || ''}`;
+            if (process.platform === 'win32') {
+                childEnv['PATH'] = childEnv['Path'];
+            }
+        }
+        childEnv.PYTHONIOENCODING = childEnv.PYTHONIOENCODING || 'utf-8';
+        childEnv.PYTHONUTF8 = childEnv.PYTHONUTF8 || '1';
+
+        let child = null;
+        try {
+            child = spawn(pyExec, [scriptPath], { env: childEnv, cwd: __dirname });
+        } catch (e) {
+            return res.status(500).json({ ok: false, error: 'sessions_spawn_error', detail: String(e && e.message) });
+        }
+
+        let out = '';
+        let err = '';
+        child.stdout.on('data', (d) => { out += d.toString(); });
+        if (child.stderr) child.stderr.on('data', (d) => { err += d.toString(); });
+        child.on('error', (e) => {
+            if (!res.headersSent) res.status(500).json({ ok: false, error: 'sessions_spawn_error', detail: String(e && e.message) });
+        });
+        child.on('close', (code) => {
+            if (res.headersSent) return;
+            const parsed = parsePossiblyNoisyJson(out);
+            if (parsed && typeof parsed === 'object') {
+                if (parsed.ok === true) return res.json(parsed);
+                const clientErrors = new Set(['missing_patient_or_query', 'bad_patient_folder', 'bad_json_in', 'index_not_found']);
+                // index_missing: the patient has sessions but the index is built by process_all or --build, not here.
+                const status = clientErrors.has(String(parsed.error)) ? 400 : (parsed.error === 'index_missing' ? 409 : 500);
+                return res.status(status).json(Object.assign({ ok: false, code, stderr: (err || '').slice(0, 8000) }, parsed));
+            }
+            return res.status(500).json({ ok: false, error: 'sessions_search_failed', code, detail: (err || out || `exit_${code}`).slice(0, 8000) });
+        });
+
+        child.stdin.write(JSON.stringify({ patient_folder, query, k, session, speaker }));
+        child.stdin.end();
+    } catch (e) {
+        return res.status(500).json({ ok: false, error: 'server_error', detail: String(e && e.message) });
+    }
+});
+
 // Data endpoints
 const dataFile = path.join(__dirname, 'data.json');
 
@@ -1739,8 +2041,9 @@ app.post('/api/generate-summary', express.json({ limit: '2mb' }), async (req, re
         let cleanedTranscription = transcription
             .replace(/【.*?】/g, '') // Remover marcadores de speaker
             .replace(/\[[\d\.]+ ?s? ?- ?[\d\.]+ ?s?\]/g, '') // Remover timestamps
-            .replace(/\n+/g, ' ')
-            .replace(/\s+/g, ' ')
+            // Keep one line per turn: long transcripts are summarized by speaker turn (map-reduce).
+            .replace(/[ \t]+/g, ' ')
+            .replace(/\s*\n\s*/g, '\n')
             .trim();
 
         // Spawn Python script to call Google GenAI
@@ -1796,7 +2099,8 @@ app.post('/api/generate-summary', express.json({ limit: '2mb' }), async (req, re
                     return res.json({
                         ok: true,
                         summary: result.summary,
-                        model_used: 'google-gemini'
+                        model_used: result.model || 'google-gemini',
+                        cached: !!result.cached
                     });
                 } else {
                     return res.status(500).json({
@@ -1851,70 +2155,38 @@ app.post('/api/genograma/:patientId', async (req, res) => {
             patientData = allData ? allData.pacientes.find(p => String(p.id) === String(patientId)) : null;
         }
 
-        let fullTranscription = '';
+        // Con transcripciones de sesión en outputs/patient_<nombre>/ el genograma sale del
+        // grafo familiar del paciente (update_family_graph): sólo las sesiones nuevas van a Gemini.
+        let patientFolder = null;
+        let hasSessionTranscripts = false;
 
         if (patientData) {
             const sanitizedName = sanitizePatientName(patientData.nombre);
-            const patientDir = path.join(outputsDir, `patient_${sanitizedName}`);
+            patientFolder = `patient_${sanitizedName}`;
+            const patientDir = path.join(outputsDir, patientFolder);
 
             if (fs.existsSync(patientDir)) {
                 console.log(`Buscando sesiones en: ${patientDir}`);
                 const entries = fs.readdirSync(patientDir, { withFileTypes: true });
+                const sessionDirs = entries.filter(e => e.isDirectory() && e.name.startsWith('sesion_'));
 
-                // Filtrar y ordenar carpetas de sesión (sesion_1, sesion_2, ...)
-                const sessionDirs = entries
-                    .filter(e => e.isDirectory() && e.name.startsWith('sesion_'))
-                    .sort((a, b) => {
-                        const numA = parseInt(a.name.replace('sesion_', '')) || 0;
-                        const numB = parseInt(b.name.replace('sesion_', '')) || 0;
-                        return numA - numB;
-                    });
-
-                // Leer transcripciones de cada sesión
-                for (const sessDir of sessionDirs) {
+                hasSessionTranscripts = sessionDirs.some(sessDir => {
                     const sessPath = path.join(patientDir, sessDir.name);
-                    // Fix: Directory is 'sesion_1' but file is '..._sesion1_...' (no underscore)
-                    const sessNameFile = sessDir.name.replace('_', ''); // sesion_1 -> sesion1
-                    const docStem = `patient_${sanitizedName}_${sessNameFile}`; // e.g. patient_juan_perez_sesion1
-
-                    // Intentar leer labeled.txt (mejor calidad)
-                    let textPath = path.join(sessPath, `${docStem}_labeled.txt`);
-                    const fallbackPath = path.join(sessPath, `${docStem}_transcription.txt`);
-
-                    console.log(`[debug] Checking sessDir: ${sessDir.name}`);
-                    console.log(`[debug] constructed textPath: ${textPath}`);
-
-                    if (!fs.existsSync(textPath)) {
-                        console.log(`[debug] labeled.txt not found, checking fallback: ${fallbackPath}`);
-                        // Fallback: transcription.txt
-                        textPath = fallbackPath;
+                    try {
+                        return fs.readdirSync(sessPath).some(f => /_(labeled|transcription)\.(txt|json)$/.test(f));
+                    } catch (e) {
+                        return false;
                     }
-
-                    if (fs.existsSync(textPath)) {
-                        try {
-                            const sessText = fs.readFileSync(textPath, 'utf8');
-                            const dateStr = sessDir.name.replace('sesion_', 'Sesión ');
-                            fullTranscription += `\n\n=== ${dateStr} ===\n${sessText}`;
-                            console.log(`Agregado texto de ${sessDir.name} (${sessText.length} chars)`);
-                        } catch (e) {
-                            console.error(`Error leyendo ${textPath}`, e);
-                        }
-                    } else {
-                        console.log(`[debug] No text file found for session ${sessDir.name}`);
-                    }
-                }
+                });
+                console.log(`[debug] ${sessionDirs.length} carpetas de sesión, transcripciones: ${hasSessionTranscripts}`);
             }
         }
 
-        // Si encontramos texto en las carpetas, usémoslo. Si no, fallback al body.
-        if (fullTranscription.trim()) {
-            transcription = fullTranscription;
-        } else {
+        if (!hasSessionTranscripts) {
             console.log("No se encontraron archivos de sesión, usando transcripción del request (si existe).");
-        }
-
-        if (!transcription || !transcription.trim()) {
-            return res.status(400).json({ ok: false, error: 'No se encontraron transcripciones para generar el genograma' });
+            if (!transcription || !transcription.trim()) {
+                return res.status(400).json({ ok: false, error: 'No se encontraron transcripciones para generar el genograma' });
+            }
         }
 
         // Ejecutar script Python
@@ -1927,18 +2199,24 @@ app.post('/api/genograma/:patientId', async (req, res) => {
         const pathKey = process.platform === 'win32' ? 'Path' : 'PATH';
         childEnv[pathKey] = `${path.dirname(pythonPath)}${path.delimiter}${childEnv[pathKey]}`;
 
-        // Crear archivo temporal con la transcripción
-        const tempTranscriptionPath = path.join(__dirname, 'outputs', `temp_transcription_${patientId}.txt`);
-        fs.writeFileSync(tempTranscriptionPath, transcription, 'utf-8');
-
         // Ruta de salida para el HTML
-        const outputPath = path.join(__dirname, 'outputs', `genogram_${patientId}`);
+        // Misma ruta que /api/generate-genogram, para que /api/genogram/render encuentre genograma.family.json.
+        const outputPath = patientFolder
+            ? path.join(outputsDir, patientFolder, 'genograma')
+            : path.join(__dirname, 'outputs', `genogram_${patientId}`);
+
+        let scriptArgs;
+        let tempTranscriptionPath = null;
+        if (hasSessionTranscripts) {
+            scriptArgs = [scriptPath, '--patient', patientFolder, outputPath];
+        } else {
+            // Crear archivo temporal con la transcripción (fuera de la carpeta del paciente)
+            tempTranscriptionPath = path.join(__dirname, 'outputs', `temp_transcription_${patientId}.txt`);
+            fs.writeFileSync(tempTranscriptionPath, transcription, 'utf-8');
+            scriptArgs = [scriptPath, tempTranscriptionPath, outputPath];
+        }
 
-        const pythonProcess = spawn(pythonPath, [
-            scriptPath,
-            tempTranscriptionPath,
-            outputPath
-        ], { env: childEnv });
+        const pythonProcess = spawn(pythonPath, scriptArgs, { env: childEnv });
 
         let pythonOutput = '';
         let pythonError = '';
@@ -1955,7 +2233,9 @@ app.post('/api/genograma/:patientId', async (req, res) => {
 
         pythonProcess.on('close', (code) => {
             // Limpiar archivo temporal
-            try { fs.unlinkSync(tempTranscriptionPath); } catch (e) { }
+            if (tempTranscriptionPath) {
+                try { fs.unlinkSync(tempTranscriptionPath); } catch (e) { }
+            }
 
             console.log(`=== Python Process Finished ===`);
             console.log(`Exit code: ${code}`);
@@ -1988,10 +2268,13 @@ app.post('/api/genograma/:patientId', async (req, res) => {
             const genogramHtml = fs.readFileSync(htmlPath, 'utf-8');
             console.log(`HTML generado exitosamente, tamaño: ${genogramHtml.length} bytes`);
 
+            const familyJsonPath = `${outputPath}.family.json`;
             res.json({
                 ok: true,
                 genogramHtml,
-                outputPath: htmlPath
+                outputPath: htmlPath,
+                patientFolder,
+                familyJson: fs.existsSync(familyJsonPath) ? path.relative(outputsDir, familyJsonPath) : null
             });
         });
 
@@ -0,0 +1,58 @@
+// Single-flight for the retrieval routes: identical requests that arrive while one is still
+// running share its response instead of paying embedding, Qdrant and Gemini again.
+const crypto = require('crypto');
+
+const coalesceInFlight = new Map();
+const coalesceStats = {};
+
+function singleFlight(name, keyOf) {
+    const stats = coalesceStats[name] = { executions: 0, coalesced: 0, saved_llm_calls: 0, in_flight: 0 };
+    return (req, res, next) => {
+        let key;
+        try {
+            key = `${name}:` + crypto.createHash('sha1').update(JSON.stringify(keyOf(req.body || {}))).digest('hex');
+        } catch (e) {
+            return next();
+        }
+
+        const entry = coalesceInFlight.get(key);
+        if (entry) {
+            stats.coalesced += 1;
+            entry.waiters.push(res);
+            return;
+        }
+
+        const waiters = [];
+        coalesceInFlight.set(key, { waiters });
+        stats.executions += 1;
+        stats.in_flight += 1;
+        let settled = false;
+        const settle = (status, body) => {
+            if (settled) return;
+            settled = true;
+            coalesceInFlight.delete(key);
+            stats.in_flight -= 1;
+            for (const w of waiters) {
+                if (w.headersSent) continue;
+                // Every follower of a successful run is one Gemini call that did not happen.
+                if (body && body.ok === true) stats.saved_llm_calls += 1;
+                const shared = (body && typeof body === 'object') ? Object.assign({}, body, { coalesced: true }) : body;
+                w.set('X-Coalesced', '1').status(status).json(shared);
+            }
+        };
+
+        const origJson = res.json.bind(res);
+        res.json = (body) => {
+            settle(res.statusCode, body);
+            return origJson(body);
+        };
+        // A leader whose client went away still finishes and calls res.json; only a response that
+        // ended some other way (res.send/res.end) leaves the followers without a result.
+        res.on('close', () => {
+            if (res.writableFinished) settle(502, { ok: false, error: 'coalesced_request_failed' });
+        });
+        next();
+    };
+}
+
+module.exports = { singleFlight, coalesceStats };
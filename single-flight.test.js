@@ -0,0 +1,114 @@
+// Tests for the single-flight middleware (single-flight.js). Requests and responses are plain
+// stand-ins, so no server or Python tool runs.
+//
+//     node --test
+const test = require('node:test');
+const assert = require('node:assert');
+const { EventEmitter } = require('node:events');
+const { singleFlight, coalesceStats } = require('./single-flight');
+
+class FakeRes extends EventEmitter {
+    constructor() {
+        super();
+        this.statusCode = 200;
+        this.headers = {};
+        this.headersSent = false;
+        this.writableFinished = false;
+        this.body = undefined;
+    }
+
+    set(name, value) { this.headers[name] = value; return this; }
+
+    status(code) { this.statusCode = code; return this; }
+
+    json(body) { this.body = body; return this.end(); }
+
+    end() {
+        this.headersSent = true;
+        this.writableFinished = true;
+        this.emit('close');
+        return this;
+    }
+}
+
+// Runs the middleware for `body`; returns the response and whether the route handler was reached.
+function call(mw, body) {
+    const res = new FakeRes();
+    let reached = false;
+    mw({ body }, res, () => { reached = true; });
+    return { res, reached };
+}
+
+test('identical requests in flight share the leader response', () => {
+    const mw = singleFlight('t_share', (b) => ({ q: b.q }));
+    const leader = call(mw, { q: 'ansiedad', extra: 1 });
+    const follower = call(mw, { q: 'ansiedad', extra: 2 });
+    const other = call(mw, { q: 'insomnio' });
+    assert.ok(leader.reached && !follower.reached && other.reached);
+    assert.deepStrictEqual(coalesceStats.t_share, { executions: 2, coalesced: 1, saved_llm_calls: 0, in_flight: 2 });
+
+    leader.res.status(200).json({ ok: true, answer: 'a' });
+    assert.deepStrictEqual(leader.res.body, { ok: true, answer: 'a' });
+    assert.deepStrictEqual(follower.res.body, { ok: true, answer: 'a', coalesced: true });
+    assert.strictEqual(follower.res.headers['X-Coalesced'], '1');
+    assert.strictEqual(follower.res.statusCode, 200);
+    assert.strictEqual(coalesceStats.t_share.saved_llm_calls, 1);
+    assert.strictEqual(coalesceStats.t_share.in_flight, 1);
+});
+
+test('a finished request is not reused by the next one', () => {
+    const mw = singleFlight('t_done', (b) => b);
+    const first = call(mw, { q: 'x' });
+    first.res.json({ ok: true });
+    const second = call(mw, { q: 'x' });
+    assert.ok(second.reached);
+    assert.strictEqual(coalesceStats.t_done.executions, 2);
+    assert.strictEqual(coalesceStats.t_done.coalesced, 0);
+});
+
+test('errors are shared with their status and do not count as saved calls', () => {
+    const mw = singleFlight('t_error', (b) => b);
+    const leader = call(mw, { q: 'x' });
+    const follower = call(mw, { q: 'x' });
+    leader.res.status(500).json({ ok: false, error: 'qdrant_query_failed' });
+    assert.strictEqual(follower.res.statusCode, 500);
+    assert.deepStrictEqual(follower.res.body, { ok: false, error: 'qdrant_query_failed', coalesced: true });
+    assert.strictEqual(coalesceStats.t_error.saved_llm_calls, 0);
+});
+
+test('a leader that ends without json fails its followers with 502', () => {
+    const mw = singleFlight('t_end', (b) => b);
+    const leader = call(mw, { q: 'x' });
+    const follower = call(mw, { q: 'x' });
+    leader.res.end();
+    assert.strictEqual(follower.res.statusCode, 502);
+    assert.deepStrictEqual(follower.res.body, { ok: false, error: 'coalesced_request_failed', coalesced: true });
+    assert.strictEqual(coalesceStats.t_end.in_flight, 0);
+    assert.ok(call(mw, { q: 'x' }).reached);
+});
+
+test('a leader whose client went away still answers its followers', () => {
+    const mw = singleFlight('t_abort', (b) => b);
+    const leader = call(mw, { q: 'x' });
+    const follower = call(mw, { q: 'x' });
+    leader.res.emit('close');
+    assert.strictEqual(follower.res.body, undefined);
+    leader.res.json({ ok: true, answer: 'tarde' });
+    assert.deepStrictEqual(follower.res.body, { ok: true, answer: 'tarde', coalesced: true });
+});
+
+test('followers that already got a response are skipped', () => {
+    const mw = singleFlight('t_sent', (b) => b);
+    const leader = call(mw, { q: 'x' });
+    const follower = call(mw, { q: 'x' });
+    follower.res.status(504).json({ ok: false, error: 'timeout' });
+    leader.res.json({ ok: true });
+    assert.strictEqual(follower.res.statusCode, 504);
+    assert.strictEqual(coalesceStats.t_sent.saved_llm_calls, 0);
+});
+
+test('a key function that throws bypasses coalescing', () => {
+    const mw = singleFlight('t_bad_key', () => { throw new Error('bad body'); });
+    assert.ok(call(mw, { q: 'x' }).reached && call(mw, { q: 'x' }).reached);
+    assert.strictEqual(coalesceStats.t_bad_key.executions, 0);
+});
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmark CPU embedder modes against the fp32 baseline.
+
+Builds the synthetic fixture collection in qdrant_client's in-process mode
+with fp32 document vectors, as ingest.py/reembed.py store them; `--dims`
+adds fp32 collections truncated to each size (ingest.py --dim). Each variant
+only changes the query side, as in production: its query vectors are fitted
+to the collection (Embedder.fit_to_collection) and searched there. Reports
+query encode latency and recall@k against the fp32 full-size top-k.
+
+Uso:
+    python tools/bench_embedder.py [--docs 300] [--queries 40] [--k 5]
+        [--backends fp32,int8] [--threads 0,1,4] [--dims 0,256]
+
+`--threads 0` leaves torch's default; `--dims 0` means the full-size collection.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List
+
+import torch
+from qdrant_client import QdrantClient
+
+from bench_fixtures import build_collection, make_corpus, make_queries, percentiles
+from embedder import Embedder, truncate_and_normalize
+from retrieval import search_ids
+
+
+def _int_list(s: str) -> List[int]:
+    return [int(x) for x in s.split(",") if x.strip()]
+
+
+def _topk(qclient: QdrantClient, collection: str, vecs: List[List[float]], k: int) -> List[List[Any]]:
+    return [[pid for pid, _ in search_ids(qclient, collection, v, k)] for v in vecs]
+
+
+def run_variant(emb: Embedder, qclient: QdrantClient, collection: str, info: Dict[str, Any],
+                queries: List[str], k: int, baseline: List[List[Any]]) -> Dict[str, Any]:
+    latencies: List[float] = []
+    q_vecs: List[List[float]] = []
+    emb.encode_query(queries[0])  # warm-up, not timed
+    for q in queries:
+        t = time.perf_counter()
+        q_vecs.append(emb.encode_query(q))
+        latencies.append((time.perf_counter() - t) * 1000.0)
+
+    results = _topk(qclient, collection, [emb.fit_to_collection(v, info) for v in q_vecs], k)
+    recall = [len(set(r) & set(b)) / float(max(1, len(b))) for r, b in zip(results, baseline)]
+
+    return {
+        "backend": emb.backend,
+        # torch.set_num_threads is process-wide, so report what was actually in effect.
+        "threads": torch.get_num_threads(),
+        "dim": info["vector_size"],
+        "query_encode_ms": percentiles(latencies),
+        f"recall@{k}": round(sum(recall) / len(recall), 4) if recall else 0.0,
+    }
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--model", default=os.environ.get("RAG_EMBED_MODEL", "intfloat/multilingual-e5-base"))
+    ap.add_argument("--docs", type=int, default=300)
+    ap.add_argument("--queries", type=int, default=40)
+    ap.add_argument("--k", type=int, default=5)
+    ap.add_argument("--backends", default="fp32,int8")
+    ap.add_argument("--threads", default="0")
+    ap.add_argument("--dims", default="0")
+    args = ap.parse_args()
+
+    payloads = make_corpus(args.docs)
+    texts = [p["page_content"] for p in payloads]
+    queries = make_queries(args.queries)
+    qclient = QdrantClient(":memory:")
+
+    # Ground truth: fp32, default threads, full dimension.
+    base = Embedder(args.model, backend="fp32", threads=0, truncate_dim=0)
+    doc_vecs = base.encode(texts)
+    build_collection(qclient, "bench_baseline", payloads, doc_vecs)
+    baseline = _topk(qclient, "bench_baseline", base.encode(queries), args.k)
+
+    # The document side is what ingest.py stores: fp32, full size or truncated with --dim.
+    collections: Dict[int, Any] = {0: ("bench_baseline", {"vector_size": base.dim, "metadata": {}})}
+    for dim in _int_list(args.dims):
+        if dim and dim < base.dim:
+            name = f"bench_fp32_d{dim}"
+            build_collection(qclient, name, payloads, [truncate_and_normalize(v, dim) for v in doc_vecs])
+            collections[dim] = (name, {"vector_size": dim, "metadata": {"embed_dim": dim}})
+    del base, doc_vecs
+
+    rows: List[Dict[str, Any]] = []
+    for backend in [b.strip() for b in args.backends.split(",") if b.strip()]:
+        for threads in _int_list(args.threads):
+            emb = Embedder(args.model, backend=backend, threads=threads, truncate_dim=0)
+            for name, info in collections.values():
+                rows.append(run_variant(emb, qclient, name, info, queries, args.k, baseline))
+                print(json.dumps(rows[-1], ensure_ascii=False), file=sys.stderr)
+
+    print(json.dumps({
+        "ok": True,
+        "model": args.model,
+        "docs": len(payloads),
+        "queries": len(queries),
+        "k": args.k,
+        "results": rows,
+    }, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Synthetic clinical/ICD-11 corpus and helpers for the offline benchmarks.
+
+Texts are generated deterministically from small Spanish templates so the
+benchmarks run without the real PDFs, Qdrant Cloud or Gemini. Payloads use
+the same shape as the production collections (page_content + metadata with
+source_pdf/page/category/code).
+"""
+
+import math
+import random
+from typing import Any, Dict, List, Optional, Tuple
+
+
+CONDITIONS: List[Tuple[str, str, str]] = [
+    ("6A20", "Esquizofrenia", "Trastornos psicóticos"),
+    ("6A60", "Trastorno bipolar tipo I", "Trastornos del estado de ánimo"),
+    ("6A70", "Episodio depresivo único", "Trastornos del estado de ánimo"),
+    ("6A71", "Trastorno depresivo recurrente", "Trastornos del estado de ánimo"),
+    ("6B00", "Trastorno de ansiedad generalizada", "Trastornos de ansiedad"),
+    ("6B01", "Trastorno de pánico", "Trastornos de ansiedad"),
+    ("6B04", "Trastorno de ansiedad social", "Trastornos de ansiedad"),
+    ("6B20", "Trastorno obsesivo-compulsivo", "Trastornos obsesivo-compulsivos"),
+    ("6B40", "Trastorno de estrés postraumático", "Trastornos asociados al estrés"),
+    ("6B41", "Trastorno de estrés postraumático complejo", "Trastornos asociados al estrés"),
+    ("6B43", "Trastorno de adaptación", "Trastornos asociados al estrés"),
+    ("6B80", "Anorexia nerviosa", "Trastornos de la alimentación"),
+    ("6B81", "Bulimia nerviosa", "Trastornos de la alimentación"),
+    ("6C40", "Trastornos debidos al consumo de alcohol", "Consumo de sustancias"),
+    ("6D10", "Trastorno de la personalidad", "Trastornos de la personalidad"),
+    ("7A00", "Insomnio crónico", "Trastornos del sueño"),
+]
+
+SYMPTOMS = [
+    "preocupación excesiva", "insomnio de conciliación", "anhedonia", "irritabilidad",
+    "ideas intrusivas", "evitación de situaciones sociales", "pesadillas recurrentes",
+    "hipervigilancia", "pérdida de apetito", "atracones", "fatiga persistente",
+    "dificultad de concentración", "sentimientos de culpa", "alucinaciones auditivas",
+    "consumo diario de alcohol", "crisis de angustia", "rituales de comprobación",
+    "inestabilidad emocional", "aislamiento", "despertar precoz",
+]
+
+CONTEXTS = [
+    "tras la separación de sus padres", "desde la muerte de su abuela", "en el entorno laboral",
+    "durante la adolescencia", "después de un accidente de tráfico", "en la relación de pareja",
+    "con antecedentes familiares", "tras un episodio de violencia", "en periodos de exámenes",
+]
+
+
+def _rng(seed: int) -> random.Random:
+    return random.Random(seed)
+
+
+def make_corpus(n_docs: int = 300, seed: int = 13) -> List[Dict[str, Any]]:
+    """Returns payloads shaped like the production collections."""
+    rnd = _rng(seed)
+    docs: List[Dict[str, Any]] = []
+    for i in range(n_docs):
+        code, name, category = CONDITIONS[i % len(CONDITIONS)]
+        sx = rnd.sample(SYMPTOMS, 4)
+        ctx = rnd.choice(CONTEXTS)
+        sub = f"{code}.{rnd.randint(0, 3)}" if rnd.random() < 0.3 else code
+        text = (
+            f"{sub} {name}. Se caracteriza por {sx[0]}, {sx[1]} y {sx[2]}, "
+            f"frecuentemente {ctx}. El cuadro puede incluir {sx[3]} y afecta el "
+            f"funcionamiento personal, familiar y social. Criterios diagnósticos y "
+            f"diagnóstico diferencial descritos en la sección {category.lower()}."
+        )
+        docs.append({
+            "page_content": text,
+            "metadata": {
+                "source_pdf": f"fixture_{(i // 40) + 1}.pdf",
+                "page": (i % 40) + 1,
+                "category": category,
+                "code": sub,
+            },
+        })
+    return docs
+
+
+def make_queries(n_queries: int = 40, seed: int = 29) -> List[str]:
+    rnd = _rng(seed)
+    out: List[str] = []
+    for i in range(n_queries):
+        if i % 8 == 7:
+            out.append(CONDITIONS[rnd.randrange(len(CONDITIONS))][0])
+            continue
+        sx = rnd.sample(SYMPTOMS, 2)
+        out.append(f"Paciente refiere {sx[0]} y {sx[1]} {rnd.choice(CONTEXTS)}")
+    return out
+
+
+def build_collection(qclient: Any, name: str, payloads: List[Dict[str, Any]],
+                     vectors: List[List[float]], batch_size: int = 128,
+                     distance: Optional[Any] = None) -> None:
+    """Creates `name` in `qclient` (e.g. QdrantClient(':memory:')) and upserts the fixture."""
+    from qdrant_client import models
+
+    if not vectors:
+        raise ValueError("no vectors")
+    if qclient.collection_exists(name):
+        qclient.delete_collection(name)
+    qclient.create_collection(
+        collection_name=name,
+        vectors_config=models.VectorParams(size=len(vectors[0]), distance=distance or models.Distance.COSINE),
+    )
+    for start in range(0, len(payloads), batch_size):
+        qclient.upsert(
+            collection_name=name,
+            points=[
+                models.PointStruct(id=start + j, vector=v, payload=p)
+                for j, (p, v) in enumerate(zip(payloads[start: start + batch_size], vectors[start: start + batch_size]))
+            ],
+        )
+
+
+def percentiles(values: List[float], ps: Tuple[int, ...] = (50, 95, 99)) -> Dict[str, float]:
+    if not values:
+        return {f"p{p}": 0.0 for p in ps}
+    s = sorted(values)
+    out = {}
+    for p in ps:
+        # Nearest-rank percentile.
+        idx = min(len(s) - 1, max(0, math.ceil(p / 100.0 * len(s)) - 1))
+        out[f"p{p}"] = round(s[idx], 3)
+    return out
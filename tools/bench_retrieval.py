@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Offline end-to-end benchmark of the rag_query.py / icd11_score.py retrieval path.
+
+Fixture collections are built in qdrant_client's in-process mode from the
+synthetic corpus in bench_fixtures.py and the Gemini client is replaced by a
+stub that answers instantly, so the numbers only cover what runs locally:
+embedder load, query embedding, Qdrant search, payload decode and prompt
+build. Each tool's main() is called in-process (stdin/stdout are redirected
+per thread) at several concurrency levels.
+
+`cold_start` is one request per tool with no cached catalog, no BM25 index
+in memory and a fresh model load, which is what every process spawned by
+server.js pays today. The concurrency levels reuse the loaded model and
+index, as a long-lived worker would.
+
+Uso:
+    python tools/bench_retrieval.py [--docs 300] [--queries 40] [--requests 80]
+        [--concurrency 1,2,4,8] [--tools rag,icd11] [--hash-embedder]
+
+`--hash-embedder` replaces the sentence-transformers model with a hashed
+bag-of-words embedder, to time the rest of the path without the model.
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from qdrant_client import QdrantClient
+
+import icd11_score
+import lexical_index
+import rag_query
+import retrieval
+from bench_fixtures import build_collection, make_corpus, make_queries, percentiles
+from lexical_index import LexicalIndex, tokenize
+
+
+RAG_COLLECTION = "bench_rag"
+ICD_COLLECTION = "bench_icd11"
+STAGES = ("load", "embed", "lexical", "search", "payload", "prompt")
+# Valid for both tools: icd11_score parses it, rag_query just returns it.
+STUB_ANSWER = json.dumps({
+    "top": [{"nombre": "Trastorno de ansiedad generalizada", "codigo": "6B00", "score": 60, "evidencia": [1]}],
+    "nota": "respuesta simulada (bench)",
+}, ensure_ascii=False)
+
+_local = threading.local()
+
+
+@contextmanager
+def _stage(name: str) -> Iterator[None]:
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        stages = getattr(_local, "stages", None)
+        if stages is not None:
+            stages[name] += (time.perf_counter() - t0) * 1000.0
+
+
+def _timed(name: str, fn: Callable[..., Any]) -> Callable[..., Any]:
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        with _stage(name):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+class _ThreadIO:
+    """sys.stdin/sys.stdout stand-in so concurrent main() calls don't share buffers."""
+
+    def read(self) -> str:
+        return getattr(_local, "stdin", "")
+
+    def write(self, s: str) -> int:
+        return _local.out.write(s)
+
+    def flush(self) -> None:
+        pass
+
+
+class HashEmbedder:
+    """Deterministic hashed bag-of-words vectors (no model download)."""
+
+    def __init__(self, dim: int = 256):
+        self.model_name = "hash"
+        self.dim = dim
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> List[List[float]]:
+        out: List[List[float]] = []
+        for text in texts:
+            vec = [0.0] * self.dim
+            for tok in tokenize(text):
+                h = int(hashlib.md5(tok.encode("utf-8")).hexdigest(), 16)
+                vec[h % self.dim] += 1.0 if (h >> 64) & 1 else -1.0
+            norm = math.sqrt(sum(x * x for x in vec)) or 1.0
+            out.append([x / norm for x in vec])
+        return out
+
+    def encode_query(self, text: str) -> List[float]:
+        return self.encode([text])[0]
+
+    def fit_to_collection(self, vec: List[float], collection_info: Optional[Dict[str, Any]]) -> List[float]:
+        return vec
+
+
+class _TimedEmbedder:
+    def __init__(self, inner: Any):
+        self.inner = inner
+
+    def encode_query(self, text: str) -> List[float]:
+        with _stage("embed"):
+            return self.inner.encode_query(text)
+
+    def fit_to_collection(self, vec: List[float], collection_info: Optional[Dict[str, Any]]) -> List[float]:
+        return self.inner.fit_to_collection(vec, collection_info)
+
+
+class _StubGeminiModels:
+    def generate_content(self, model: str, contents: str) -> Any:
+        return SimpleNamespace(text=STUB_ANSWER)
+
+    def generate_content_stream(self, model: str, contents: str) -> Iterator[Any]:
+        yield SimpleNamespace(text=STUB_ANSWER)
+
+
+class _StubGeminiClient:
+    def __init__(self, api_key: str = "", **kwargs: Any):
+        self.models = _StubGeminiModels()
+
+
+class Harness:
+    """Patches the tool modules to run against `qclient` with stubbed Gemini and timed stages."""
+
+    def __init__(self, qclient: QdrantClient, make_embedder: Callable[[], Any]):
+        self.qclient = qclient
+        self.make_embedder = make_embedder
+        self.warm_embedder: Optional[Any] = None
+        self.cold = True
+
+    def _embedder_factory(self, model_name: Optional[str] = None, **kwargs: Any) -> _TimedEmbedder:
+        if self.cold or self.warm_embedder is None:
+            with _stage("load"):
+                self.warm_embedder = self.make_embedder()
+        return _TimedEmbedder(self.warm_embedder)
+
+    def install(self) -> None:
+        stub_genai = SimpleNamespace(Client=_StubGeminiClient)
+        for mod in (rag_query, icd11_score):
+            mod.QdrantClient = lambda *a, **kw: self.qclient
+            mod.genai = stub_genai
+            mod.Embedder = self._embedder_factory
+            mod.pack_context = _timed("prompt", mod.pack_context)
+            mod.format_context = _timed("prompt", mod.format_context)
+            mod.count_tokens = _timed("prompt", mod.count_tokens)
+        icd11_score.load_fresh = _timed("lexical", icd11_score.load_fresh)
+        icd11_score.load_code_table = _timed("lexical", icd11_score.load_code_table)
+        # two_phase_search resolves these through the retrieval module at call time.
+        retrieval.search_ids = _timed("search", retrieval.search_ids)
+        retrieval.fetch_payloads = _timed("payload", retrieval.fetch_payloads)
+        retrieval.payload_to_text_and_meta = _timed("payload", retrieval.payload_to_text_and_meta)
+
+    def run_one(self, tool: Any, req: Dict[str, Any]) -> Dict[str, Any]:
+        _local.stdin = json.dumps(req, ensure_ascii=False)
+        _local.out = io.StringIO()
+        _local.stages = defaultdict(float)
+        t0 = time.perf_counter()
+        try:
+            rc = tool.main()
+        except Exception as e:
+            rc, res = -1, {"ok": False, "error": type(e).__name__, "detail": str(e)}
+        else:
+            lines = _local.out.getvalue().strip().splitlines()
+            try:
+                res = json.loads(lines[-1]) if lines else {}
+            except ValueError:
+                res = {"ok": False, "error": "bad_json_out"}
+        total_ms = (time.perf_counter() - t0) * 1000.0
+        stages = dict(_local.stages)
+        stages["other"] = max(0.0, total_ms - sum(stages.values()))
+        return {
+            "rc": rc,
+            "ok": bool(res.get("ok")),
+            "error": res.get("error"),
+            "mode": ((res.get("metrics") or {}).get("retrieval") or {}).get("mode"),
+            "total_ms": total_ms,
+            "stages": stages,
+        }
+
+
+def _requests_for(tool_name: str, queries: List[str]) -> List[Dict[str, Any]]:
+    if tool_name == "rag":
+        return [{"collection": RAG_COLLECTION, "query": q, "k": 6, "top_n": 25} for q in queries]
+    return [{"collection": ICD_COLLECTION, "clinical_text": q, "k": 8} for q in queries]
+
+
+def _cold_row(run: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "ok": run["ok"],
+        "error": run["error"],
+        "total_ms": round(run["total_ms"], 3),
+        "stages_ms": {s: round(v, 3) for s, v in run["stages"].items()},
+    }
+
+
+def run_level(harness: Harness, tool: Any, tool_name: str, reqs: List[Dict[str, Any]],
+              concurrency: int, n_requests: int) -> Dict[str, Any]:
+    batch = [reqs[i % len(reqs)] for i in range(n_requests)]
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        runs = list(pool.map(lambda r: harness.run_one(tool, r), batch))
+    wall_s = time.perf_counter() - t0
+
+    stage_names = sorted({s for r in runs for s in r["stages"]}, key=lambda s: (STAGES + ("other",)).index(s))
+    modes: Dict[str, int] = defaultdict(int)
+    for r in runs:
+        modes[r["mode"] or ("dense" if r["ok"] else "error")] += 1
+    return {
+        "tool": tool_name,
+        "concurrency": concurrency,
+        "requests": len(runs),
+        "errors": sum(1 for r in runs if not r["ok"]),
+        "throughput_rps": round(len(runs) / wall_s, 2) if wall_s > 0 else 0.0,
+        "latency_ms": percentiles([r["total_ms"] for r in runs]),
+        "stages_ms_p50": {s: percentiles([r["stages"].get(s, 0.0) for r in runs], (50,))["p50"] for s in stage_names},
+        "modes": dict(modes),
+    }
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--model", default=os.environ.get("RAG_EMBED_MODEL", "intfloat/multilingual-e5-base"))
+    ap.add_argument("--docs", type=int, default=300)
+    ap.add_argument("--queries", type=int, default=40)
+    ap.add_argument("--requests", type=int, default=80, help="requests per concurrency level")
+    ap.add_argument("--concurrency", default="1,2,4,8")
+    ap.add_argument("--tools", default="rag,icd11")
+    ap.add_argument("--hash-embedder", action="store_true")
+    args = ap.parse_args()
+
+    if args.hash_embedder:
+        make_embedder: Callable[[], Any] = HashEmbedder
+    else:
+        from embedder import Embedder
+        make_embedder = lambda: Embedder(args.model)
+
+    # The tools insist on these; nothing leaves the process.
+    cache_dir = tempfile.mkdtemp(prefix="bench_retrieval_")
+    os.environ.update({
+        "QDRANT_URL": "http://bench.local",
+        "QDRANT_API_KEY": "bench",
+        "GEMINI_API_KEY": "bench",
+        "RAG_CACHE_DIR": cache_dir,
+        "RAG_EMBED_MODEL": args.model,
+    })
+
+    qclient = QdrantClient(":memory:")
+    fixture_embedder = make_embedder()
+    for name, seed in ((RAG_COLLECTION, 13), (ICD_COLLECTION, 17)):
+        payloads = make_corpus(args.docs, seed=seed)
+        build_collection(qclient, name, payloads, fixture_embedder.encode([p["page_content"] for p in payloads]))
+    del fixture_embedder
+    # ingest.py builds the BM25 index after loading a collection; the query path only reads it.
+    LexicalIndex.build(qclient, ICD_COLLECTION)
+    queries = make_queries(args.queries)
+
+    harness = Harness(qclient, make_embedder)
+    harness.install()
+    tools = {"rag": rag_query, "icd11": icd11_score}
+    selected = [t.strip() for t in args.tools.split(",") if t.strip() in tools]
+
+    real_stdin, real_stdout = sys.stdin, sys.stdout
+    sys.stdin = sys.stdout = _ThreadIO()  # type: ignore[assignment]
+    cold: Dict[str, Any] = {}
+    rows: List[Dict[str, Any]] = []
+    try:
+        for name in selected:
+            harness.cold = True
+            # A process spawned by server.js also starts without the BM25 index in memory.
+            lexical_index._loaded.clear()
+            cold[name] = _cold_row(harness.run_one(tools[name], _requests_for(name, queries)[0]))
+            print(json.dumps({"cold_start": name, **cold[name]}, ensure_ascii=False), file=sys.stderr)
+        harness.cold = False
+        for name in selected:
+            reqs = _requests_for(name, queries)
+            for c in [int(x) for x in args.concurrency.split(",") if x.strip()]:
+                rows.append(run_level(harness, tools[name], name, reqs, max(1, c), args.requests))
+                print(json.dumps(rows[-1], ensure_ascii=False), file=sys.stderr)
+    finally:
+        sys.stdin, sys.stdout = real_stdin, real_stdout
+
+    print(json.dumps({
+        "ok": True,
+        "model": "hash" if args.hash_embedder else args.model,
+        "docs": args.docs,
+        "queries": len(queries),
+        "cache_dir": cache_dir,
+        "cold_start": cold,
+        "results": rows,
+    }, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Cached catalog of Qdrant collections shared by rag_query.py and icd11_score.py.
+
+Each tool run is a short-lived process spawned by server.js, so the catalog
+lives on disk (RAG_CACHE_DIR) and is refreshed when older than
+RAG_CATALOG_TTL seconds or when Qdrant reports a missing collection.
+
+Collections can be versioned per embedder model: the physical collection is
+`<name>__<model>` (`<name>__<model>-d<dim>` when built with truncated vectors,
+see versioned_name) and `<name>` is a Qdrant alias to the live version. A collection created before versioning keeps its plain name
+until tools/reembed.py --drop-old removes it; meanwhile the alias
+`<name>__live` points to the new version and takes precedence. lookup()
+resolves aliases and reports the physical collection and the model it was
+embedded with (recorded in the collection metadata by ingest.py and
+reembed.py), so the tools query one consistent version even while reembed.py
+swaps the alias underneath them.
+"""
+
+import hashlib
+import json
+import os
+import re
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from qdrant_client import QdrantClient
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+DEFAULT_TTL_S = 600.0
+VERSION_SEP = "__"
+
+
+def default_cache_dir() -> Path:
+    return Path(os.environ.get("RAG_CACHE_DIR") or (PROJECT_ROOT / "outputs" / ".rag_cache"))
+
+
+def write_json_atomic(path: Path, obj: Any) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def versioned_name(base: str, model: str, dim: int = 0) -> str:
+    # Collection names cannot contain "/", so "intfloat/multilingual-e5-base" becomes "intfloat--multilingual-e5-base".
+    name = f"{base}{VERSION_SEP}{model.replace('/', '--')}"
+    return f"{name}-d{dim}" if dim else name
+
+
+# Only "<org>--<model>" slugs decode back to a model id; "rag__dsm" is a plain name.
+_MODEL_SLUG_RE = re.compile(r"^[A-Za-z0-9][\w.-]*--[A-Za-z0-9][\w.-]*$")
+_DIM_SUFFIX_RE = re.compile(r"-d\d+$")
+LIVE_ALIAS_SUFFIX = f"{VERSION_SEP}live"
+
+
+def model_from_collection(name: str) -> Optional[str]:
+    """Model encoded in a versioned collection name, or None.
+
+    Only a fallback for servers without collection metadata: the model
+    recorded by ingest.py/reembed.py (see collection_model) wins.
+    """
+    if VERSION_SEP not in name:
+        return None
+    slug = _DIM_SUFFIX_RE.sub("", name.rsplit(VERSION_SEP, 1)[1])
+    if not _MODEL_SLUG_RE.match(slug) or slug.count("--") != 1:
+        return None
+    return slug.replace("--", "/")
+
+
+def collection_model(entry: Optional[Dict[str, Any]], physical: str) -> Optional[str]:
+    """Embedder model of a described collection: its metadata, else a strictly decoded versioned name."""
+    recorded = ((entry or {}).get("metadata") or {}).get("embed_model")
+    return str(recorded) if recorded else model_from_collection(physical)
+
+
+def collection_dim(entry: Optional[Dict[str, Any]]) -> int:
+    """Truncated vector size recorded by ingest.py/reembed.py --dim; 0 for full-size vectors."""
+    try:
+        return int(((entry or {}).get("metadata") or {}).get("embed_dim") or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def live_alias(name: str) -> str:
+    return f"{name}{LIVE_ALIAS_SUFFIX}"
+
+
+def resolve_alias(aliases: Dict[str, str], name: str) -> Optional[str]:
+    """Physical collection behind `name`, or None when `name` is not an alias.
+
+    `<name>__live` wins over `<name>`: it exists only while a plain `<name>`
+    collection is waiting for reembed.py --drop-old.
+    """
+    return aliases.get(live_alias(name)) or aliases.get(name)
+
+
+def list_aliases(qclient: QdrantClient) -> Dict[str, str]:
+    """{alias: physical collection}; empty when the server/client has no alias support."""
+    try:
+        resp = qclient.get_aliases()
+    except Exception:
+        return {}
+    return {
+        str(getattr(a, "alias_name", "")): str(getattr(a, "collection_name", ""))
+        for a in (getattr(resp, "aliases", None) or [])
+        if getattr(a, "alias_name", None)
+    }
+
+
+def _enum_str(v: Any) -> Optional[str]:
+    if v is None:
+        return None
+    return str(getattr(v, "value", v))
+
+
+def describe_collection(qclient: QdrantClient, name: str) -> Dict[str, Any]:
+    info = qclient.get_collection(collection_name=name)
+    config = getattr(info, "config", None)
+    params = getattr(config, "params", None)
+    vectors = getattr(params, "vectors", None)
+
+    entry: Dict[str, Any] = {
+        "vector_size": None,
+        "distance": None,
+        "named_vectors": {},
+        "points_count": getattr(info, "points_count", None),
+        # Collection metadata (Qdrant >= 1.16): ingested_at, embed_model... Empty on older servers.
+        "metadata": dict(getattr(config, "metadata", None) or {}),
+    }
+    if isinstance(vectors, dict):
+        for vname, vp in vectors.items():
+            entry["named_vectors"][str(vname)] = {
+                "size": getattr(vp, "size", None),
+                "distance": _enum_str(getattr(vp, "distance", None)),
+            }
+    elif vectors is not None:
+        entry["vector_size"] = getattr(vectors, "size", None)
+        entry["distance"] = _enum_str(getattr(vectors, "distance", None))
+    return entry
+
+
+def mark_ingested(qclient: QdrantClient, collection: str) -> Optional[float]:
+    """Stamps the collection's metadata with `ingested_at`; None when the server has no metadata support.
+
+    ingest.py and reembed.py call it after writing points, so anything built
+    from the collection's content (the BM25 index) can tell it is outdated
+    even when the point count did not change.
+    """
+    stamp = time.time()
+    try:
+        qclient.update_collection(collection_name=collection, metadata={"ingested_at": stamp})
+    except Exception:
+        return None
+    return stamp
+
+
+class CollectionCatalog:
+    def __init__(self, qclient: QdrantClient, qdrant_url: str = "", ttl_s: Optional[float] = None,
+                 cache_dir: Optional[Path] = None):
+        self.qclient = qclient
+        if ttl_s is None:
+            try:
+                ttl_s = float(os.environ.get("RAG_CATALOG_TTL") or DEFAULT_TTL_S)
+            except ValueError:
+                ttl_s = DEFAULT_TTL_S
+        self.ttl_s = ttl_s
+        # One cache file per Qdrant endpoint so switching QDRANT_URL never mixes catalogs.
+        url_key = hashlib.sha1((qdrant_url or "").encode("utf-8")).hexdigest()[:12]
+        self.path = Path(cache_dir or default_cache_dir()) / f"qdrant_catalog_{url_key}.json"
+        self._data: Optional[Dict[str, Any]] = None
+        self.refreshed = False
+
+    def _load(self) -> Dict[str, Any]:
+        if self._data is not None:
+            return self._data
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if not isinstance(data, dict) or not isinstance(data.get("collections"), dict):
+                raise ValueError("bad catalog")
+        except Exception:
+            data = {"fetched_at": 0.0, "collections": {}}
+        self._data = data
+        return data
+
+    def _stale(self) -> bool:
+        return (time.time() - float(self._load().get("fetched_at") or 0.0)) > self.ttl_s
+
+    def _entry_stale(self, entry: Dict[str, Any]) -> bool:
+        # vector_size/distance/points_count change with re-ingests; the name listing alone does not show it.
+        if "vector_size" not in entry or "metadata" not in entry:
+            return True
+        return (time.time() - float(entry.get("described_at") or 0.0)) > self.ttl_s
+
+    def refresh(self) -> Dict[str, Any]:
+        try:
+            cols = self.qclient.get_collections()
+        except Exception:
+            # Keep whatever we had; callers treat an empty catalog as "unknown".
+            return self._load()
+        items = getattr(cols, "collections", None) or []
+        old = self._load().get("collections") or {}
+        collections: Dict[str, Any] = {}
+        for c in items:
+            n = getattr(c, "name", None)
+            if n:
+                # Details are described lazily in lookup(), which re-describes an entry
+                # once its own `described_at` is older than the TTL.
+                collections[str(n)] = old.get(str(n)) or {}
+        data = {"fetched_at": time.time(), "collections": collections, "aliases": list_aliases(self.qclient)}
+        self._data = data
+        self.refreshed = True
+        try:
+            write_json_atomic(self.path, data)
+        except Exception:
+            pass
+        return data
+
+    def invalidate(self) -> None:
+        self._data = {"fetched_at": 0.0, "collections": {}, "aliases": {}}
+        try:
+            self.path.unlink()
+        except Exception:
+            pass
+
+    def names(self) -> List[str]:
+        if self._stale():
+            self.refresh()
+        data = self._load()
+        return sorted(set(data.get("collections") or {}) | set(data.get("aliases") or {}))
+
+    def lookup(self, name: str) -> Optional[Dict[str, Any]]:
+        """Catalog entry for `name` (collection or alias), or None if it is unknown.
+
+        An unknown name triggers one refresh before giving up, so a freshly
+        created collection is found without waiting for the TTL. Details
+        (vector size, distance, point count) are re-described once they are
+        older than the TTL. The entry
+        also carries `collection` (the physical collection to query) and
+        `embed_model` (None when no model was recorded for it).
+        """
+        if self._stale():
+            self.refresh()
+        data = self._load()
+        if (name not in (data.get("collections") or {}) and resolve_alias(data.get("aliases") or {}, name) is None
+                and not self.refreshed):
+            data = self.refresh()
+        physical = resolve_alias(data.get("aliases") or {}, name) or name
+        collections = data.get("collections") or {}
+        if physical not in collections:
+            return None
+
+        entry = collections[physical]
+        if self._entry_stale(entry):
+            try:
+                entry = dict(describe_collection(self.qclient, physical), described_at=time.time())
+            except Exception:
+                return dict(entry, collection=physical, embed_model=collection_model(entry, physical))
+            collections[physical] = entry
+            try:
+                write_json_atomic(self.path, self._load())
+            except Exception:
+                pass
+        return dict(entry, collection=physical, embed_model=collection_model(entry, physical))
+
+    @staticmethod
+    def dimension_error(entry: Optional[Dict[str, Any]], dim: int, vector_name: str = "") -> Optional[str]:
+        if not entry:
+            return None
+        size = entry.get("vector_size")
+        if vector_name:
+            size = (entry.get("named_vectors") or {}).get(vector_name, {}).get("size")
+        if size is None or int(size) == int(dim):
+            return None
+        return f"El embedder produce vectores de {dim} dimensiones pero la colección espera {size}."
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Token-budgeted context packing for the RAG and ICD-11 prompts.
+
+Chunks arrive ranked. Near-duplicates of an earlier chunk from the same
+source/page are dropped, then the remaining ones are trimmed so the total
+fits the token budget. The returned list is what the prompt numbers as
+[1], [2], ... so `sources` built from it stays aligned with the citations.
+"""
+
+import os
+import re
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+try:
+    import tiktoken
+except Exception:  # tiktoken is optional; fall back to a char-based estimate
+    tiktoken = None
+
+
+DEFAULT_CONTEXT_TOKENS = 3000
+MIN_CHUNK_TOKENS = 48
+DUP_THRESHOLD = 0.8
+_SHINGLE = 5
+
+_encoder = None
+_encoder_failed = False
+
+
+def _get_encoder():
+    global _encoder, _encoder_failed
+    if _encoder is None and not _encoder_failed and tiktoken is not None:
+        try:
+            # Gemini's tokenizer is not public; cl100k_base is a close enough proxy for budgeting.
+            _encoder = tiktoken.get_encoding(os.environ.get("RAG_TOKEN_ENCODING", "cl100k_base"))
+        except Exception:
+            _encoder_failed = True
+    return _encoder
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    enc = _get_encoder()
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    return max(1, len(text) // 4)
+
+
+def trim_to_tokens(text: str, max_tokens: int) -> str:
+    if max_tokens <= 0:
+        return ""
+    enc = _get_encoder()
+    if enc is not None:
+        ids = enc.encode(text, disallowed_special=())
+        if len(ids) <= max_tokens:
+            return text
+        # The marker counts against the cap too; re-encoding a cut can merge differently.
+        keep = max(0, max_tokens - len(enc.encode(" …", disallowed_special=())))
+        out = enc.decode(ids[:keep]).rstrip() + " …"
+        while keep > 0 and len(enc.encode(out, disallowed_special=())) > max_tokens:
+            keep -= 1
+            out = enc.decode(ids[:keep]).rstrip() + " …"
+        return out
+    if len(text) <= max_tokens * 4:
+        return text
+    return text[: max_tokens * 4].rstrip() + " …"
+
+
+def _shingles(text: str) -> Set[Tuple[str, ...]]:
+    words = re.findall(r"\w+", (text or "").lower())
+    if len(words) < _SHINGLE:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i: i + _SHINGLE]) for i in range(len(words) - _SHINGLE + 1)}
+
+
+def _containment(a: Set[Tuple[str, ...]], b: Set[Tuple[str, ...]]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / float(min(len(a), len(b)))
+
+
+def _page_key(meta: Dict[str, Any]) -> Tuple[Any, Any]:
+    return (meta.get("source_pdf") or meta.get("source"), meta.get("page"))
+
+
+def _water_level(sizes: List[int], budget: int) -> int:
+    """Largest per-chunk cap c with sum(min(size, c)) <= budget."""
+    if sum(sizes) <= budget:
+        return max(sizes) if sizes else 0
+    lo, hi = 0, max(sizes)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if sum(min(s, mid) for s in sizes) <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def pack_context(
+    docs: List[Dict[str, Any]],
+    budget_tokens: Optional[int] = None,
+    dup_threshold: float = DUP_THRESHOLD,
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    if budget_tokens is None:
+        try:
+            budget_tokens = int(os.environ.get("RAG_CONTEXT_TOKENS") or DEFAULT_CONTEXT_TOKENS)
+        except ValueError:
+            budget_tokens = DEFAULT_CONTEXT_TOKENS
+    budget_tokens = max(MIN_CHUNK_TOKENS, int(budget_tokens))
+
+    # 1. Drop chunks mostly contained in a better-ranked chunk of the same source/page.
+    kept: List[Dict[str, Any]] = []
+    kept_shingles: List[Tuple[Tuple[Any, Any], Set[Tuple[str, ...]]]] = []
+    dropped = 0
+    for d in docs:
+        text = d.get("page_content") or ""
+        key = _page_key(d.get("metadata") or {})
+        sh = _shingles(text)
+        if any(k == key and _containment(sh, other) >= dup_threshold for k, other in kept_shingles):
+            dropped += 1
+            continue
+        kept.append(d)
+        kept_shingles.append((key, sh))
+
+    sizes = [count_tokens(d.get("page_content") or "") for d in kept]
+    raw_tokens = sum(sizes)
+
+    # 2. Share the budget: short chunks stay whole, long ones are cut to a common cap.
+    # If the cap gets too small to be useful, keep fewer (top-ranked) chunks instead.
+    n = len(kept)
+    cap = _water_level(sizes, budget_tokens)
+    while n > 1 and cap < MIN_CHUNK_TOKENS and sum(sizes[:n]) > budget_tokens:
+        n -= 1
+        cap = _water_level(sizes[:n], budget_tokens)
+
+    packed: List[Dict[str, Any]] = []
+    trimmed = 0
+    context_tokens = 0
+    for d, size in zip(kept[:n], sizes[:n]):
+        if size > cap:
+            d = dict(d, page_content=trim_to_tokens(d.get("page_content") or "", cap))
+            trimmed += 1
+            size = count_tokens(d["page_content"])
+        packed.append(d)
+        context_tokens += size
+
+    stats = {
+        "budget": budget_tokens,
+        "context_raw": raw_tokens,
+        "context": context_tokens,
+        "chunks_in": len(docs),
+        "chunks_out": len(packed),
+        "dropped_duplicates": dropped,
+        "dropped_over_budget": len(kept) - n,
+        "trimmed": trimmed,
+        "tokenizer": "tiktoken" if _get_encoder() is not None else "chars/4",
+    }
+    return packed, stats
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Query embedder used by the RAG tools, with CPU-oriented options.
+
+Environment:
+    RAG_EMBED_MODEL     sentence-transformers model (default multilingual-e5-base)
+    RAG_EMBED_BACKEND   fp32 (default) or int8 (dynamic quantization of Linear layers)
+    RAG_EMBED_THREADS   torch intra-op threads (default: torch's choice)
+
+Matryoshka-style truncation is a property of the collection, not of the
+query side: ingest.py/reembed.py --dim store truncated fp32 document vectors
+and record `embed_dim` in the collection metadata, and fit_to_collection
+truncates queries to match.
+"""
+
+import math
+import os
+from typing import Any, Dict, List, Optional
+
+from sentence_transformers import SentenceTransformer
+
+
+DEFAULT_MODEL = "intfloat/multilingual-e5-base"
+BACKENDS = ("fp32", "int8")
+
+
+def _env_int(name: str) -> Optional[int]:
+    try:
+        v = int(os.environ.get(name) or 0)
+    except ValueError:
+        return None
+    return v if v > 0 else None
+
+
+def _as_int(v: Any) -> Optional[int]:
+    try:
+        return int(v) if v else None
+    except (TypeError, ValueError):
+        return None
+
+
+def truncate_and_normalize(vec: List[float], dim: int) -> List[float]:
+    head = list(vec[:dim])
+    norm = math.sqrt(sum(x * x for x in head)) or 1.0
+    return [x / norm for x in head]
+
+
+class Embedder:
+    def __init__(self, model_name: Optional[str] = None, backend: Optional[str] = None,
+                 threads: Optional[int] = None, truncate_dim: Optional[int] = None):
+        self.model_name = model_name or os.environ.get("RAG_EMBED_MODEL", DEFAULT_MODEL)
+        self.backend = (backend or os.environ.get("RAG_EMBED_BACKEND") or "fp32").lower()
+        if self.backend not in BACKENDS:
+            raise ValueError(f"RAG_EMBED_BACKEND must be one of {BACKENDS}, got {self.backend!r}")
+        self.threads = threads if threads is not None else _env_int("RAG_EMBED_THREADS")
+        self.truncate_dim = truncate_dim or None
+
+        if self.threads:
+            import torch
+            torch.set_num_threads(self.threads)
+
+        self.model = SentenceTransformer(self.model_name, device="cpu" if self.backend == "int8" else None)
+        if self.backend == "int8":
+            import torch
+            # Dynamic int8 quantization only touches Linear weights; activations stay fp32.
+            self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    @property
+    def full_dim(self) -> int:
+        return int(self.model.get_sentence_embedding_dimension() or 0)
+
+    @property
+    def dim(self) -> int:
+        full = self.full_dim
+        return min(full, self.truncate_dim) if self.truncate_dim else full
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> List[List[float]]:
+        """Normalized vectors, cut to `truncate_dim` (and renormalized) when set."""
+        vecs = self.model.encode(texts, batch_size=batch_size, normalize_embeddings=True)
+        if self.truncate_dim and self.truncate_dim < self.full_dim:
+            return [truncate_and_normalize(v.tolist(), self.truncate_dim) for v in vecs]
+        return [v.tolist() for v in vecs]
+
+    def encode_query(self, text: str) -> List[float]:
+        return self.encode([text])[0]
+
+    def fit_to_collection(self, vec: List[float], collection_info: Optional[Dict[str, Any]]) -> List[float]:
+        """Truncate `vec` when the collection was built truncated (metadata `embed_dim` equal to its size).
+
+        Any other mismatch is left alone so the caller's dimension check reports it.
+        """
+        info = collection_info or {}
+        size = info.get("vector_size")
+        stored = _as_int((info.get("metadata") or {}).get("embed_dim"))
+        if stored and size and int(size) == stored < len(vec):
+            return truncate_and_normalize(vec, stored)
+        return vec
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "model": self.model_name,
+            "backend": self.backend,
+            "threads": self.threads,
+            "truncate_dim": self.truncate_dim,
+        }
@@ -5,14 +5,23 @@ import os
 import sys
 import json
 import re
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List
 
 from qdrant_client import QdrantClient
-from sentence_transformers import SentenceTransformer
 from google import genai
 
+from collection_catalog import CollectionCatalog
+from context_packer import count_tokens, pack_context
+from embedder import Embedder
+from lexical_index import extract_codes, is_code_query, load_code_table, load_fresh
+from retrieval import two_phase_search
+
 
 DEFAULT_COLLECTION = "rag_ics_enfermedadesmundiales"
+DENSE_TOP_N = 40
+# With BM25 fused in, the dense side no longer needs a wide net to catch exact terms.
+HYBRID_DENSE_TOP_N = 12
+LEXICAL_TOP_N = 20
 
 
 def _json_out(obj: Dict[str, Any]) -> None:
@@ -26,33 +35,6 @@ def _safe_str(e: BaseException) -> str:
         return repr(e)
 
 
-def list_collection_names(qclient: QdrantClient) -> List[str]:
-    try:
-        cols = qclient.get_collections()
-        items = getattr(cols, "collections", None) or []
-        names: List[str] = []
-        for c in items:
-            n = getattr(c, "name", None)
-            if n:
-                names.append(str(n))
-        return sorted(set(names))
-    except Exception:
-        return []
-
-
-def payload_to_text_and_meta(payload: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
-    if not payload:
-        return "", {}
-
-    text = payload.get("page_content") or payload.get("text") or payload.get("content") or ""
-
-    meta = payload.get("metadata") if isinstance(payload.get("metadata"), dict) else None
-    if not meta:
-        meta = {k: v for k, v in payload.items() if k not in ("page_content", "text", "content")}
-
-    return str(text).strip(), (meta or {})
-
-
 def format_context(docs: List[Dict[str, Any]]) -> str:
     blocks: List[str] = []
     for i, d in enumerate(docs, 1):
@@ -144,8 +126,9 @@ def main() -> int:
     search_query = (req.get("search_query") or clinical_text).strip()
 
     k = int(req.get("k") or 8)
-    top_n = int(req.get("top_n") or 40)
+    req_top_n = int(req.get("top_n") or 0)
     out_top = int(req.get("out_top") or 5)
+    context_tokens = int(req.get("context_tokens") or 0) or None
 
     if not clinical_text:
         _json_out({"ok": False, "error": "missing_clinical_text"})
@@ -166,22 +149,14 @@ def main() -> int:
     embed_model = os.environ.get("RAG_EMBED_MODEL", "intfloat/multilingual-e5-base")
     llm_model = os.environ.get("RAG_GEMINI_MODEL", "models/gemini-2.5-flash")
 
-    try:
-        embedder = SentenceTransformer(embed_model)
-        qvec = embedder.encode([search_query], normalize_embeddings=True)[0].tolist()
-    except Exception as e:
-        _json_out({
-            "ok": False,
-            "error": "embedder_failed",
-            "model": embed_model,
-            "detail": _safe_str(e),
-        })
-        return 5
-
     qclient = QdrantClient(url=qdrant_url, api_key=qdrant_api_key, timeout=120)
 
-    available = list_collection_names(qclient)
-    if available and collection not in available:
+    # The catalog is cached on disk, so this is not a get_collections round trip per request.
+    # An alias resolves to its physical collection, which is what gets queried below.
+    catalog = CollectionCatalog(qclient, qdrant_url)
+    collection_info = catalog.lookup(collection)
+    available = catalog.names()
+    if available and collection_info is None:
         _json_out({
             "ok": False,
             "error": "collection_not_found",
@@ -190,37 +165,75 @@ def main() -> int:
             "hint": "Revisa que QDRANT_URL/QDRANT_API_KEY apunten al mismo Qdrant donde cargaste las colecciones.",
         })
         return 3
-
+    physical = (collection_info or {}).get("collection") or collection
+
+    # Local BM25 index over the collection text (RAG_LEXICAL_INDEX=0 disables it). ingest.py/reembed.py
+    # build it; an index from another version or ingest of the collection is ignored.
+    # Queries made only of ICD-11 codes ("6B00") are answered from its code table, with
+    # neither the embedder nor Qdrant.
+    use_lexical = os.environ.get("RAG_LEXICAL_INDEX", "1") != "0" and req.get("hybrid", True) is not False
+    top_docs = None
+    retrieval_metrics: Dict[str, Any] = {}
+    if use_lexical and is_code_query(search_query):
+        codes = load_code_table(collection_info)
+        code_docs = codes.lookup(extract_codes(search_query), max(1, k)) if codes is not None else []
+        if code_docs:
+            top_docs = code_docs
+            retrieval_metrics = {
+                "mode": "lexical_code",
+                "candidates": len(code_docs),
+                "payloads_fetched": 0,
+                "payload_calls": 0,
+                "resolved_collection": physical,
+            }
+    lexical = load_fresh(collection_info) if use_lexical and top_docs is None else None
     try:
-        points = []
-        if hasattr(qclient, "query_points"):
-            qr = qclient.query_points(
-                collection_name=collection,
-                query=qvec,
-                limit=top_n,
-                with_payload=True,
-            )
-            points = getattr(qr, "points", None) or []
-        elif hasattr(qclient, "query"):
-            qr = qclient.query(
-                collection_name=collection,
-                query_vector=qvec,
-                limit=top_n,
-                with_payload=True,
-            )
-            points = getattr(qr, "points", None) or getattr(qr, "result", None) or []
-        elif hasattr(qclient, "search"):
-            points = qclient.search(
-                collection_name=collection,
-                query_vector=qvec,
-                limit=top_n,
-                with_payload=True,
+        if top_docs is None:
+            # A versioned collection records the model that embedded it; the query must use the same one.
+            embed_model = (collection_info or {}).get("embed_model") or embed_model
+
+            try:
+                embedder = Embedder(embed_model)
+                qvec = embedder.encode_query(search_query)
+            except Exception as e:
+                _json_out({
+                    "ok": False,
+                    "error": "embedder_failed",
+                    "model": embed_model,
+                    "detail": _safe_str(e),
+                })
+                return 5
+
+            qvec = embedder.fit_to_collection(qvec, collection_info)
+            dim_error = CollectionCatalog.dimension_error(collection_info, len(qvec))
+            if dim_error:
+                _json_out({
+                    "ok": False,
+                    "error": "embedder_dimension_mismatch",
+                    "collection": collection,
+                    "model": embed_model,
+                    "vector_size": (collection_info or {}).get("vector_size"),
+                    "embedder_dim": len(qvec),
+                    "detail": dim_error,
+                    "hint": "RAG_EMBED_MODEL debe ser el mismo modelo con el que se cargó la colección.",
+                })
+                return 5
+
+            top_n = req_top_n or (HYBRID_DENSE_TOP_N if lexical else DENSE_TOP_N)
+            # Two-phase retrieval: ids/scores for top_n, then payloads only for the final k.
+            top_docs, retrieval_metrics = two_phase_search(
+                qclient, physical, qvec, k=max(1, k), top_n=top_n,
+                reorder=(lambda hits: lexical.fuse(hits, search_query, LEXICAL_TOP_N)) if lexical else None,
             )
-        else:
-            raise RuntimeError("Unsupported qdrant-client: no query_points/query/search method")
+            retrieval_metrics["mode"] = "hybrid_rrf" if lexical else "dense"
+            retrieval_metrics["dense_top_n"] = top_n
+            retrieval_metrics["resolved_collection"] = physical
     except Exception as e:
         msg = _safe_str(e)
         if "doesn't exist" in msg or "does not exist" in msg:
+            # The cached catalog was stale: drop it and report the live listing.
+            catalog.invalidate()
+            available = catalog.names()
             _json_out({
                 "ok": False,
                 "error": "collection_not_found",
@@ -237,19 +250,8 @@ def main() -> int:
         })
         return 4
 
-    candidates: List[Dict[str, Any]] = []
-    for h in points:
-        payload = getattr(h, "payload", None) or {}
-        text, meta = payload_to_text_and_meta(payload)
-        if not text:
-            continue
-        candidates.append({
-            "page_content": text,
-            "metadata": meta,
-            "score": float(getattr(h, "score", 0.0) or 0.0),
-        })
-
-    top_docs = candidates[: max(1, k)]
+    # Dedup overlapping chunks and fit the token budget; [n] numbering follows top_docs.
+    top_docs, token_stats = pack_context(top_docs, context_tokens)
     context = format_context(top_docs)
 
     try:
@@ -286,6 +288,8 @@ CONTEXTO ICD-11:
 {context}
 """
 
+    token_stats["prompt"] = count_tokens(prompt)
+
     try:
         resp = client.models.generate_content(model=model_id, contents=prompt)
         raw_answer = (getattr(resp, "text", "") or "").strip()
@@ -326,6 +330,8 @@ CONTEXTO ICD-11:
             }
             for d in top_docs
         ],
+        "tokens": token_stats,
+        "metrics": {"retrieval": retrieval_metrics},
     })
 
     return 0
@@ -0,0 +1,396 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Bulk, resumable ingestion of PDF/text sources into a Qdrant collection.
+
+Chunks carry the payload shape the retrieval tools expect (page_content +
+metadata.source_pdf/page/category/code). Embeddings use the same e5 model as
+the queries (RAG_EMBED_MODEL) in large batches, and upserts run in parallel
+batches. After every batch a checkpoint in RAG_CACHE_DIR records the content
+hash of each stored point, so an interrupted run resumes where it stopped and
+a re-run only re-embeds chunks whose text (or model) changed.
+
+Vectors are stored in fp32. `--dim N` creates the collection with
+Matryoshka-truncated N-dim vectors instead; the size is recorded in the
+collection metadata, later runs keep it, and the query tools truncate to it.
+
+Uso:
+    python tools/ingest.py <collection> <file|dir> [<file|dir> ...]
+        [--category "Trastornos de ansiedad"] [--chunk-words 220] [--overlap 40]
+        [--embed-batch 256] [--upsert-batch 128] [--workers 4] [--dim N] [--recreate] [--no-lexical-index]
+
+PDFs need `pypdf`; .txt/.md files are split into pages on form feeds.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from qdrant_client import QdrantClient, models
+
+from collection_catalog import (
+    CollectionCatalog, collection_dim, collection_model, default_cache_dir, describe_collection, list_aliases,
+    mark_ingested, resolve_alias, write_json_atomic,
+)
+from embedder import Embedder
+from lexical_index import extract_codes, rebuild_index
+
+
+SOURCE_EXTS = (".pdf", ".txt", ".md")
+CHECKPOINT_VERSION = 1
+
+
+def _json_out(obj: Dict[str, Any]) -> None:
+    print(json.dumps(obj, ensure_ascii=False))
+
+
+def _safe_str(e: BaseException) -> str:
+    try:
+        return str(e)
+    except Exception:
+        return repr(e)
+
+
+def checkpoint_path(collection: str) -> Path:
+    safe = re.sub(r"[^\w.-]+", "_", collection)
+    return default_cache_dir() / f"ingest_{safe}.json"
+
+
+def iter_source_files(paths: List[str]) -> Iterator[Tuple[str, Path]]:
+    """(source key, file): the key is the path relative to the directory given
+    on the command line (just the name for a file given directly), so two
+    files with the same name in different folders stay different sources."""
+    for raw in paths:
+        p = Path(raw)
+        if p.is_dir():
+            for f in sorted(p.rglob("*")):
+                if f.is_file() and f.suffix.lower() in SOURCE_EXTS:
+                    yield f.relative_to(p).as_posix(), f
+        elif p.is_file() and p.suffix.lower() in SOURCE_EXTS:
+            yield p.name, p
+
+
+def extract_pages(path: Path) -> List[Tuple[int, str]]:
+    """(page_number, text) pairs, 1-based."""
+    if path.suffix.lower() == ".pdf":
+        from pypdf import PdfReader
+
+        reader = PdfReader(str(path))
+        return [(i, page.extract_text() or "") for i, page in enumerate(reader.pages, 1)]
+    text = path.read_text(encoding="utf-8", errors="replace")
+    return [(i, page) for i, page in enumerate(text.split("\f"), 1)]
+
+
+def chunk_words(text: str, size: int, overlap: int) -> List[str]:
+    words = re.sub(r"\s+", " ", text or "").strip().split(" ")
+    words = [w for w in words if w]
+    if not words:
+        return []
+    step = max(1, size - max(0, overlap))
+    chunks: List[str] = []
+    for start in range(0, len(words), step):
+        chunks.append(" ".join(words[start: start + size]))
+        if start + size >= len(words):
+            break
+    return chunks
+
+
+def point_id(source: str, page: int, idx: int) -> str:
+    # Stable per position, so a changed chunk overwrites its old point.
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{source}#{page}#{idx}"))
+
+
+def content_hash(model: str, text: str, meta: Dict[str, Any]) -> str:
+    blob = json.dumps([model, text, meta], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(blob.encode("utf-8")).hexdigest()
+
+
+def build_chunks(files: List[Tuple[str, Path]], category: Optional[str], size: int, overlap: int,
+                 model: str) -> Iterator[Dict[str, Any]]:
+    for source, f in files:
+        try:
+            pages = extract_pages(f)
+        except Exception as e:
+            print(f"skip {f}: {_safe_str(e)}", file=sys.stderr)
+            continue
+        for page, text in pages:
+            for idx, chunk in enumerate(chunk_words(text, size, overlap)):
+                codes = extract_codes(chunk)
+                meta = {
+                    "source_pdf": f.name,
+                    "page": page,
+                    "category": category or f.parent.name,
+                    "code": codes[0] if codes else None,
+                    "chunk": idx,
+                }
+                yield {
+                    "id": point_id(source, page, idx),
+                    "source": source,
+                    "text": chunk,
+                    "meta": meta,
+                    "hash": content_hash(model, chunk, meta),
+                }
+
+
+class Checkpoint:
+    """{point_id: content_hash} for the points already stored in the collection."""
+
+    def __init__(self, collection: str, model: str):
+        self.path = checkpoint_path(collection)
+        self.collection = collection
+        self.model = model
+        self.points: Dict[str, str] = {}
+        self.sources: Dict[str, List[str]] = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == CHECKPOINT_VERSION and data.get("collection") == collection:
+                self.points = data.get("points") or {}
+                self.sources = data.get("sources") or {}
+        except Exception:
+            pass
+
+    def save(self) -> None:
+        write_json_atomic(self.path, {
+            "version": CHECKPOINT_VERSION,
+            "collection": self.collection,
+            "model": self.model,
+            "updated_at": time.time(),
+            "points": self.points,
+            "sources": self.sources,
+        })
+
+    def reset(self) -> None:
+        self.points, self.sources = {}, {}
+        try:
+            self.path.unlink()
+        except Exception:
+            pass
+
+
+def ensure_collection(qclient: QdrantClient, collection: str, dim: int, recreate: bool, model: str,
+                      truncated: bool = False) -> Optional[str]:
+    if recreate and qclient.collection_exists(collection):
+        qclient.delete_collection(collection)
+    if not qclient.collection_exists(collection):
+        metadata: Dict[str, Any] = {"embed_model": model}
+        if truncated:
+            metadata["embed_dim"] = dim
+        qclient.create_collection(
+            collection_name=collection,
+            vectors_config=models.VectorParams(size=dim, distance=models.Distance.COSINE),
+            metadata=metadata,
+        )
+        return None
+    return CollectionCatalog.dimension_error(describe_collection(qclient, collection), dim)
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("collection")
+    ap.add_argument("paths", nargs="+")
+    ap.add_argument("--category", default=None, help="metadata.category (default: parent folder name)")
+    ap.add_argument("--chunk-words", type=int, default=220)
+    ap.add_argument("--overlap", type=int, default=40)
+    ap.add_argument("--embed-batch", type=int, default=256)
+    ap.add_argument("--upsert-batch", type=int, default=128)
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--dim", type=int, default=0,
+                    help="Matryoshka-truncated vector size for a new (or --recreate'd) collection")
+    ap.add_argument("--recreate", action="store_true", help="drop the collection and its checkpoint first")
+    ap.add_argument("--no-lexical-index", action="store_true",
+                    help="skip rebuilding the BM25 index icd11_score.py uses (tools/lexical_index.py builds it later)")
+    args = ap.parse_args()
+
+    qdrant_url = os.environ.get("QDRANT_URL")
+    qdrant_api_key = os.environ.get("QDRANT_API_KEY")
+    if not qdrant_url or not qdrant_api_key:
+        _json_out({"ok": False, "error": "missing_qdrant_env"})
+        return 2
+
+    files = list(iter_source_files(args.paths))
+    if not files:
+        _json_out({"ok": False, "error": "no_sources", "paths": args.paths, "hint": f"Extensiones admitidas: {', '.join(SOURCE_EXTS)}"})
+        return 2
+    by_key: Dict[str, List[str]] = {}
+    for key, f in files:
+        by_key.setdefault(key, []).append(str(f))
+    dupes = {k: v for k, v in by_key.items() if len(v) > 1}
+    if dupes:
+        _json_out({
+            "ok": False,
+            "error": "duplicate_sources",
+            "sources": dupes,
+            "hint": "Pasa la carpeta que los contiene en lugar de los archivos sueltos.",
+        })
+        return 2
+
+    qclient = QdrantClient(url=qdrant_url, api_key=qdrant_api_key, timeout=120)
+    # An alias (see tools/reembed.py) is written through to its live version, with that version's model.
+    target = resolve_alias(list_aliases(qclient), args.collection) or args.collection
+    try:
+        entry = describe_collection(qclient, target) if qclient.collection_exists(target) else None
+    except Exception as e:
+        _json_out({"ok": False, "error": "qdrant_collection_failed", "collection": args.collection, "detail": _safe_str(e)})
+        return 4
+    embed_model = collection_model(entry, target) if entry is not None else None
+    embed_model = embed_model or os.environ.get("RAG_EMBED_MODEL", "intfloat/multilingual-e5-base")
+    # An existing collection keeps the size it was built with.
+    dim = args.dim or (collection_dim(entry) if not args.recreate else 0)
+    try:
+        # Stored vectors are always fp32; RAG_EMBED_BACKEND only affects queries.
+        embedder = Embedder(embed_model, backend="fp32", truncate_dim=dim)
+    except Exception as e:
+        _json_out({"ok": False, "error": "embedder_failed", "model": embed_model, "detail": _safe_str(e)})
+        return 5
+
+    ckpt = Checkpoint(target, embed_model)
+    if args.recreate:
+        ckpt.reset()
+    try:
+        dim_error = ensure_collection(qclient, target, embedder.dim, args.recreate, embed_model,
+                                      truncated=embedder.dim < embedder.full_dim)
+    except Exception as e:
+        _json_out({"ok": False, "error": "qdrant_collection_failed", "collection": args.collection, "detail": _safe_str(e)})
+        return 4
+    if dim_error:
+        _json_out({
+            "ok": False,
+            "error": "embedder_dimension_mismatch",
+            "collection": args.collection,
+            "model": embed_model,
+            "detail": dim_error,
+            "hint": "Usa --recreate o el mismo RAG_EMBED_MODEL y --dim con los que se cargó la colección.",
+        })
+        return 5
+
+    stats = {"chunks": 0, "unchanged": 0, "upserted": 0, "deleted": 0, "embed_s": 0.0}
+    seen_by_source: Dict[str, Set[str]] = {}
+    pending: List[Dict[str, Any]] = []
+    inflight: Dict[Future, List[Dict[str, Any]]] = {}
+    t_start = time.perf_counter()
+
+    def _upsert(batch: List[Dict[str, Any]], vectors: List[List[float]]) -> None:
+        qclient.upsert(
+            collection_name=target,
+            points=[
+                models.PointStruct(id=c["id"], vector=v, payload={
+                    "page_content": c["text"],
+                    "metadata": c["meta"],
+                    "content_hash": c["hash"],
+                })
+                for c, v in zip(batch, vectors)
+            ],
+            wait=True,
+        )
+
+    def _drain(block_all: bool) -> None:
+        # Record finished batches in the checkpoint; a crash loses at most the in-flight ones.
+        while inflight:
+            done, _ = wait(list(inflight), return_when=FIRST_COMPLETED)
+            for fut in done:
+                batch = inflight.pop(fut)
+                fut.result()
+                for c in batch:
+                    ckpt.points[c["id"]] = c["hash"]
+                stats["upserted"] += len(batch)
+            ckpt.save()
+            if not block_all and len(inflight) < args.workers:
+                return
+
+    def _flush(pool: ThreadPoolExecutor) -> None:
+        if not pending:
+            return
+        t0 = time.perf_counter()
+        vectors = embedder.encode([c["text"] for c in pending], batch_size=min(64, args.embed_batch))
+        stats["embed_s"] += time.perf_counter() - t0
+        for start in range(0, len(pending), args.upsert_batch):
+            sub = pending[start: start + args.upsert_batch]
+            inflight[pool.submit(_upsert, sub, vectors[start: start + args.upsert_batch])] = sub
+            # Keep at most `workers` batches in flight while the next embed batch is computed.
+            if len(inflight) >= args.workers:
+                _drain(block_all=False)
+        print(f"embedded {len(pending)} chunks ({stats['upserted']} upserted so far)", file=sys.stderr)
+        pending.clear()
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+            for chunk in build_chunks(files, args.category, args.chunk_words, args.overlap, embed_model):
+                stats["chunks"] += 1
+                seen_by_source.setdefault(chunk["source"], set()).add(chunk["id"])
+                if ckpt.points.get(chunk["id"]) == chunk["hash"]:
+                    stats["unchanged"] += 1
+                    continue
+                pending.append(chunk)
+                if len(pending) >= args.embed_batch:
+                    _flush(pool)
+            _flush(pool)
+            _drain(block_all=True)
+
+        # Points left over from a source whose new version has fewer chunks.
+        stale: List[str] = []
+        for source, ids in seen_by_source.items():
+            stale.extend(pid for pid in ckpt.sources.get(source, []) if pid not in ids)
+            ckpt.sources[source] = sorted(ids)
+        # Checkpoints from before sources were keyed by relative path used the bare file
+        # name; a nested file ingested again under its path replaces those points.
+        for source in [s for s in seen_by_source if "/" in s]:
+            old_key = source.rsplit("/", 1)[1]
+            if old_key not in seen_by_source and old_key in ckpt.sources:
+                stale.extend(ckpt.sources.pop(old_key))
+        if stale:
+            qclient.delete(collection_name=target, points_selector=models.PointIdsList(points=stale), wait=True)
+            for pid in stale:
+                ckpt.points.pop(pid, None)
+            stats["deleted"] = len(stale)
+        ckpt.save()
+    except Exception as e:
+        ckpt.save()
+        _json_out({
+            "ok": False,
+            "error": "ingest_failed",
+            "collection": args.collection,
+            "detail": _safe_str(e),
+            "upserted": stats["upserted"],
+            "hint": "Vuelve a ejecutar el mismo comando: se retoma desde el último lote guardado.",
+        })
+        return 4
+
+    # The tools cache the catalog and the BM25 index; make them see the new points.
+    # The stamp also tells other hosts' indexes that the content changed.
+    mark_ingested(qclient, target)
+    CollectionCatalog(qclient, qdrant_url).invalidate()
+    t_index = time.perf_counter()
+    lexical = rebuild_index(qclient, target) if not args.no_lexical_index else None
+    index_s = time.perf_counter() - t_index
+
+    _json_out({
+        "ok": True,
+        "collection": args.collection,
+        "resolved_collection": target,
+        "model": embed_model,
+        "dim": embedder.dim,
+        "files": len(files),
+        "chunks": stats["chunks"],
+        "unchanged": stats["unchanged"],
+        "upserted": stats["upserted"],
+        "deleted": stats["deleted"],
+        "embed_s": round(stats["embed_s"], 2),
+        "lexical_index_docs": len(lexical.docs) if lexical else None,
+        "lexical_index_s": round(index_s, 2),
+        "total_s": round(time.perf_counter() - t_start, 2),
+        "checkpoint": str(ckpt.path),
+    })
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Local BM25 index over a Qdrant collection's text (ICD-11 lookups).
+
+The index holds point ids, lengths, codes and term postings only; payloads
+for its hits come from Qdrant (retrieval.fetch_payloads). Next to it, a code
+table keeps the text and metadata of every point that has an ICD-11 code, so
+code-exact queries ("6B00") are answered without the embedder and without
+Qdrant. Other queries fuse the BM25 ranking with the dense results through
+reciprocal-rank fusion.
+
+Both files are keyed on the physical collection and stamped with the
+collection's `ingested_at` metadata and point count at build time. The query
+path only uses files whose stamp matches the catalog entry and never builds
+them: ingest.py and reembed.py rebuild them after writing points. Once loaded
+they stay in memory for the life of the process, as long as the stamp holds.
+
+Build or refresh by hand:
+    python tools/lexical_index.py rag_ics_enfermedadesmundiales
+"""
+
+import json
+import math
+import os
+import re
+import sys
+import time
+import unicodedata
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from collection_catalog import default_cache_dir, describe_collection, write_json_atomic
+from retrieval import Hit, payload_to_text_and_meta
+
+
+INDEX_VERSION = 3
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60
+# Code and category tokens count more than body text.
+CODE_WEIGHT = 3
+CATEGORY_WEIGHT = 2
+
+_TOKEN_RE = re.compile(r"[0-9a-z]+(?:\.[0-9a-z]+)?")
+# ICD-11 stem codes: 4 chars, 2nd is a letter, at least one digit, optional .extension (6B00, 8A00.1, 6D10.Z).
+_CODE_RE = re.compile(r"\b([0-9A-HJ-NP-Z][A-HJ-NP-Z][0-9A-HJ-NP-Z]{2}(?:\.[0-9A-HJ-NP-Z]{1,2})?)\b", re.IGNORECASE)
+_STOPWORDS = {
+    "de", "la", "el", "los", "las", "y", "o", "en", "un", "una", "que", "con", "por", "para",
+    "del", "al", "se", "su", "sus", "es", "a", "lo", "como", "the", "of", "and", "or", "in", "to",
+}
+
+
+def _fold(text: str) -> str:
+    text = unicodedata.normalize("NFD", (text or "").lower())
+    return "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+
+
+def tokenize(text: str) -> List[str]:
+    out: List[str] = []
+    for tok in _TOKEN_RE.findall(_fold(text)):
+        if tok in _STOPWORDS:
+            continue
+        out.append(tok)
+        if "." in tok:
+            # "6a70.0" also matches a query for its stem "6a70".
+            out.append(tok.split(".", 1)[0])
+    return out
+
+
+def extract_codes(text: str) -> List[str]:
+    return [c.upper() for c in _CODE_RE.findall(text or "") if any(ch.isdigit() for ch in c)]
+
+
+def is_code_query(text: str) -> bool:
+    """True when the query is only ICD-11 codes (plus separators)."""
+    codes = extract_codes(text)
+    if not codes:
+        return False
+    rest = _CODE_RE.sub(" ", text or "")
+    return not re.search(r"\w", rest)
+
+
+def _doc_codes(meta: Dict[str, Any]) -> List[str]:
+    codes = []
+    for key in ("code", "icd11_code"):
+        v = meta.get(key)
+        if v:
+            codes.append(str(v).strip().upper())
+    return codes
+
+
+def index_path(collection: str) -> Path:
+    safe = re.sub(r"[^\w.-]+", "_", collection)
+    return default_cache_dir() / f"lexical_{safe}.json"
+
+
+def code_table_path(collection: str) -> Path:
+    safe = re.sub(r"[^\w.-]+", "_", collection)
+    return default_cache_dir() / f"lexical_{safe}.codes.json"
+
+
+def source_stamp(info: Dict[str, Any]) -> Dict[str, Any]:
+    """What the index must have been built from: physical collection, ingest stamp and point count."""
+    return {
+        "collection": info.get("collection"),
+        "ingested_at": (info.get("metadata") or {}).get("ingested_at"),
+        "points_count": info.get("points_count"),
+    }
+
+
+class LexicalIndex:
+    def __init__(self, data: Dict[str, Any]):
+        self.source: Dict[str, Any] = data.get("source") or {}
+        self.built_at = float(data.get("built_at") or 0.0)
+        self.docs: List[Dict[str, Any]] = data.get("docs") or []
+        self.postings: Dict[str, List[List[int]]] = data.get("postings") or {}
+        self.avgdl = float(data.get("avgdl") or 1.0)
+
+    # --- persistence -------------------------------------------------
+
+    @classmethod
+    def load(cls, collection: str) -> Optional["LexicalIndex"]:
+        try:
+            with open(index_path(collection), "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception:
+            return None
+        if data.get("version") != INDEX_VERSION:
+            return None
+        return cls(data)
+
+    @classmethod
+    def build(cls, qclient: Any, collection: str, batch_size: int = 256) -> "LexicalIndex":
+        """Scrolls the physical `collection` once; run from ingest/reembed or by hand, not per request."""
+        source = source_stamp(dict(describe_collection(qclient, collection), collection=collection))
+        docs: List[Dict[str, Any]] = []
+        coded: List[Dict[str, Any]] = []
+        postings: Dict[str, List[List[int]]] = defaultdict(list)
+        total_len = 0
+        offset = None
+        while True:
+            records, offset = qclient.scroll(
+                collection_name=collection,
+                limit=batch_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=False,
+            )
+            for r in records:
+                text, meta = payload_to_text_and_meta(getattr(r, "payload", None) or {})
+                if not text:
+                    continue
+                codes = _doc_codes(meta)
+                category = str(meta.get("category") or meta.get("area") or "")
+                tokens = tokenize(text)
+                tokens += tokenize(" ".join(codes)) * CODE_WEIGHT
+                tokens += tokenize(category) * CATEGORY_WEIGHT
+                idx = len(docs)
+                docs.append({"id": getattr(r, "id", None), "len": len(tokens), "codes": codes})
+                if codes:
+                    coded.append({"id": getattr(r, "id", None), "codes": codes, "page_content": text, "metadata": meta})
+                total_len += len(tokens)
+                for term, tf in Counter(tokens).items():
+                    postings[term].append([idx, tf])
+            if offset is None:
+                break
+
+        built_at = time.time()
+        data = {
+            "version": INDEX_VERSION,
+            "source": source,
+            "built_at": built_at,
+            "avgdl": (total_len / len(docs)) if docs else 1.0,
+            "docs": docs,
+            "postings": dict(postings),
+        }
+        table = {"version": INDEX_VERSION, "source": source, "built_at": built_at, "docs": coded}
+        write_json_atomic(code_table_path(collection), table)
+        write_json_atomic(index_path(collection), data)
+        index = cls(data)
+        _loaded[index_path(collection)] = index
+        _loaded[code_table_path(collection)] = CodeTable(table)
+        return index
+
+    # --- querying ----------------------------------------------------
+
+    def search(self, query: str, limit: int = 20) -> List[Hit]:
+        n = len(self.docs)
+        if not n:
+            return []
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            plist = self.postings.get(term)
+            if not plist:
+                continue
+            idf = math.log(1.0 + (n - len(plist) + 0.5) / (len(plist) + 0.5))
+            for idx, tf in plist:
+                dl = self.docs[idx]["len"] or 1
+                denom = tf + BM25_K1 * (1.0 - BM25_B + BM25_B * dl / self.avgdl)
+                scores[idx] += idf * tf * (BM25_K1 + 1.0) / denom
+        ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:limit]
+        return [(self.docs[i]["id"], s) for i, s in ranked]
+
+    def fuse(self, dense: List[Hit], query: str, lexical_limit: int = 20) -> List[Hit]:
+        """Reciprocal-rank fusion of dense hits and BM25 hits for `query`."""
+        fused: Dict[Any, float] = defaultdict(float)
+        for rank, (pid, _) in enumerate(dense, 1):
+            fused[pid] += 1.0 / (RRF_K + rank)
+        for rank, (pid, _) in enumerate(self.search(query, lexical_limit), 1):
+            fused[pid] += 1.0 / (RRF_K + rank)
+        return sorted(fused.items(), key=lambda x: x[1], reverse=True)
+
+
+class CodeTable:
+    """Text and metadata of the points that carry an ICD-11 code."""
+
+    def __init__(self, data: Dict[str, Any]):
+        self.source: Dict[str, Any] = data.get("source") or {}
+        self.docs: List[Dict[str, Any]] = data.get("docs") or []
+
+    @classmethod
+    def load(cls, collection: str) -> Optional["CodeTable"]:
+        try:
+            with open(code_table_path(collection), "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception:
+            return None
+        if data.get("version") != INDEX_VERSION:
+            return None
+        return cls(data)
+
+    def lookup(self, codes: List[str], limit: int) -> List[Dict[str, Any]]:
+        """Docs whose code equals one of `codes` (exact first, then sub-codes like 6B00.1), shaped like fetch_docs()."""
+        wanted = [c.upper() for c in codes]
+        exact: List[Dict[str, Any]] = []
+        children: List[Dict[str, Any]] = []
+        for d in self.docs:
+            dcodes = d.get("codes") or []
+            if any(c in wanted for c in dcodes):
+                exact.append(d)
+            elif any(c.startswith(w + ".") for c in dcodes for w in wanted):
+                children.append(d)
+        return [
+            {"id": d["id"], "page_content": d["page_content"], "metadata": d.get("metadata") or {}, "score": 1.0}
+            for d in (exact + children)[: max(1, limit)]
+        ]
+
+
+# Loaded index and code table per file; reused while their stamp matches the catalog entry.
+_loaded: Dict[Path, Any] = {}
+
+
+def _load_stamped(info: Optional[Dict[str, Any]], path_for: Callable[[str], Path], load: Callable[[str], Any],
+                  what: str) -> Any:
+    if not info or not info.get("collection"):
+        return None
+    path = path_for(info["collection"])
+    stamp = source_stamp(info)
+    obj = _loaded.get(path)
+    if obj is not None and obj.source == stamp:
+        return obj
+    obj = load(info["collection"])
+    if obj is None:
+        return None
+    if obj.source != stamp:
+        print(f"{what} for {info['collection']} is stale; rebuild it with tools/lexical_index.py", file=sys.stderr)
+        return None
+    _loaded[path] = obj
+    return obj
+
+
+def load_fresh(info: Optional[Dict[str, Any]]) -> Optional[LexicalIndex]:
+    """Index for the catalog entry `info` (see CollectionCatalog.lookup), or None.
+
+    None also when the stored index was built from another collection
+    version, ingest or point count: stale ids would fuse wrong documents in.
+    """
+    return _load_stamped(info, index_path, LexicalIndex.load, "lexical index")
+
+
+def load_code_table(info: Optional[Dict[str, Any]]) -> Optional[CodeTable]:
+    """Code table for the catalog entry `info`, or None (missing or stale, as load_fresh)."""
+    return _load_stamped(info, code_table_path, CodeTable.load, "code table")
+
+
+def rebuild_index(qclient: Any, collection: str) -> Optional[LexicalIndex]:
+    """Rebuilds the index after a write; a failure only disables BM25 for the collection."""
+    try:
+        return LexicalIndex.build(qclient, collection)
+    except Exception as e:
+        print(f"lexical index build failed for {collection}: {e}", file=sys.stderr)
+        for path in (index_path(collection), code_table_path(collection)):
+            _loaded.pop(path, None)
+            try:
+                path.unlink()
+            except Exception:
+                pass
+        return None
+
+
+if __name__ == "__main__":
+    from qdrant_client import QdrantClient
+
+    from collection_catalog import CollectionCatalog
+
+    if len(sys.argv) < 2:
+        print("Uso: python tools/lexical_index.py <collection>")
+        sys.exit(2)
+    name = sys.argv[1]
+    url = os.environ.get("QDRANT_URL")
+    client = QdrantClient(url=url, api_key=os.environ.get("QDRANT_API_KEY"), timeout=120)
+    # An alias is indexed under the physical collection it points to, which is what the tools query.
+    physical = (CollectionCatalog(client, url or "").lookup(name) or {}).get("collection") or name
+    t0 = time.perf_counter()
+    idx = LexicalIndex.build(client, physical)
+    print(json.dumps({
+        "ok": True,
+        "collection": name,
+        "resolved_collection": physical,
+        "docs": len(idx.docs),
+        "terms": len(idx.postings),
+        "path": str(index_path(physical)),
+        "code_table": str(code_table_path(physical)),
+        "build_s": round(time.perf_counter() - t0, 2),
+    }, ensure_ascii=False))
@@ -4,17 +4,27 @@
 import os
 import sys
 import json
-from typing import Any, Dict, List, Tuple
+import time
+from typing import Any, Dict, List
 
 from qdrant_client import QdrantClient
-from sentence_transformers import SentenceTransformer
 from google import genai
 
+from collection_catalog import CollectionCatalog
+from context_packer import count_tokens, pack_context
+from embedder import Embedder
+from retrieval import federated_search, two_phase_search
+
 
 def _json_out(obj: Dict[str, Any]) -> None:
     print(json.dumps(obj, ensure_ascii=False))
 
 
+def _event_out(event: str, obj: Dict[str, Any]) -> None:
+    # NDJSON for stream mode: one event per line, flushed so server.js can relay it immediately.
+    print(json.dumps(dict(obj, event=event), ensure_ascii=False), flush=True)
+
+
 def _safe_str(e: BaseException) -> str:
     try:
         return str(e)
@@ -22,32 +32,18 @@ def _safe_str(e: BaseException) -> str:
         return repr(e)
 
 
-def list_collection_names(qclient: QdrantClient) -> List[str]:
-    try:
-        cols = qclient.get_collections()
-        # qdrant-client returns an object with .collections (list of CollectionDescription)
-        items = getattr(cols, "collections", None) or []
-        names: List[str] = []
-        for c in items:
-            n = getattr(c, "name", None)
-            if n:
-                names.append(str(n))
-        return sorted(set(names))
-    except Exception:
-        return []
-
-
-def payload_to_text_and_meta(payload: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
-    if not payload:
-        return "", {}
-
-    text = payload.get("page_content") or payload.get("text") or payload.get("content") or ""
-
-    meta = payload.get("metadata") if isinstance(payload.get("metadata"), dict) else None
-    if not meta:
-        meta = {k: v for k, v in payload.items() if k not in ("page_content", "text", "content")}
-
-    return str(text).strip(), (meta or {})
+def _gemini_error(e: BaseException, llm_model: str) -> Dict[str, Any]:
+    msg = _safe_str(e)
+    err_name = "gemini_failed"
+    if "API key" in msg or "api key" in msg or "key not valid" in msg or "invalid api key" in msg.lower():
+        err_name = "invalid_gemini_api_key"
+    return {
+        "ok": False,
+        "error": err_name,
+        "model": llm_model,
+        "detail": msg,
+        "hint": "Tu GEMINI_API_KEY parece inválida o no autorizada. Genera una nueva en Google AI Studio, actualiza .env y reinicia el servidor.",
+    }
 
 
 def format_context(docs: List[Dict[str, Any]]) -> str:
@@ -69,12 +65,22 @@ def main() -> int:
         _json_out({"ok": False, "error": "bad_json_in", "detail": _safe_str(e)})
         return 2
 
-    collection = (req.get("collection") or "").strip()
+    # `collections` (list) searches several collections at once; `collection` may also be a list.
+    raw_collections = req.get("collections")
+    if raw_collections is None:
+        raw_collections = req.get("collection")
+    if not isinstance(raw_collections, list):
+        raw_collections = [raw_collections]
+    collections = list(dict.fromkeys(str(c).strip() for c in raw_collections if c and str(c).strip()))
+    collection = collections[0] if collections else ""
     query = (req.get("query") or "").strip()
     k = int(req.get("k") or 6)
     top_n = int(req.get("top_n") or 25)
+    context_tokens = int(req.get("context_tokens") or 0) or None
+    # Stream mode writes NDJSON events (sources, delta..., done); the single JSON object stays the default.
+    stream = bool(req.get("stream")) or "--stream" in sys.argv[1:]
 
-    if not collection or not query:
+    if not collections or not query:
         _json_out({"ok": False, "error": "missing_collection_or_query"})
         return 2
 
@@ -93,69 +99,87 @@ def main() -> int:
     embed_model = os.environ.get("RAG_EMBED_MODEL", "intfloat/multilingual-e5-base")
     llm_model = os.environ.get("RAG_GEMINI_MODEL", "models/gemini-2.5-flash")
 
-    try:
-        embedder = SentenceTransformer(embed_model)
-        qvec = embedder.encode([query], normalize_embeddings=True)[0].tolist()
-    except Exception as e:
-        _json_out({
-            "ok": False,
-            "error": "embedder_failed",
-            "model": embed_model,
-            "detail": _safe_str(e),
-        })
-        return 5
-
     qclient = QdrantClient(url=qdrant_url, api_key=qdrant_api_key, timeout=120)
 
     # Validate collection exists to avoid opaque 500s like: "Collection `...` doesn't exist!"
-    available = list_collection_names(qclient)
-    if available and collection not in available:
-        _json_out({
-            "ok": False,
-            "error": "collection_not_found",
-            "collection": collection,
-            "available_collections": available,
-            "hint": "Revisa que QDRANT_URL/QDRANT_API_KEY apunten al mismo Qdrant donde cargaste los PDFs."
-        })
-        return 3
-
-    # qdrant-client API differs by version. Your environment exposes query_points/query.
-    # Support both older/newer clients.
+    # The catalog is cached on disk, so this is not a get_collections round trip per request.
+    # Aliases resolve to their physical collection, which is what gets queried below.
+    catalog = CollectionCatalog(qclient, qdrant_url)
+    infos: Dict[str, Dict[str, Any]] = {}
+    for name in collections:
+        collection_info = catalog.lookup(name)
+        available = catalog.names()
+        if available and collection_info is None:
+            _json_out({
+                "ok": False,
+                "error": "collection_not_found",
+                "collection": name,
+                "available_collections": available,
+                "hint": "Revisa que QDRANT_URL/QDRANT_API_KEY apunten al mismo Qdrant donde cargaste los PDFs."
+            })
+            return 3
+        infos[name] = collection_info or {}
+    physical = {name: infos[name].get("collection") or name for name in collections}
+
+    # A versioned collection names the model that embedded it; the query must use the same one.
+    embedders: Dict[str, Embedder] = {}
+    qvecs_by_model: Dict[str, List[float]] = {}
+    qvecs: Dict[str, List[float]] = {}
+    for name in collections:
+        model = infos[name].get("embed_model") or embed_model
+        if model not in embedders:
+            try:
+                embedders[model] = Embedder(model)
+                qvecs_by_model[model] = embedders[model].encode_query(query)
+            except Exception as e:
+                _json_out({
+                    "ok": False,
+                    "error": "embedder_failed",
+                    "model": model,
+                    "detail": _safe_str(e),
+                })
+                return 5
+
+        qvec = embedders[model].fit_to_collection(qvecs_by_model[model], infos[name])
+        dim_error = CollectionCatalog.dimension_error(infos[name], len(qvec))
+        if dim_error:
+            _json_out({
+                "ok": False,
+                "error": "embedder_dimension_mismatch",
+                "collection": name,
+                "model": model,
+                "vector_size": infos[name].get("vector_size"),
+                "embedder_dim": len(qvec),
+                "detail": dim_error,
+                "hint": "RAG_EMBED_MODEL debe ser el mismo modelo con el que se cargó la colección.",
+            })
+            return 5
+        qvecs[physical[name]] = qvec
+
+    # Two-phase retrieval: ids/scores for top_n, then payloads only for the final k.
+    # Several collections are searched concurrently and merged on per-collection normalized scores.
+    # An alias and its target (or `x` and `x__live`) are one physical collection: search it once
+    # and report it under the first name that requested it.
+    requested: Dict[str, str] = {}
+    for name in collections:
+        requested.setdefault(physical[name], name)
     try:
-        points = []
-        if hasattr(qclient, "query_points"):
-            # Newer API: returns QueryResponse with .points
-            qr = qclient.query_points(
-                collection_name=collection,
-                query=qvec,
-                limit=top_n,
-                with_payload=True,
-            )
-            points = getattr(qr, "points", None) or []
-        elif hasattr(qclient, "query"):
-            # Some versions offer .query(...)
-            qr = qclient.query(
-                collection_name=collection,
-                query_vector=qvec,
-                limit=top_n,
-                with_payload=True,
-            )
-            points = getattr(qr, "points", None) or getattr(qr, "result", None) or []
-        elif hasattr(qclient, "search"):
-            # Older API
-            points = qclient.search(
-                collection_name=collection,
-                query_vector=qvec,
-                limit=top_n,
-                with_payload=True,
-            )
+        if len(requested) > 1:
+            top_docs, retrieval_metrics = federated_search(
+                qclient, list(requested), qvecs, k=k, top_n=top_n)
+            for d in top_docs:
+                d["collection"] = requested.get(d.get("collection"), d.get("collection"))
         else:
-            raise RuntimeError("Unsupported qdrant-client: no query_points/query/search method")
+            top_docs, retrieval_metrics = two_phase_search(
+                qclient, physical[collection], qvecs[physical[collection]], k=k, top_n=top_n)
+        retrieval_metrics["resolved_collections"] = physical
     except Exception as e:
         msg = _safe_str(e)
-        # If Qdrant says the collection doesn't exist but list_collections failed,
-        # return a clear error anyway.
+        # If Qdrant says the collection doesn't exist the cached catalog was stale:
+        # drop it and report the live listing.
         if "doesn't exist" in msg or "does not exist" in msg:
+            catalog.invalidate()
+            available = catalog.names()
             _json_out({
                 "ok": False,
                 "error": "collection_not_found",
@@ -172,19 +196,8 @@ def main() -> int:
         })
         return 4
 
-    candidates: List[Dict[str, Any]] = []
-    for h in points:
-        payload = getattr(h, "payload", None) or {}
-        text, meta = payload_to_text_and_meta(payload)
-        if not text:
-            continue
-        candidates.append({
-            "page_content": text,
-            "metadata": meta,
-            "score": float(getattr(h, "score", 0.0) or 0.0),
-        })
-
-    top_docs = candidates[:k]
+    # Dedup overlapping chunks and fit the token budget; [n] numbering follows top_docs.
+    top_docs, token_stats = pack_context(top_docs, context_tokens)
     context = format_context(top_docs)
 
     try:
@@ -216,39 +229,63 @@ CONTEXTO:
 RESPUESTA:
 """
 
-    try:
-        resp = client.models.generate_content(model=model_id, contents=prompt)
-        answer = (getattr(resp, "text", "") or "").strip()
-    except Exception as e:
-        msg = _safe_str(e)
-        err_name = "gemini_failed"
-        if "API key" in msg or "api key" in msg or "key not valid" in msg or "invalid api key" in msg.lower():
-            err_name = "invalid_gemini_api_key"
-
-        _json_out({
-            "ok": False,
-            "error": err_name,
-            "model": llm_model,
-            "detail": msg,
-            "hint": "Tu GEMINI_API_KEY parece inválida o no autorizada. Genera una nueva en Google AI Studio, actualiza .env y reinicia el servidor.",
-        })
-        return 7
+    token_stats["prompt"] = count_tokens(prompt)
 
-    _json_out({
+    result: Dict[str, Any] = {
         "ok": True,
         "collection": collection,
+        "collections": collections,
         "k": k,
-        "answer": answer,
+        "answer": "",
         "contexts": [d.get("page_content", "") for d in top_docs],
         "sources": [
             {
                 "source_pdf": (d.get("metadata") or {}).get("source_pdf"),
                 "page": (d.get("metadata") or {}).get("page"),
                 "category": (d.get("metadata") or {}).get("category"),
+                "collection": d.get("collection") or collection,
+                "score": d.get("score"),
             }
             for d in top_docs
         ],
-    })
+        "tokens": token_stats,
+        "metrics": {"retrieval": retrieval_metrics},
+    }
+
+    if stream:
+        _event_out("sources", {key: v for key, v in result.items() if key != "answer"})
+        t0 = time.perf_counter()
+        ttft_ms = None
+        parts: List[str] = []
+        try:
+            for chunk in client.models.generate_content_stream(model=model_id, contents=prompt):
+                text = getattr(chunk, "text", "") or ""
+                if not text:
+                    continue
+                if ttft_ms is None:
+                    ttft_ms = round((time.perf_counter() - t0) * 1000.0, 1)
+                parts.append(text)
+                _event_out("delta", {"text": text})
+        except Exception as e:
+            _event_out("error", _gemini_error(e, llm_model))
+            return 7
+        result["answer"] = "".join(parts).strip()
+        result["metrics"]["llm"] = {
+            "ttft_ms": ttft_ms,
+            "total_ms": round((time.perf_counter() - t0) * 1000.0, 1),
+        }
+        _event_out("done", result)
+        return 0
+
+    try:
+        resp = client.models.generate_content(model=model_id, contents=prompt)
+        answer = (getattr(resp, "text", "") or "").strip()
+    except Exception as e:
+        _json_out(_gemini_error(e, llm_model))
+        return 7
+
+    result["answer"] = answer
+    _json_out(result)
 
     return 0
 
@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Re-embed a collection with another model and swap its alias when done.
+
+The new vectors are computed from the `page_content` already stored in the
+live collection, so no source PDFs are needed. They go into a new physical
+collection `<name>__<model>` that keeps the same point ids and payloads;
+its BM25 index (lexical_index.py) is built before the swap. The service keeps
+answering from the old version the whole time. When every point is copied,
+the `<name>` alias is switched to the new version in a single
+update_collection_aliases call. The model is recorded in the new collection's
+metadata and the tools read it from there, so no RAG_EMBED_MODEL change is
+needed at swap time.
+
+Progress is checkpointed in RAG_CACHE_DIR, so an interrupted run continues
+from the last finished page. Run it in the background:
+
+    nohup python tools/reembed.py <name> --model intfloat/multilingual-e5-large &
+
+`--dim N` stores Matryoshka-truncated N-dim vectors in `<name>__<model>-d<N>`
+(the size is recorded in its metadata, as ingest.py --dim does).
+
+The previous version is kept. Once every host's catalog has expired
+(RAG_CATALOG_TTL after the swap), remove it with a separate run:
+
+    python tools/reembed.py <name> --drop-old
+
+A collection created before versioning (a plain `<name>` collection, no alias)
+cannot share its name with an alias, so the swap points `<name>__live` at the
+new version instead; the tools prefer it over `<name>`. --drop-old then
+deletes the plain collection and moves the alias to `<name>`. The tools
+resolve to the new version at every step, so no request sees
+collection_not_found.
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from qdrant_client import QdrantClient, models
+
+from collection_catalog import (
+    DEFAULT_TTL_S, CollectionCatalog, collection_model, default_cache_dir, describe_collection, list_aliases,
+    live_alias, mark_ingested, resolve_alias, versioned_name, write_json_atomic,
+)
+from embedder import Embedder
+from ingest import Checkpoint, content_hash
+from lexical_index import rebuild_index
+from retrieval import payload_to_text_and_meta
+
+
+def _json_out(obj: Dict[str, Any]) -> None:
+    print(json.dumps(obj, ensure_ascii=False))
+
+
+def _safe_str(e: BaseException) -> str:
+    try:
+        return str(e)
+    except Exception:
+        return repr(e)
+
+
+def _progress_path(target: str) -> Path:
+    safe = re.sub(r"[^\w.-]+", "_", target)
+    return default_cache_dir() / f"reembed_{safe}.json"
+
+
+def _load_progress(path: Path, source: str) -> Dict[str, Any]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("source") == source:
+            return data
+    except Exception:
+        pass
+    return {"source": source, "offset": None, "copied": 0, "skipped_empty": 0, "done": False}
+
+
+def copy_with_new_vectors(qclient: QdrantClient, source: str, target: str, embedder: Embedder,
+                          progress_path: Path, page_size: int, upsert_batch: int, workers: int) -> Dict[str, Any]:
+    progress = _load_progress(progress_path, source)
+    if progress.get("done"):
+        return progress
+
+    # ingest.py's checkpoint is per physical collection. The new version gets its own,
+    # with hashes under the new model, so the next ingest through the alias only
+    # re-embeds what actually changed.
+    model = embedder.model_name
+    ckpt = Checkpoint(target, model)
+    if progress.get("offset") is None:
+        ckpt.points, ckpt.sources = {}, dict(Checkpoint(source, model).sources)
+
+    def _upsert(points: List[Any]) -> None:
+        qclient.upsert(collection_name=target, points=points, wait=True)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        while True:
+            records, next_offset = qclient.scroll(
+                collection_name=source,
+                limit=page_size,
+                offset=progress.get("offset"),
+                with_payload=True,
+                with_vectors=False,
+            )
+            keep = []
+            for r in records:
+                payload = getattr(r, "payload", None) or {}
+                text, meta = payload_to_text_and_meta(payload)
+                if text:
+                    if "content_hash" in payload:
+                        payload = dict(payload, content_hash=content_hash(model, text, meta))
+                        ckpt.points[str(getattr(r, "id", None))] = payload["content_hash"]
+                    keep.append((getattr(r, "id", None), payload, text))
+            progress["skipped_empty"] += len(records) - len(keep)
+
+            if keep:
+                vectors = embedder.encode([t for _, _, t in keep])
+                points = [models.PointStruct(id=pid, vector=v, payload=p) for (pid, p, _), v in zip(keep, vectors)]
+                # The page is only marked done once all of its batches are stored.
+                list(pool.map(_upsert, [points[i: i + upsert_batch] for i in range(0, len(points), upsert_batch)]))
+                progress["copied"] += len(points)
+
+            progress["offset"] = next_offset
+            progress["done"] = next_offset is None
+            ckpt.save()
+            write_json_atomic(progress_path, progress)
+            print(f"{target}: {progress['copied']} points copied", file=sys.stderr)
+            if progress["done"]:
+                return progress
+
+
+def _state_path(name: str) -> Path:
+    safe = re.sub(r"[^\w.-]+", "_", name)
+    return default_cache_dir() / f"reembed_state_{safe}.json"
+
+
+def _load_state(name: str) -> Dict[str, Any]:
+    try:
+        with open(_state_path(name), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def _catalog_ttl_s() -> float:
+    try:
+        return float(os.environ.get("RAG_CATALOG_TTL") or DEFAULT_TTL_S)
+    except ValueError:
+        return DEFAULT_TTL_S
+
+
+def _alias_ops(alias: str, target: str, replace: bool) -> List[Any]:
+    ops: List[Any] = []
+    if replace:
+        ops.append(models.DeleteAliasOperation(delete_alias=models.DeleteAlias(alias_name=alias)))
+    ops.append(models.CreateAliasOperation(create_alias=models.CreateAlias(collection_name=target, alias_name=alias)))
+    return ops
+
+
+def swap_alias(qclient: QdrantClient, name: str, target: str, aliases: Dict[str, str]) -> str:
+    """Point the alias the tools resolve for `name` at `target`; returns the alias used.
+
+    Never deletes anything: while a plain `<name>` collection exists the alias
+    is `<name>__live` (see --drop-old).
+    """
+    if live_alias(name) in aliases or (name not in aliases and qclient.collection_exists(name)):
+        alias = live_alias(name)
+    else:
+        alias = name
+    qclient.update_collection_aliases(change_aliases_operations=_alias_ops(alias, target, alias in aliases))
+    return alias
+
+
+def drop_old(qclient: QdrantClient, name: str) -> Dict[str, Any]:
+    """Delete the versions a previous swap replaced, once no cached catalog can point at them."""
+    state = _load_state(name)
+    previous = [c for c in state.get("previous") or [] if c]
+    if not previous:
+        return {"ok": False, "error": "nothing_to_drop", "collection": name}
+    active = resolve_alias(list_aliases(qclient), name)
+    if active != state.get("target"):
+        return {"ok": False, "error": "alias_moved", "collection": name, "active": active, "expected": state.get("target")}
+    wait_s = float(state.get("swapped_at") or 0.0) + _catalog_ttl_s() - time.time()
+    if wait_s > 0:
+        return {"ok": False, "error": "too_early", "collection": name, "retry_in_s": int(wait_s) + 1}
+
+    dropped = []
+    for coll in previous:
+        if coll == active:
+            continue
+        if coll == name:
+            # Plain pre-versioning collection: once it is gone, `<name>` can become the
+            # alias; `<name>__live` keeps resolving to the new version until then.
+            if qclient.collection_exists(name) and name not in list_aliases(qclient):
+                qclient.delete_collection(name)
+            ops = _alias_ops(name, active, False)
+            ops.append(models.DeleteAliasOperation(delete_alias=models.DeleteAlias(alias_name=live_alias(name))))
+            qclient.update_collection_aliases(change_aliases_operations=ops)
+        elif qclient.collection_exists(coll):
+            qclient.delete_collection(coll)
+        dropped.append(coll)
+    try:
+        _state_path(name).unlink()
+    except FileNotFoundError:
+        pass
+    return {"ok": True, "collection": name, "active": active, "dropped": dropped}
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("name", help="alias (or unversioned collection) the tools query")
+    ap.add_argument("--model", default=os.environ.get("RAG_EMBED_MODEL", "intfloat/multilingual-e5-base"))
+    ap.add_argument("--dim", type=int, default=0, help="Matryoshka-truncated vector size (default: the model's)")
+    ap.add_argument("--page-size", type=int, default=256)
+    ap.add_argument("--upsert-batch", type=int, default=128)
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--no-swap", action="store_true", help="copy only; swap later by re-running without it")
+    ap.add_argument("--drop-old", action="store_true",
+                    help="only delete the versions replaced by earlier swaps; refused until RAG_CATALOG_TTL has passed")
+    args = ap.parse_args()
+
+    qdrant_url = os.environ.get("QDRANT_URL")
+    qdrant_api_key = os.environ.get("QDRANT_API_KEY")
+    if not qdrant_url or not qdrant_api_key:
+        _json_out({"ok": False, "error": "missing_qdrant_env"})
+        return 2
+
+    qclient = QdrantClient(url=qdrant_url, api_key=qdrant_api_key, timeout=120)
+    if args.drop_old:
+        try:
+            result = drop_old(qclient, args.name)
+        except Exception as e:
+            result = {"ok": False, "error": "drop_failed", "collection": args.name, "detail": _safe_str(e)}
+        if result["ok"]:
+            CollectionCatalog(qclient, qdrant_url).invalidate()
+        _json_out(result)
+        return 0 if result["ok"] else (4 if result["error"] == "drop_failed" else 3)
+
+    aliases = list_aliases(qclient)
+    source = resolve_alias(aliases, args.name) or args.name
+    if not qclient.collection_exists(source):
+        _json_out({"ok": False, "error": "collection_not_found", "collection": args.name})
+        return 3
+
+    try:
+        embedder = Embedder(args.model, backend="fp32", truncate_dim=args.dim)
+    except Exception as e:
+        _json_out({"ok": False, "error": "embedder_failed", "model": args.model, "detail": _safe_str(e)})
+        return 5
+    truncated = embedder.dim < embedder.full_dim
+
+    target = versioned_name(args.name, args.model, embedder.dim if truncated else 0)
+    if source == target:
+        _json_out({"ok": True, "collection": args.name, "active": target, "changed": False})
+        return 0
+
+    t0 = time.perf_counter()
+    try:
+        src_info = describe_collection(qclient, source)
+        if not qclient.collection_exists(target):
+            metadata: Dict[str, Any] = {"embed_model": args.model}
+            if truncated:
+                metadata["embed_dim"] = embedder.dim
+            qclient.create_collection(
+                collection_name=target,
+                vectors_config=models.VectorParams(
+                    size=embedder.dim,
+                    distance=getattr(models.Distance, str(src_info.get("distance") or "Cosine").upper(), models.Distance.COSINE),
+                ),
+                metadata=metadata,
+            )
+        progress = copy_with_new_vectors(
+            qclient, source, target, embedder, _progress_path(target),
+            args.page_size, args.upsert_batch, args.workers,
+        )
+        mark_ingested(qclient, target)
+        # Ready before the swap, so icd11_score.py keeps its BM25 fusion across it.
+        rebuild_index(qclient, target)
+    except Exception as e:
+        _json_out({
+            "ok": False,
+            "error": "reembed_failed",
+            "collection": args.name,
+            "target": target,
+            "detail": _safe_str(e),
+            "hint": "Vuelve a ejecutar el mismo comando: continúa desde la última página copiada.",
+        })
+        return 4
+
+    result: Dict[str, Any] = {
+        "ok": True,
+        "collection": args.name,
+        "previous": source,
+        "previous_model": collection_model(src_info, source),
+        "target": target,
+        "model": args.model,
+        "dim": embedder.dim,
+        "copied": progress["copied"],
+        "skipped_empty": progress["skipped_empty"],
+        "copy_s": round(time.perf_counter() - t0, 2),
+        "swapped": False,
+    }
+    if args.no_swap:
+        _json_out(result)
+        return 0
+
+    try:
+        result["alias"] = swap_alias(qclient, args.name, target, aliases)
+    except Exception as e:
+        _json_out(dict(result, ok=False, error="alias_swap_failed", detail=_safe_str(e)))
+        return 4
+    result["swapped"] = True
+    # This host's tools pick up the new version right away; others within RAG_CATALOG_TTL.
+    CollectionCatalog(qclient, qdrant_url).invalidate()
+
+    # Replaced versions accumulate until a --drop-old run removes them.
+    state = _load_state(args.name)
+    pending = [c for c in state.get("previous") or [] if c not in (source, target)]
+    write_json_atomic(_state_path(args.name), {
+        "collection": args.name,
+        "target": target,
+        "previous": pending + [source],
+        "swapped_at": time.time(),
+    })
+    result["drop_old_after_s"] = round(_catalog_ttl_s())
+
+    _json_out(result)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
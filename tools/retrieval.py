@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Shared Qdrant retrieval helpers for rag_query.py and icd11_score.py.
+
+Retrieval runs in two phases: first ids and scores only for the `top_n`
+candidates, then one `retrieve` call that pulls payloads for the selected
+`k` points. The unused candidates never send their page text over the wire.
+"""
+
+import json
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from qdrant_client import QdrantClient
+
+
+Hit = Tuple[Any, float]
+
+
+def payload_to_text_and_meta(payload: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    if not payload:
+        return "", {}
+
+    text = payload.get("page_content") or payload.get("text") or payload.get("content") or ""
+
+    meta = payload.get("metadata") if isinstance(payload.get("metadata"), dict) else None
+    if not meta:
+        meta = {k: v for k, v in payload.items() if k not in ("page_content", "text", "content")}
+
+    return str(text).strip(), (meta or {})
+
+
+def _payload_bytes(payload: Any) -> int:
+    try:
+        return len(json.dumps(payload or {}, ensure_ascii=False).encode("utf-8"))
+    except Exception:
+        return 0
+
+
+def search_ids(qclient: QdrantClient, collection: str, qvec: List[float], limit: int) -> List[Hit]:
+    """Phase 1: (id, score) pairs for the nearest `limit` points, no payloads."""
+    # qdrant-client API differs by version. Support both older/newer clients.
+    if hasattr(qclient, "query_points"):
+        qr = qclient.query_points(
+            collection_name=collection,
+            query=qvec,
+            limit=limit,
+            with_payload=False,
+            with_vectors=False,
+        )
+        points = getattr(qr, "points", None) or []
+    elif hasattr(qclient, "query"):
+        qr = qclient.query(
+            collection_name=collection,
+            query_vector=qvec,
+            limit=limit,
+            with_payload=False,
+        )
+        points = getattr(qr, "points", None) or getattr(qr, "result", None) or []
+    elif hasattr(qclient, "search"):
+        points = qclient.search(
+            collection_name=collection,
+            query_vector=qvec,
+            limit=limit,
+            with_payload=False,
+            with_vectors=False,
+        )
+    else:
+        raise RuntimeError("Unsupported qdrant-client: no query_points/query/search method")
+
+    return [(getattr(p, "id", None), float(getattr(p, "score", 0.0) or 0.0)) for p in points]
+
+
+def fetch_payloads(qclient: QdrantClient, collection: str, ids: List[Any]) -> Dict[Any, Dict[str, Any]]:
+    """Phase 2: payloads for `ids` in a single round trip, keyed by point id."""
+    if not ids:
+        return {}
+    records = qclient.retrieve(
+        collection_name=collection,
+        ids=list(ids),
+        with_payload=True,
+        with_vectors=False,
+    )
+    return {getattr(r, "id", None): (getattr(r, "payload", None) or {}) for r in records}
+
+
+def dedup_hits(hits: List[Hit]) -> List[Hit]:
+    seen = set()
+    out: List[Hit] = []
+    for pid, score in hits:
+        if pid is None or pid in seen:
+            continue
+        seen.add(pid)
+        out.append((pid, score))
+    return out
+
+
+def fetch_docs(qclient: QdrantClient, collection: str, hits: List[Hit], k: int) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """Phase 2: payloads for the first `k` usable `hits`, in their order.
+
+    Points whose payload has no text are skipped and the next ids are
+    fetched, so the caller still gets up to `k` usable chunks.
+    """
+    k = max(1, int(k))
+    docs: List[Dict[str, Any]] = []
+    fetched = 0
+    fetched_bytes = 0
+    calls = 0
+    cursor = 0
+    while len(docs) < k and cursor < len(hits):
+        batch = hits[cursor: cursor + (k - len(docs))]
+        cursor += len(batch)
+        payloads = fetch_payloads(qclient, collection, [pid for pid, _ in batch])
+        calls += 1
+        for pid, score in batch:
+            payload = payloads.get(pid) or {}
+            fetched += 1
+            fetched_bytes += _payload_bytes(payload)
+            text, meta = payload_to_text_and_meta(payload)
+            if not text:
+                continue
+            docs.append({
+                "id": pid,
+                "page_content": text,
+                "metadata": meta,
+                "score": score,
+            })
+
+    skipped = max(0, len(hits) - fetched)
+    avg_bytes = (fetched_bytes / fetched) if fetched else 0.0
+    metrics = {
+        "candidates": len(hits),
+        "payloads_fetched": fetched,
+        "payload_calls": calls,
+        "payload_bytes": fetched_bytes,
+        # Estimated from the average size of the payloads we did fetch.
+        "payload_bytes_saved_est": int(round(avg_bytes * skipped)),
+    }
+    return docs, metrics
+
+
+def two_phase_search(
+    qclient: QdrantClient,
+    collection: str,
+    qvec: List[float],
+    k: int,
+    top_n: int,
+    reorder: Optional[Callable[[List[Hit]], List[Hit]]] = None,
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """Returns (docs, metrics).
+
+    `docs` keeps the shape the tools already used ({page_content, metadata,
+    score}). `reorder(hits)` may re-rank the candidates (e.g. BM25 fusion)
+    before the payloads of the final `k` are fetched.
+    """
+    k = max(1, int(k))
+    hits = dedup_hits(search_ids(qclient, collection, qvec, max(k, int(top_n))))
+    if reorder is not None:
+        hits = reorder(hits)
+    return fetch_docs(qclient, collection, hits, k)
+
+
+def _minmax(hits: List[Hit]) -> List[Hit]:
+    # Scores from different collections are not comparable (different corpora,
+    # sometimes different distances); rescale each list to 0..1 before merging.
+    if not hits:
+        return []
+    scores = [s for _, s in hits]
+    lo, hi = min(scores), max(scores)
+    if hi - lo <= 1e-12:
+        return [(pid, 1.0) for pid, _ in hits]
+    return [(pid, (s - lo) / (hi - lo)) for pid, s in hits]
+
+
+def federated_search(
+    qclient: QdrantClient,
+    collections: List[str],
+    qvecs: Dict[str, List[float]],
+    k: int,
+    top_n: int,
+    max_workers: Optional[int] = None,
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """Two-phase search over several collections at once.
+
+    `qvecs` maps each collection to its query vector (they can differ when a
+    collection needs a truncated vector). Phase 1 runs concurrently, scores are
+    min-max normalized per collection and merged; phase 2 fetches payloads of
+    the selected points with one concurrent `retrieve` per collection.
+    Each doc carries `collection` and its raw `raw_score` for provenance.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    k = max(1, int(k))
+    limit = max(k, int(top_n))
+    workers = max_workers or min(8, len(collections)) or 1
+    per: Dict[str, Dict[str, Any]] = {c: {"selected": 0} for c in collections}
+
+    def _search(c: str) -> Tuple[str, List[Hit]]:
+        t0 = time.perf_counter()
+        hits = dedup_hits(search_ids(qclient, c, qvecs[c], limit))
+        per[c]["search_ms"] = round((time.perf_counter() - t0) * 1000.0, 1)
+        per[c]["candidates"] = len(hits)
+        return c, hits
+
+    merged: List[Tuple[str, Any, float, float]] = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for c, hits in pool.map(_search, collections):
+            raw = dict(hits)
+            merged.extend((c, pid, norm, raw[pid]) for pid, norm in _minmax(hits))
+        # Ties keep the request's collection order.
+        order = {c: i for i, c in enumerate(collections)}
+        merged.sort(key=lambda x: (-x[2], order[x[0]]))
+
+        docs: List[Dict[str, Any]] = []
+        fetched = 0
+        fetched_bytes = 0
+        cursor = 0
+        while len(docs) < k and cursor < len(merged):
+            batch = merged[cursor: cursor + (k - len(docs))]
+            cursor += len(batch)
+            by_coll: Dict[str, List[Any]] = {}
+            for c, pid, _, _ in batch:
+                by_coll.setdefault(c, []).append(pid)
+
+            def _fetch(c: str) -> Tuple[str, Dict[Any, Dict[str, Any]]]:
+                t0 = time.perf_counter()
+                payloads = fetch_payloads(qclient, c, by_coll[c])
+                per[c]["fetch_ms"] = round(per[c].get("fetch_ms", 0.0) + (time.perf_counter() - t0) * 1000.0, 1)
+                return c, payloads
+
+            payloads = dict(pool.map(_fetch, list(by_coll)))
+            for c, pid, norm, raw_score in batch:
+                payload = payloads.get(c, {}).get(pid) or {}
+                fetched += 1
+                fetched_bytes += _payload_bytes(payload)
+                text, meta = payload_to_text_and_meta(payload)
+                if not text:
+                    continue
+                per[c]["selected"] += 1
+                docs.append({
+                    "id": pid,
+                    "collection": c,
+                    "page_content": text,
+                    "metadata": meta,
+                    "score": norm,
+                    "raw_score": raw_score,
+                })
+
+    skipped = max(0, len(merged) - fetched)
+    avg_bytes = (fetched_bytes / fetched) if fetched else 0.0
+    metrics = {
+        "candidates": len(merged),
+        "payloads_fetched": fetched,
+        "payload_bytes": fetched_bytes,
+        "payload_bytes_saved_est": int(round(avg_bytes * skipped)),
+        "per_collection": per,
+    }
+    return docs, metrics
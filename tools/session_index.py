@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Per-patient semantic index of session transcripts.
+
+process_all.py calls update_patient_index() at the end of the pipeline. It
+groups each session's `*_labeled.json` segments into speaker turns, embeds
+the new or changed sessions in one batch and stores them under
+`outputs/<patient>/turn_index/`:
+
+    vectors.npy   float32 matrix, one L2-normalized row per turn (memory-mapped on query)
+    turns.json    model, per-session content hash, and the row metadata
+                  (session, speaker, start, end, text)
+
+A query is one dot product over the memory-mapped matrix, so searching a
+patient's whole history takes milliseconds. Query tool (JSON in/out like the
+other tools):
+
+    echo '{"patient_folder": "patient_ana", "query": "habló de su padre", "k": 8}' | python tools/session_index.py
+
+A query never builds the index. Sessions transcribed before the index existed
+are indexed with the explicit build command:
+
+    echo '{"patient_folder": "patient_ana"}' | python tools/session_index.py --build
+"""
+
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from collection_catalog import PROJECT_ROOT, write_json_atomic
+from embedder import Embedder
+
+
+INDEX_VERSION = 1
+INDEX_DIRNAME = "turn_index"
+# Turns longer than this are split on segment boundaries so one row stays one topic.
+MAX_TURN_WORDS = 120
+# "Sí", "ajá"... carry nothing to search for.
+MIN_TURN_WORDS = 3
+
+_SESSION_RE = re.compile(r"^sesion_(\d+)$")
+
+
+def _json_out(obj: Dict[str, Any]) -> None:
+    print(json.dumps(obj, ensure_ascii=False))
+
+
+def _safe_str(e: BaseException) -> str:
+    try:
+        return str(e)
+    except Exception:
+        return repr(e)
+
+
+def patient_dir_for(output_dir: str) -> Tuple[Path, str]:
+    """(patient dir, session label) for a process_all output dir like outputs/patient_x/sesion_2."""
+    out = Path(output_dir).resolve()
+    if _SESSION_RE.match(out.name):
+        return out.parent, out.name
+    return out, out.name
+
+
+def find_sessions(patient_dir: Path) -> Dict[str, Path]:
+    """{session label: labeled json}, newest labeled file per session folder."""
+    sessions: Dict[str, Path] = {}
+    for d in sorted(patient_dir.iterdir()) if patient_dir.is_dir() else []:
+        if not d.is_dir() or not _SESSION_RE.match(d.name):
+            continue
+        labeled = sorted(d.glob("*_labeled.json"), key=lambda p: p.stat().st_mtime)
+        if labeled:
+            sessions[d.name] = labeled[-1]
+    return sessions
+
+
+def segments_to_turns(segments: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Merges consecutive segments of the same speaker into turns."""
+    turns: List[Dict[str, Any]] = []
+    cur: Optional[Dict[str, Any]] = None
+    for seg in segments:
+        text = str(seg.get("text") or "").strip()
+        if not text:
+            continue
+        speaker = str(seg.get("speaker") or "?")
+        words = len(text.split())
+        if cur is not None and cur["speaker"] == speaker and cur["words"] + words <= MAX_TURN_WORDS:
+            cur["text"] += " " + text
+            cur["end"] = float(seg.get("end") or cur["end"])
+            cur["words"] += words
+            continue
+        cur = {
+            "speaker": speaker,
+            "start": float(seg.get("start") or 0.0),
+            "end": float(seg.get("end") or 0.0),
+            "text": text,
+            "words": words,
+        }
+        turns.append(cur)
+    return [
+        {k: v for k, v in t.items() if k != "words"}
+        for t in turns if t["words"] >= MIN_TURN_WORDS
+    ]
+
+
+def _file_hash(path: Path) -> str:
+    return hashlib.sha1(path.read_bytes()).hexdigest()
+
+
+def _sort_key(session: str) -> int:
+    m = _SESSION_RE.match(session)
+    return int(m.group(1)) if m else 0
+
+
+class TurnIndex:
+    def __init__(self, patient_dir: Path):
+        self.dir = Path(patient_dir) / INDEX_DIRNAME
+        self.meta_path = self.dir / "turns.json"
+        self.vectors_path = self.dir / "vectors.npy"
+        self.model: Optional[str] = None
+        self.sessions: Dict[str, Dict[str, Any]] = {}
+        self.turns: List[Dict[str, Any]] = []
+        try:
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == INDEX_VERSION:
+                self.model = data.get("model")
+                self.sessions = data.get("sessions") or {}
+                self.turns = data.get("turns") or []
+        except Exception:
+            pass
+
+    def vectors(self) -> np.ndarray:
+        # mmap: a query touches the pages it needs instead of reading the whole matrix.
+        return np.load(self.vectors_path, mmap_mode="r")
+
+    def save(self, vectors: np.ndarray) -> None:
+        self.dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.vectors_path.with_name(f"vectors.{os.getpid()}.tmp.npy")
+        np.save(tmp, vectors.astype(np.float32, copy=False))
+        os.replace(tmp, self.vectors_path)
+        write_json_atomic(self.meta_path, {
+            "version": INDEX_VERSION,
+            "model": self.model,
+            "updated_at": time.time(),
+            "sessions": self.sessions,
+            "turns": self.turns,
+        })
+
+    def search(self, qvec: List[float], k: int = 8, session: Optional[str] = None,
+               speaker: Optional[str] = None) -> List[Dict[str, Any]]:
+        if not self.turns or not self.vectors_path.exists():
+            return []
+        scores = self.vectors() @ np.asarray(qvec, dtype=np.float32)
+        if session or speaker:
+            mask = np.array([
+                (not session or t["session"] == session) and (not speaker or t["speaker"] == speaker)
+                for t in self.turns
+            ])
+            scores = np.where(mask, scores, -np.inf)
+        k = max(1, min(int(k), len(self.turns)))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [dict(self.turns[i], score=round(float(scores[i]), 4)) for i in top if np.isfinite(scores[i])]
+
+
+def update_patient_index(patient_dir: Path, embedder: Optional[Embedder] = None) -> Dict[str, Any]:
+    """Re-embeds only the sessions whose labeled json changed; drops removed sessions."""
+    patient_dir = Path(patient_dir)
+    index = TurnIndex(patient_dir)
+    sessions = find_sessions(patient_dir)
+    model = embedder.model_name if embedder else os.environ.get("RAG_EMBED_MODEL", "intfloat/multilingual-e5-base")
+
+    # Read fully (no mmap): the file is replaced below, which Windows refuses while it is mapped.
+    old_vectors = np.load(index.vectors_path) if index.turns and index.vectors_path.exists() else None
+    if index.model != model:
+        index.sessions, index.turns, old_vectors = {}, [], None
+
+    hashes = {s: _file_hash(p) for s, p in sessions.items()}
+    changed = [s for s in sessions if (index.sessions.get(s) or {}).get("hash") != hashes[s]]
+    keep_rows = [i for i, t in enumerate(index.turns) if t["session"] in sessions and t["session"] not in changed]
+    if not changed and len(keep_rows) == len(index.turns):
+        return {"patient_dir": str(patient_dir), "sessions": len(sessions), "reindexed": [], "turns": len(index.turns)}
+
+    new_turns: List[Dict[str, Any]] = []
+    for s in changed:
+        with open(sessions[s], "r", encoding="utf-8") as f:
+            segments = json.load(f)
+        for t in segments_to_turns(segments if isinstance(segments, list) else []):
+            new_turns.append(dict(t, session=s, source=sessions[s].name))
+
+    dim = 0
+    new_vectors = np.zeros((0, 0), dtype=np.float32)
+    if new_turns:
+        embedder = embedder or Embedder(model, backend="fp32", truncate_dim=0)
+        new_vectors = np.asarray(embedder.encode([t["text"] for t in new_turns], batch_size=64), dtype=np.float32)
+        dim = new_vectors.shape[1]
+    elif old_vectors is not None:
+        dim = old_vectors.shape[1]
+
+    parts = []
+    if old_vectors is not None and keep_rows:
+        parts.append(np.asarray(old_vectors[keep_rows], dtype=np.float32))
+    if new_turns:
+        parts.append(new_vectors)
+    vectors = np.concatenate(parts) if parts else np.zeros((0, dim), dtype=np.float32)
+    turns = [index.turns[i] for i in keep_rows] + new_turns
+
+    # Chronological order (session number, then time) so results read naturally.
+    order = sorted(range(len(turns)), key=lambda i: (_sort_key(turns[i]["session"]), turns[i]["start"]))
+    index.turns = [turns[i] for i in order]
+    index.model = model
+    index.sessions = {
+        s: {"hash": hashes[s], "turns": sum(1 for t in index.turns if t["session"] == s)}
+        for s in sessions
+    }
+    index.save(vectors[order] if len(order) else vectors)
+    return {
+        "patient_dir": str(patient_dir),
+        "sessions": len(sessions),
+        "reindexed": changed,
+        "turns": len(index.turns),
+    }
+
+
+def main() -> int:
+    raw_in = sys.stdin.read()
+    try:
+        req = json.loads(raw_in) if raw_in.strip() else {}
+    except Exception as e:
+        _json_out({"ok": False, "error": "bad_json_in", "detail": _safe_str(e)})
+        return 2
+
+    build = "--build" in sys.argv[1:]
+    patient_folder = str(req.get("patient_folder") or "").strip()
+    query = str(req.get("query") or "").strip()
+    if not patient_folder or not (query or build):
+        _json_out({"ok": False, "error": "missing_patient_or_query"})
+        return 2
+
+    outputs_dir = (PROJECT_ROOT / "outputs").resolve()
+    patient_dir = (outputs_dir / patient_folder).resolve()
+    if outputs_dir not in patient_dir.parents:
+        _json_out({"ok": False, "error": "bad_patient_folder"})
+        return 2
+
+    if build:
+        try:
+            summary = update_patient_index(patient_dir)
+        except Exception as e:
+            _json_out({"ok": False, "error": "index_build_failed", "patient_folder": patient_folder, "detail": _safe_str(e)})
+            return 5
+        _json_out(dict(summary, ok=True, patient_folder=patient_folder))
+        return 0
+
+    index = TurnIndex(patient_dir)
+    sessions = find_sessions(patient_dir) if not index.turns else {}
+    if sessions:
+        # Sessions transcribed before the index existed: building it here would embed the whole
+        # history inside a search request, so the query reports it and the build runs apart.
+        _json_out({
+            "ok": False,
+            "error": "index_missing",
+            "patient_folder": patient_folder,
+            "sessions": len(sessions),
+            "hint": "El índice se crea en el paso 4/4 de process_all.py o con tools/session_index.py --build.",
+        })
+        return 3
+    if not index.turns:
+        _json_out({
+            "ok": False,
+            "error": "index_not_found",
+            "patient_folder": patient_folder,
+            "hint": "El índice se crea al terminar la transcripción de una sesión (process_all.py).",
+        })
+        return 3
+
+    t0 = time.perf_counter()
+    try:
+        embedder = Embedder(index.model)
+        t1 = time.perf_counter()
+        qvec = embedder.encode_query(query)
+    except Exception as e:
+        _json_out({"ok": False, "error": "embedder_failed", "model": index.model, "detail": _safe_str(e)})
+        return 5
+    t2 = time.perf_counter()
+    results = index.search(qvec, k=int(req.get("k") or 8), session=req.get("session"), speaker=req.get("speaker"))
+    t3 = time.perf_counter()
+
+    _json_out({
+        "ok": True,
+        "patient_folder": patient_folder,
+        "query": query,
+        "results": results,
+        "metrics": {
+            "turns": len(index.turns),
+            "sessions": len(index.sessions),
+            "model_load_ms": round((t1 - t0) * 1000.0, 1),
+            "embed_ms": round((t2 - t1) * 1000.0, 1),
+            "search_ms": round((t3 - t2) * 1000.0, 2),
+        },
+    })
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for the token-budgeted context packing (context_packer.py).
+
+    python -m pytest tools/test_context_packer.py
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+import context_packer
+from context_packer import MIN_CHUNK_TOKENS, count_tokens, pack_context
+
+
+def _doc(text, source="a.pdf", page=1):
+    return {"page_content": text, "metadata": {"source_pdf": source, "page": page}, "score": 1.0}
+
+
+def _text(tag, n_words):
+    return " ".join(f"{tag}{j}" for j in range(n_words))
+
+
+class _CharEncoder:
+    """One token per character, so a tiktoken-style encoder can be checked without tiktoken."""
+
+    def encode(self, text, disallowed_special=()):
+        return [ord(c) for c in text]
+
+    def decode(self, ids):
+        return "".join(chr(i) for i in ids)
+
+
+def test_near_duplicates_dropped_per_page():
+    """A near-duplicate on the same page is dropped; the same text on another page is kept"""
+    base = _text("sintoma", 60)
+    docs = [
+        _doc(base, page=1),
+        _doc(_text("sintoma", 55), page=1),
+        _doc(base, page=2),
+        _doc(_text("otro", 60), page=1),
+    ]
+    packed, stats = pack_context(docs, budget_tokens=10000)
+    assert [d["metadata"]["page"] for d in packed] == [1, 2, 1]
+    assert packed[0] is docs[0] and packed[1] is docs[2] and packed[2] is docs[3]
+    assert stats["dropped_duplicates"] == 1 and stats["chunks_in"] == 4 and stats["chunks_out"] == 3
+
+
+def test_budget_cap_trims_only_long_chunks():
+    """Packed context fits the budget; short chunks stay whole and long ones are trimmed"""
+    docs = [_doc(_text(f"d{i}x", n), page=i) for i, n in enumerate([300, 20, 250, 15, 400])]
+    budget = 300
+    packed, stats = pack_context(docs, budget_tokens=budget)
+    assert stats["context"] <= budget, stats
+    assert stats["context"] == sum(count_tokens(d["page_content"]) for d in packed)
+    assert len(packed) == len(docs) and stats["dropped_over_budget"] == 0
+    assert packed[1]["page_content"] == docs[1]["page_content"]
+    assert packed[3]["page_content"] == docs[3]["page_content"]
+    changed = [i for i, (p, d) in enumerate(zip(packed, docs)) if p["page_content"] != d["page_content"]]
+    assert changed == [0, 2, 4] and stats["trimmed"] == 3, stats
+    for i in changed:
+        assert packed[i]["page_content"].endswith(" …")
+        assert docs[i]["page_content"].startswith(packed[i]["page_content"][:-2])
+    assert docs[0]["page_content"] == _text("d0x", 300), "input docs must not be modified"
+
+
+def test_tiny_budget_keeps_top_ranked_chunks():
+    """A budget too small to share keeps fewer, top-ranked chunks instead of slivers"""
+    docs = [_doc(_text(f"d{i}x", 200), page=i) for i in range(10)]
+    packed, stats = pack_context(docs, budget_tokens=100)
+    assert stats["context"] <= 100, stats
+    assert [d["metadata"]["page"] for d in packed] == list(range(len(packed)))
+    assert stats["dropped_over_budget"] == 10 - len(packed) > 0, stats
+    assert all(count_tokens(d["page_content"]) >= MIN_CHUNK_TOKENS for d in packed)
+
+
+def test_short_chunks_that_fit_are_all_kept():
+    """Chunks shorter than MIN_CHUNK_TOKENS are not dropped when they all fit"""
+    docs = [_doc(_text(f"d{i}x", 8), page=i) for i in range(6)]
+    packed, stats = pack_context(docs, budget_tokens=3000)
+    assert packed == docs
+    assert stats["dropped_over_budget"] == 0 and stats["trimmed"] == 0, stats
+
+
+def test_budget_holds_with_tokenizer():
+    """With a tokenizer the trim marker counts against the cap too"""
+    saved = context_packer._encoder
+    context_packer._encoder = _CharEncoder()
+    try:
+        docs = [_doc(_text(f"d{i}x", 80), page=i) for i in range(4)]
+        packed, stats = pack_context(docs, budget_tokens=400)
+        assert stats["tokenizer"] == "tiktoken"
+        assert stats["trimmed"] == 4 and stats["context"] <= 400, stats
+    finally:
+        context_packer._encoder = saved
+
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for the local BM25 index and its fusion with dense hits (lexical_index.py).
+
+Builds the index and code table over an in-memory Qdrant collection into a
+temporary RAG_CACHE_DIR.
+
+    python -m pytest tools/test_lexical_index.py
+"""
+
+import io
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).parent))
+os.environ["RAG_CACHE_DIR"] = tempfile.mkdtemp(prefix="rag_cache_test_")
+
+from qdrant_client import QdrantClient, models
+
+import icd11_score
+import lexical_index
+from bench_fixtures import build_collection
+from collection_catalog import describe_collection, mark_ingested
+from lexical_index import (
+    RRF_K, LexicalIndex, index_path, is_code_query, load_code_table, load_fresh, rebuild_index,
+)
+
+COLLECTION = "test_lexical"
+PAYLOADS = [
+    {"page_content": "6B00.1 Ansiedad generalizada con crisis. Preocupación excesiva y tensión muscular.",
+     "metadata": {"code": "6B00.1", "category": "Trastornos de ansiedad"}},
+    {"page_content": "6B00 Trastorno de ansiedad generalizada. Preocupación excesiva e irritabilidad.",
+     "metadata": {"code": "6B00", "category": "Trastornos de ansiedad"}},
+    {"page_content": "6A70 Episodio depresivo único. Anhedonia, tristeza y fatiga persistente.",
+     "metadata": {"code": "6A70", "category": "Trastornos del estado de ánimo"}},
+    {"page_content": "7A00 Insomnio crónico. Dificultad para conciliar el sueño y despertar precoz.",
+     "metadata": {"code": "7A00", "category": "Trastornos del sueño"}},
+    {"page_content": "", "metadata": {"code": "6C40"}},
+]
+
+
+def _setup():
+    qclient = QdrantClient(":memory:")
+    build_collection(qclient, COLLECTION, PAYLOADS, [[1.0, 0.1 * i, 0.0, 0.0] for i in range(len(PAYLOADS))])
+    mark_ingested(qclient, COLLECTION)
+    return qclient, rebuild_index(qclient, COLLECTION)
+
+
+def _info(qclient):
+    return dict(describe_collection(qclient, COLLECTION), collection=COLLECTION)
+
+
+def test_bm25_search():
+    """BM25 ranks the document with the query term first and skips empty payloads"""
+    _, index = _setup()
+    assert [d["id"] for d in index.docs] == [0, 1, 2, 3]
+    hits = index.search("anhedonia y fatiga", limit=5)
+    assert hits[0][0] == 2, hits
+    assert index.search("esquizofrenia") == []
+    # Accents and case are folded at index and query time.
+    assert index.search("INSOMNIO cronico")[0][0] == 3
+
+
+def test_code_table_exact_first():
+    """Code queries: the exact code comes before its sub-codes, with text and metadata"""
+    qclient, _ = _setup()
+    assert is_code_query("6B00") and is_code_query("6b00, 7A00")
+    assert not is_code_query("6B00 ansiedad")
+    table = load_code_table(_info(qclient))
+    docs = table.lookup(["6b00"], limit=5)
+    assert [d["id"] for d in docs] == [1, 0]
+    assert docs[0]["page_content"] == PAYLOADS[1]["page_content"]
+    assert docs[0]["metadata"]["code"] == "6B00" and docs[0]["score"] == 1.0
+    assert [d["id"] for d in table.lookup(["6B00"], limit=1)] == [1]
+    assert table.lookup(["9Z99"], limit=5) == []
+    # The empty payload is not in the table.
+    assert table.lookup(["6C40"], limit=5) == []
+
+
+def test_rrf_fusion():
+    """Reciprocal-rank fusion: scores are sums of 1/(RRF_K + rank) over both lists"""
+    _, index = _setup()
+    fused = index.fuse([(2, 0.9), (0, 0.8), (3, 0.7)], "anhedonia")
+    scores = dict(fused)
+    assert fused[0][0] == 2
+    assert abs(scores[2] - (1.0 / (RRF_K + 1) + 1.0 / (RRF_K + 1))) < 1e-12
+    assert abs(scores[0] - 1.0 / (RRF_K + 2)) < 1e-12
+    assert abs(scores[3] - 1.0 / (RRF_K + 3)) < 1e-12
+
+    # A BM25 match ranked second by the dense search overtakes the dense top hit.
+    fused = index.fuse([(3, 0.9), (2, 0.8)], "anhedonia")
+    assert [pid for pid, _ in fused] == [2, 3], fused
+    # Documents only BM25 found are added.
+    fused = index.fuse([(3, 0.9)], "anhedonia")
+    assert {pid for pid, _ in fused} == {2, 3}
+
+
+def test_load_fresh_rejects_stale_index():
+    """load_fresh returns the index only while the collection stamp matches"""
+    qclient, index = _setup()
+    info = _info(qclient)
+    fresh = load_fresh(info)
+    assert fresh is not None and fresh.source == index.source
+    assert load_fresh(dict(info, collection="other_collection")) is None
+    assert load_fresh(None) is None
+
+    # New ingest stamp (same point count): stale.
+    assert mark_ingested(qclient, COLLECTION) is not None
+    assert load_fresh(_info(qclient)) is None
+    rebuild_index(qclient, COLLECTION)
+    assert load_fresh(_info(qclient)) is not None
+
+    # Point count changed without a stamp: stale too.
+    qclient.upsert(collection_name=COLLECTION, points=[
+        models.PointStruct(id=99, vector=[0.0, 1.0, 0.0, 0.0], payload={"page_content": "nuevo"}),
+    ])
+    assert load_fresh(_info(qclient)) is None
+    assert LexicalIndex.load(COLLECTION) is not None
+
+
+def test_loaded_index_is_kept_per_process():
+    """A fresh index is parsed once per process; a new stamp makes it read the file again"""
+    qclient, _ = _setup()
+    info = _info(qclient)
+    lexical_index._loaded.clear()
+    first = load_fresh(info)
+    assert first is not None
+    index_path(COLLECTION).unlink()
+    assert load_fresh(info) is first
+    assert load_code_table(info) is not None
+
+    mark_ingested(qclient, COLLECTION)
+    assert load_fresh(_info(qclient)) is None
+
+
+def test_icd11_code_query_skips_embedder_and_qdrant(monkeypatch, capsys):
+    """icd11_score answers a code-only query from the code table: no embedder, no Qdrant search or retrieve"""
+    qclient, _ = _setup()
+
+    def _unexpected(*args, **kwargs):
+        raise AssertionError("code-only query reached Qdrant or the embedder")
+
+    for method in ("retrieve", "query_points", "scroll"):
+        monkeypatch.setattr(qclient, method, _unexpected)
+    answer = json.dumps({"top": [{"nombre": "Ansiedad generalizada", "codigo": "6B00", "score": 70, "evidencia": [1]}]})
+    models_stub = SimpleNamespace(generate_content=lambda model, contents: SimpleNamespace(text=answer))
+    monkeypatch.setattr(icd11_score, "QdrantClient", lambda *a, **kw: qclient)
+    monkeypatch.setattr(icd11_score, "Embedder", _unexpected)
+    monkeypatch.setattr(icd11_score, "genai", SimpleNamespace(Client=lambda **kw: SimpleNamespace(models=models_stub)))
+    monkeypatch.setenv("QDRANT_URL", "http://test.local")
+    monkeypatch.setenv("QDRANT_API_KEY", "test")
+    monkeypatch.setenv("GEMINI_API_KEY", "test")
+    monkeypatch.setattr(sys, "stdin", io.StringIO(json.dumps(
+        {"collection": COLLECTION, "clinical_text": "6B00", "k": 4})))
+
+    assert icd11_score.main() == 0
+    out = json.loads(capsys.readouterr().out.strip().splitlines()[-1])
+    assert out["ok"], out
+    retrieval = out["metrics"]["retrieval"]
+    assert retrieval["mode"] == "lexical_code" and retrieval["payload_calls"] == 0
+    assert [s["code"] for s in out["sources"]] == ["6B00", "6B00.1"]
+
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for the two-phase retrieval helpers (retrieval.py).
+
+Runs against an in-memory Qdrant collection; no Qdrant Cloud or embedder.
+The rag_query test stubs the embedder and Gemini.
+
+    python -m pytest tools/test_retrieval.py
+"""
+
+import io
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).parent))
+os.environ["RAG_CACHE_DIR"] = tempfile.mkdtemp(prefix="rag_cache_test_")
+
+from qdrant_client import QdrantClient, models
+
+import rag_query
+from bench_fixtures import build_collection
+from retrieval import dedup_hits, fetch_docs, two_phase_search
+
+COLLECTION = "test_retrieval"
+QUERY = [1.0, 0.0, 0.0, 0.0]
+EMPTY_IDS = {1, 3}
+
+
+def _client() -> QdrantClient:
+    """Ten points, nearest first by id; points 1 and 3 have no text."""
+    payloads = [
+        {"page_content": "" if i in EMPTY_IDS else f"chunk {i}", "metadata": {"source_pdf": "a.pdf", "page": i}}
+        for i in range(10)
+    ]
+    vectors = [[1.0, 0.1 * i, 0.0, 0.0] for i in range(10)]
+    qclient = QdrantClient(":memory:")
+    build_collection(qclient, COLLECTION, payloads, vectors)
+    return qclient
+
+
+def test_skips_empty_payloads_and_fetches_more():
+    """Empty payloads are skipped and further ids fetched until k docs"""
+    docs, metrics = two_phase_search(_client(), COLLECTION, QUERY, k=3, top_n=10)
+    assert [d["id"] for d in docs] == [0, 2, 4], docs
+    assert [d["page_content"] for d in docs] == ["chunk 0", "chunk 2", "chunk 4"]
+    assert docs[1]["metadata"] == {"source_pdf": "a.pdf", "page": 2}
+    assert docs[0]["score"] > docs[1]["score"] > docs[2]["score"]
+    # [0, 1, 2] -> 2 docs, [3] -> none, [4] -> 1 doc; ids 5..9 never leave Qdrant.
+    assert metrics["candidates"] == 10
+    assert metrics["payload_calls"] == 3
+    assert metrics["payloads_fetched"] == 5
+    assert metrics["payload_bytes"] > 0 and metrics["payload_bytes_saved_est"] > 0
+
+
+def test_reorder_decides_which_payloads_are_fetched():
+    """reorder() runs before phase 2: docs follow its order and keep the vector scores"""
+    seen = []
+
+    def _reverse(hits):
+        seen.extend(hits)
+        return list(reversed(hits))
+
+    docs, metrics = two_phase_search(_client(), COLLECTION, QUERY, k=3, top_n=10, reorder=_reverse)
+    assert [pid for pid, _ in seen] == list(range(10))
+    assert [d["id"] for d in docs] == [9, 8, 7], docs
+    scores = dict(seen)
+    assert all(d["score"] == scores[d["id"]] for d in docs)
+    assert metrics["payload_calls"] == 1 and metrics["payloads_fetched"] == 3
+
+
+def test_top_n_below_k_and_short_candidate_list():
+    """top_n below k still searches k; fewer usable hits than k returns what exists"""
+    docs, metrics = two_phase_search(_client(), COLLECTION, QUERY, k=4, top_n=1)
+    assert metrics["candidates"] == 4
+    assert [d["id"] for d in docs] == [0, 2]
+
+    docs, metrics = fetch_docs(_client(), COLLECTION, [(1, 0.9), (3, 0.8)], k=2)
+    assert docs == [] and metrics["payloads_fetched"] == 2
+
+
+def test_dedup_hits():
+    """dedup_hits keeps the first occurrence and drops missing ids"""
+    assert dedup_hits([(1, 0.9), (None, 0.8), (2, 0.7), (1, 0.5)]) == [(1, 0.9), (2, 0.7)]
+
+
+
+class _QueryEmbedder:
+    def __init__(self, model):
+        pass
+
+    def encode_query(self, query):
+        return QUERY
+
+    def fit_to_collection(self, qvec, info):
+        return qvec
+
+
+def test_rag_query_searches_an_aliased_collection_once(monkeypatch, capsys):
+    """A collection requested by name and by alias is searched once and its hits are not doubled"""
+    qclient = _client()
+    qclient.update_collection_aliases(change_aliases_operations=[
+        models.CreateAliasOperation(create_alias=models.CreateAlias(
+            collection_name=COLLECTION, alias_name="libros")),
+    ])
+    searched = []
+    real_query_points = qclient.query_points
+
+    def _query_points(collection_name, **kwargs):
+        searched.append(collection_name)
+        return real_query_points(collection_name=collection_name, **kwargs)
+
+    monkeypatch.setattr(qclient, "query_points", _query_points)
+    answer = SimpleNamespace(generate_content=lambda model, contents: SimpleNamespace(text="respuesta [1]"))
+    monkeypatch.setattr(rag_query, "QdrantClient", lambda *a, **kw: qclient)
+    monkeypatch.setattr(rag_query, "Embedder", _QueryEmbedder)
+    monkeypatch.setattr(rag_query, "genai", SimpleNamespace(Client=lambda **kw: SimpleNamespace(models=answer)))
+    monkeypatch.setenv("QDRANT_URL", "http://test.local")
+    monkeypatch.setenv("QDRANT_API_KEY", "test")
+    monkeypatch.setenv("GEMINI_API_KEY", "test")
+    monkeypatch.setattr(sys, "stdin", io.StringIO(json.dumps(
+        {"collections": ["libros", COLLECTION], "query": "ansiedad", "k": 3})))
+
+    assert rag_query.main() == 0
+    out = json.loads(capsys.readouterr().out.strip().splitlines()[-1])
+    assert out["ok"], out
+    assert searched == [COLLECTION]
+    assert out["metrics"]["retrieval"]["resolved_collections"] == {"libros": COLLECTION, COLLECTION: COLLECTION}
+    assert [s["page"] for s in out["sources"]] == [0, 2, 4]
+    assert {s["collection"] for s in out["sources"]} == {"libros"}
@@ -47,7 +47,7 @@ def process_audio_complete(audio_path, model_size="small", language="es",
     
     # PASO 1: Transcripción
     print("\n" + "="*60)
-    print("PASO 1/3: TRANSCRIPCIÓN")
+    print("PASO 1/4: TRANSCRIPCIÓN")
     print("="*60 + "\n")
     
     transcription = transcribe_audio(audio_path, model_size, language, output_dir)
@@ -55,7 +55,7 @@ def process_audio_complete(audio_path, model_size="small", language="es",
     
     # PASO 2: Diarización y etiquetado
     print("\n" + "="*60)
-    print("PASO 2/3: DIARIZACIÓN Y ETIQUETADO")
+    print("PASO 2/4: DIARIZACIÓN Y ETIQUETADO")
     print("="*60 + "\n")
     
     labeled_segments = diarize_and_label(audio_path, transcription_json, output_dir)
@@ -64,18 +64,35 @@ def process_audio_complete(audio_path, model_size="small", language="es",
     # PASO 3: Identificación (si hay audios de referencia)
     if os.path.exists(refs_dir) and any(Path(refs_dir).glob("*.wav")):
         print("\n" + "="*60)
-        print("PASO 3/3: IDENTIFICACIÓN DE HABLANTES")
+        print("PASO 3/4: IDENTIFICACIÓN DE HABLANTES")
         print("="*60 + "\n")
         
         speaker_mapping = identify_speakers(labeled_json, audio_path, refs_dir, threshold, output_dir)
     else:
         print("\n" + "="*60)
-        print("PASO 3/3: IDENTIFICACIÓN (OMITIDO)")
+        print("PASO 3/4: IDENTIFICACIÓN (OMITIDO)")
         print("="*60)
         print(f"\nNo se encontraron audios de referencia en '{refs_dir}'")
         print("  Para identificar hablantes, coloca archivos WAV en esa carpeta con nombres descriptivos")
         print("  Ejemplo: refs/psicologo.wav, refs/paciente.wav")
     
+    # PASO 4: Índice semántico del paciente (no debe tumbar el pipeline si falla)
+    print("\n" + "="*60)
+    print("PASO 4/4: ÍNDICE SEMÁNTICO DE SESIONES")
+    print("="*60 + "\n")
+    
+    try:
+        tools_dir = str(PROJECT_ROOT / "tools")
+        if tools_dir not in sys.path:
+            sys.path.append(tools_dir)
+        from session_index import patient_dir_for, update_patient_index
+        
+        patient_dir, _ = patient_dir_for(output_dir)
+        summary = update_patient_index(patient_dir)
+        print(f"✓ Índice actualizado: {summary['turns']} turnos, sesiones reindexadas: {summary['reindexed'] or 'ninguna'}")
+    except Exception as e:
+        print(f"⚠ Advertencia: no se pudo actualizar el índice semántico: {e}")
+    
     # Resumen final
     print("\n" + "="*60)
     print("PROCESO COMPLETADO")